@@ -0,0 +1,424 @@
+# aio_app.py
+# 非同期（asyncio / aiohttp）サービングモード
+#
+#   gunicorn aio_app:create_app --worker-class aiohttp.GunicornWebWorker
+#   もしくは  python aio_app.py
+#
+# /webhook, /api/me, /api/scores をイベントループ上で処理する。
+# 外部 I/O（LINE, Vision, OpenAI, MusicBrainz, Supabase）は全て非同期クライアント経由。
+# テキスト・友だち追加イベントは既存の同期ハンドラをスレッドに逃がして再利用する。
+
+import os
+import time
+import asyncio
+import logging
+import httpx
+from aiohttp import web
+from linebot.v3 import WebhookParser
+from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.webhooks import MessageEvent, FollowEvent, TextMessageContent
+from linebot.v3.messaging import AsyncApiClient, AsyncMessagingApi
+from linebot.v3.messaging.models import ReplyMessageRequest, TextMessage
+
+import app as sync_app
+from supabase_client import get_async_supabase, get_async_supabase_read, async_reader, mark_written
+from utils.auth import verify_id_token
+from routes.scores import (
+    parse_scores_params, build_scores_query, build_version_query,
+    score_version, compute_etag, build_page
+)
+from utils.user_code import with_unique_user_code_async
+from utils.stats import build_user_stats_message_async
+from utils.gpt_parser import parse_text_with_gpt_async
+from utils.musicbrainz import search_artist_in_musicbrainz_async
+from utils.metrics import timed, observe, render, is_scrape_authorized, CONTENT_TYPE
+from utils.tracing import start_trace
+from utils import (
+    write_behind, profile_cache, song_stats, cost_meter, singleflight, score_series, ocr_backends,
+    group_session,
+)
+from utils.resilience import CircuitOpenError
+from utils import profiler
+
+LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
+parser = WebhookParser(os.getenv("LINE_CHANNEL_SECRET"))
+
+HTTP_CLIENT = web.AppKey("http_client", httpx.AsyncClient)
+LINE_API_CLIENT = web.AppKey("line_api_client", AsyncApiClient)
+
+
+# --- イベント処理 ---
+async def handle_event(app, event):
+    # トレースはタスク内の await 先・to_thread 先に引き継がれる
+    with start_trace(event):
+        if isinstance(event, FollowEvent):
+            await asyncio.to_thread(sync_app.handle_follow, event)
+        elif isinstance(event, MessageEvent):
+            msg = event.message
+            if hasattr(msg, "content_provider") and msg.content_provider.type != "none":
+                with timed("image_total"):
+                    await handle_image(app, event)
+            elif isinstance(msg, TextMessageContent):
+                await asyncio.to_thread(sync_app.handle_text, event)
+
+async def handle_image(app, event):
+    # 手順は app._process_image と同じ（共通部分は app の関数を使い、I/O だけを await する）
+    messaging_api = AsyncMessagingApi(app[LINE_API_CLIENT])
+    calls = {"vision": 0, "openai": 0, "musicbrainz": 0}
+    try:
+        user_id = event.source.user_id
+        if sync_app._is_rate_limited(user_id):
+            await _reply(messaging_api, event.reply_token, sync_app.RATE_LIMIT_MESSAGE)
+            return
+
+        # 予算の消化状況で処理の段階を決める（utils/cost_meter.py）
+        with timed("cost_meter"):
+            tier = await asyncio.to_thread(cost_meter.tier_for, user_id)
+        # グループ・トークルームで大会が開催中なら順位表を返す（utils/group_session.py）
+        source = group_session.source_of(event)
+        source_id = source[1] if source else None
+
+        # 画像取得（一時ファイルを経由せずメモリ上で扱う）
+        with timed("content_download"):
+            resp = await app[HTTP_CLIENT].get(
+                f"{sync_app.LINE_API_DATA_ENDPOINT}/v2/bot/message/{event.message.id}/content",
+                headers={"Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}"}
+            )
+            resp.raise_for_status()
+
+        if tier == cost_meter.DEFERRED:
+            reply = await asyncio.to_thread(sync_app._defer_image, user_id, event.message.id, resp.content)
+            await _reply(messaging_api, event.reply_token, reply)
+            return
+
+        # OCR（Vision が使えない・遅い時はローカルのエンジン。utils/ocr_backends.py）
+        try:
+            ocr = await ocr_backends.recognize_async(resp.content, need_text=tier != cost_meter.TEMPLATE)
+        except Exception as e:
+            if ocr_backends.vision_called(e):
+                calls["vision"] += 1
+            raise
+        if ocr.vision_called:
+            calls["vision"] += 1
+        score, error = sync_app._read_score(user_id, ocr)
+        if error:
+            await _reply(messaging_api, event.reply_token, error)
+            return
+
+        # LINE プロフィールを取る必要がある時は GPT 構造化と並行実行
+        gpt_input = sync_app._gpt_input(tier, ocr)
+        if gpt_input is not None:
+            calls["openai"] += 1
+            gpt = _timed("gpt", parse_text_with_gpt_async(gpt_input))
+        else:
+            gpt = _template_parse()
+        user_name = profile_cache.cached_display_name(user_id)
+        if sync_app._needs_profile_fetch(user_name):
+            parsed, user_name = await asyncio.gather(gpt, _timed("line_profile", _fetch_display_name(messaging_api, user_id)))
+        else:
+            parsed = await gpt
+
+        mb_result = None
+        if sync_app._wants_enrichment(tier, parsed):
+            with timed("musicbrainz"):
+                calls["musicbrainz"] += 1
+                mb_result = await search_artist_in_musicbrainz_async(parsed["artist_name"], app[HTTP_CLIENT])
+
+        score_row = sync_app._build_score_row(score, parsed, mb_result)
+        headline = await _song_headline(user_id, score_row)
+        if write_behind.ENABLED:
+            # ジャーナルの fsync と成績の読み出しは同期版をスレッドで使う
+            with timed("write_behind_submit"):
+                await asyncio.to_thread(write_behind.submit_score, user_id, user_name, score_row)
+            standings = sync_app._session_standings(source_id, user_id, user_name, score_row)
+            with timed("stats"):
+                stats = standings or await asyncio.to_thread(write_behind.build_user_stats_message, user_id)
+        else:
+            user_name = await _store_score(messaging_api, user_id, user_name, score_row)
+            standings = sync_app._session_standings(source_id, user_id, user_name, score_row)
+            with timed("stats"):
+                stats = standings or await build_user_stats_message_async(user_id)
+        sync_app._archive_registered(user_id, ocr, score_row)
+        await _reply(messaging_api, event.reply_token, sync_app._registration_reply(score_row, tier, ocr, headline, stats))
+
+    except CircuitOpenError as e:
+        logging.warning(f"⏭️ {e}（画像処理を中止）")
+        await _reply(messaging_api, event.reply_token, sync_app.VISION_UNAVAILABLE_MESSAGE)
+    except Exception as e:
+        logging.exception(f"❌ Image processing error: {e}")
+        await _reply(messaging_api, event.reply_token, sync_app.IMAGE_ERROR_MESSAGE)
+    finally:
+        cost_meter.record(event.source.user_id, calls)
+
+
+async def _template_parse():
+    return sync_app._template_parse()
+
+
+async def _fetch_display_name(messaging_api, user_id):
+    profile = await messaging_api.get_profile(user_id)
+    user_name = profile.display_name or "unknown"
+    profile_cache.put(user_id, user_name)
+    return user_name
+
+
+async def _song_headline(user_id, score_row):
+    try:
+        with timed("song_stats"):
+            before = await song_stats.get_song_stats_async(user_id, score_row["song_name"])
+        return sync_app._format_headline(user_id, before, score_row)
+    except Exception as e:
+        logging.warning(f"⚠️ 曲ごとの集計の取得に失敗: {e}")
+        return None
+
+
+async def _store_score(messaging_api, user_id, user_name, score_row):
+    # Supabase: ユーザー情報更新・登録（登録に使った表示名を返す）
+    db = await get_async_supabase()
+    with timed("supabase_user"):
+        u_resp = await db.table("users").select("score_count,user_code,name").eq("id", user_id).maybe_single().execute()
+        u = (u_resp.data if u_resp else None) or {}
+    if user_name is None:
+        user_name = sync_app._name_from_user_row(user_id, u)
+    if user_name is None:
+        with timed("line_profile"):
+            user_name = await _fetch_display_name(messaging_api, user_id)
+    with timed("supabase_user"):
+        async def upsert_user(code):
+            return await db.table("users").upsert(sync_app._user_row(user_id, u, user_name, score_row, code)).execute()
+        await with_unique_user_code_async(user_id, upsert_user)
+
+    # スコア登録
+    with timed("supabase_score"):
+        await db.table("scores").insert({"user_id": user_id, **score_row}).execute()
+    mark_written(user_id)
+
+    # 平均スコア更新
+    try:
+        logging.info(f"📣 平均スコア更新を開始します（user_id={user_id}）")
+        with timed("supabase_rating"):
+            response = await db.rpc("update_average_score", {"p_user_id": user_id}).execute()
+        logging.info(f"✅ 平均スコア更新成功: {response}")
+    except Exception as e:
+        logging.error(f"❌ 平均スコア更新に失敗: {e}")
+    return user_name
+
+
+# --- ルート定義 ---
+async def index(request):
+    return web.Response(text="✅ aiohttp x LINE Bot is running!")
+
+async def webhook(request):
+    signature = request.headers.get("X-Line-Signature")
+    body = await request.text()
+    try:
+        events = parser.parse(body, signature)
+    except InvalidSignatureError:
+        raise web.HTTPBadRequest()
+
+    results = await asyncio.gather(
+        *(handle_event(request.app, event) for event in events),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logging.error(f"❌ Webhook error: {result}")
+            raise web.HTTPBadRequest()
+    return web.Response(text="OK")
+
+async def get_me(request):
+    user_info, error = _authenticate(request, "Invalid id_token")
+    if error:
+        return error
+    line_user_id = user_info["sub"]
+
+    db = await async_reader(line_user_id)
+    user = await singleflight.do_async(
+        ("me", line_user_id),
+        lambda: db.table("users").select("*").eq("id", line_user_id).maybe_single().execute()
+    )
+    if not user or not user.data:
+        return web.json_response({"error": "User not found"}, status=404)
+
+    return web.json_response({
+        "line_user_id": line_user_id,
+        "user_info": user_info,
+        "db_user": user.data
+    })
+
+async def get_scores(request):
+    user_info, error = _authenticate(request, "Invalid token")
+    if error:
+        return error
+    line_user_id = user_info["sub"]
+
+    try:
+        limit, cursor, fields = parse_scores_params(request.query)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    db = await async_reader(line_user_id)
+    version = await singleflight.do_async(
+        ("scores_version", line_user_id),
+        lambda: build_version_query(db.table("users"), line_user_id).execute()
+    )
+    etag = compute_etag(score_version(version.data), limit, cursor, fields)
+    if request.if_none_match and any(e.value == etag for e in request.if_none_match):
+        return web.Response(status=304, headers={"ETag": f'"{etag}"'})
+
+    scores = await singleflight.do_async(
+        ("scores_page", line_user_id, limit, cursor, tuple(fields or ())),
+        lambda: build_scores_query(db.table("scores"), line_user_id, limit, cursor, fields).execute()
+    )
+
+    return web.json_response(build_page(line_user_id, scores.data, limit), headers={
+        "ETag": f'"{etag}"',
+        "Cache-Control": "private, no-cache"
+    })
+
+async def get_score_series(request):
+    user_info, error = _authenticate(request, "Invalid token")
+    if error:
+        return error
+    line_user_id = user_info["sub"]
+
+    try:
+        points = score_series.parse_points(request.query)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    db = await async_reader(line_user_id)
+    current = await singleflight.do_async(
+        ("scores_version", line_user_id),
+        lambda: build_version_query(db.table("users"), line_user_id).execute()
+    )
+    version = score_version(current.data)
+    etag = score_series.compute_etag(version, points)
+    if request.if_none_match and any(e.value == etag for e in request.if_none_match):
+        return web.Response(status=304, headers={"ETag": f'"{etag}"'})
+
+    # 間引きは NumPy のループなのでスレッドで行う
+    series = await asyncio.to_thread(score_series.cached_series, line_user_id, version, points)
+    if series is None:
+        history = await singleflight.do_async(("score_history", line_user_id),
+                                              lambda: score_series.load_history_async(db, line_user_id))
+        series = await asyncio.to_thread(score_series.store_series, line_user_id, version, history, points)
+
+    return web.json_response(series, headers={
+        "ETag": f'"{etag}"',
+        "Cache-Control": "private, no-cache"
+    })
+
+
+async def get_metrics(request):
+    if not is_scrape_authorized(request.headers.get("Authorization")):
+        return web.Response(status=401, text="Unauthorized\n")
+    return web.Response(body=render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+# --- プロファイラ（routes/debug.py と同じ仕様） ---
+async def profiler_status(request):
+    return web.json_response(profiler.status())
+
+async def profiler_start(request):
+    try:
+        interval = float(request.query.get("interval_ms", profiler.DEFAULT_INTERVAL * 1000)) / 1000
+        duration = float(request.query.get("duration_s", profiler.MAX_DURATION))
+    except ValueError:
+        return web.json_response({"error": "interval_ms and duration_s must be numbers"}, status=400)
+    return web.json_response(profiler.start(interval, duration))
+
+async def profiler_stop(request):
+    return web.json_response(await asyncio.to_thread(profiler.stop))
+
+async def profiler_collapsed(request):
+    try:
+        limit = int(request.query["limit"]) if "limit" in request.query else None
+    except ValueError:
+        return web.json_response({"error": "limit must be an integer"}, status=400)
+    return web.Response(text=profiler.collapsed(limit))
+
+@web.middleware
+async def debug_auth_middleware(request, handler):
+    # DEBUG_TOKEN 未設定・不一致ではエンドポイントの存在自体を見せない
+    if request.path.startswith("/debug/") and \
+            not profiler.is_authorized(request.headers.get("Authorization")):
+        raise web.HTTPNotFound()
+    return await handler(request)
+
+
+# --- ヘルパー ---
+def _authenticate(request, error_prefix):
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None, web.json_response({"error": "Missing or invalid Authorization header"}, status=401)
+    try:
+        return verify_id_token(auth_header.split(" ")[1]), None
+    except Exception as e:
+        return None, web.json_response({"error": f"{error_prefix}: {str(e)}"}, status=401)
+
+async def _reply(messaging_api, token, text):
+    with timed("line_reply"):
+        await messaging_api.reply_message(
+            ReplyMessageRequest(reply_token=token, messages=[TextMessage(text=text)])
+        )
+
+async def _timed(stage, coro):
+    with timed(stage):
+        return await coro
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    started = time.perf_counter()
+    response = await handler(request)
+    route = request.match_info.route.resource
+    if route is not None:
+        observe("http_request_seconds", time.perf_counter() - started,
+                route=route.canonical, method=request.method, status=response.status)
+    return response
+
+@web.middleware
+async def cors_middleware(request, handler):
+    # Flask 側の CORS(app) と同じく全オリジンを許可
+    if request.method == "OPTIONS":
+        response = web.Response()
+        response.headers["Access-Control-Allow-Headers"] = request.headers.get(
+            "Access-Control-Request-Headers", "*"
+        )
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+    else:
+        response = await handler(request)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+async def _on_startup(app):
+    # クライアントはイベントループ上で生成し、接続を使い回す
+    app[HTTP_CLIENT] = httpx.AsyncClient()
+    app[LINE_API_CLIENT] = AsyncApiClient(sync_app.line_configuration())
+    await get_async_supabase()
+    await get_async_supabase_read()
+
+async def _on_cleanup(app):
+    await app[HTTP_CLIENT].aclose()
+    await app[LINE_API_CLIENT].close()
+
+
+async def create_app():
+    app = web.Application(middlewares=[cors_middleware, metrics_middleware, debug_auth_middleware])
+    app.router.add_get("/", index)
+    app.router.add_post("/webhook", webhook)
+    app.router.add_get("/api/me", get_me)
+    app.router.add_get("/api/scores", get_scores)
+    app.router.add_get("/api/scores/series", get_score_series)
+    app.router.add_get("/metrics", get_metrics)
+    app.router.add_get("/debug/profiler", profiler_status)
+    app.router.add_post("/debug/profiler/start", profiler_start)
+    app.router.add_post("/debug/profiler/stop", profiler_stop)
+    app.router.add_get("/debug/profiler/collapsed", profiler_collapsed)
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
@@ -1,46 +1,50 @@
 import os
 import time
+import uuid
 import logging
 from datetime import datetime
-from flask import Flask, request, abort
-from dotenv import load_dotenv
-from google.cloud import vision
-from supabase_client import supabase
+import config  # noqa: F401  .env の読み込み（環境変数を参照するモジュールより先に）
+from flask import Flask, request, abort, g
+from supabase_client import supabase, mark_written
 from routes.login import login_bp
 from routes.api import api_bp
 from routes.scores import scores_bp
+from routes.stats import stats_bp
+from routes.leaderboard import leaderboard_bp
+from routes.score_io import score_io_bp
+from routes.metrics import metrics_bp
+from routes.debug import debug_bp
+from routes.usage import usage_bp
 from linebot.v3 import WebhookHandler
 from linebot.v3.webhooks import MessageEvent, FollowEvent, TextMessageContent
-from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
-from linebot.v3.messaging.models import ReplyMessageRequest, TextMessage
-from linebot.exceptions import InvalidSignatureError
-from linebot import LineBotApi
-from uuid import UUID
+from linebot.v3.exceptions import InvalidSignatureError
 from utils.field_map import get_supabase_field
-from utils.user_code import generate_unique_user_code
+from utils.user_code import with_unique_user_code
 from utils.stats import build_user_stats_message
-from utils.onboarding import handle_user_onboarding
 from utils.gpt_parser import parse_text_with_gpt
-from utils.richmenu import create_and_link_rich_menu
 from utils.ocr_utils import _extract_score, validate_score_range
 from utils.musicbrainz import search_artist_in_musicbrainz
-from utils.correction import is_correction_trigger
-from utils.correction_ui import (
-    send_correction_form,
-    set_temp_value,
-    get_temp_value,
-    clear_temp_value
+from utils.metrics import timed, observe
+from utils.tracing import traced, install_log_filter
+from utils import (
+    write_behind, profile_cache, ocr_archive, song_stats, cost_meter, ocr_backends, group_session, weekly_summary
 )
+from utils.resilience import CircuitOpenError
 from flask_cors import CORS
-# --- 環境変数読み込み ---
-env_file = os.getenv("ENV_FILE", ".env.dev")
-load_dotenv(dotenv_path=env_file)
+# LINE Messaging API（v3 messaging / v2）・Vision・OpenAI の SDK とクライアントは
+# 起動を軽くするため初回使用時に読み込む（scripts/import_cost.py で計測）
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 # --- Flask アプリケーション ---
 app = Flask(__name__)
 app.register_blueprint(login_bp)
 app.register_blueprint(api_bp)
 app.register_blueprint(scores_bp)
+app.register_blueprint(stats_bp)
+app.register_blueprint(leaderboard_bp)
+app.register_blueprint(score_io_bp)
+app.register_blueprint(metrics_bp)
+app.register_blueprint(debug_bp)
+app.register_blueprint(usage_bp)
 CORS(app)
 
 
@@ -48,13 +52,72 @@ CORS(app)
 # --- ロギング設定 ---
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
 logging.basicConfig(level=logging.DEBUG if DEBUG else logging.INFO,
-                    format="%(asctime)s [%(levelname)s] %(message)s")
+                    format="%(asctime)s [%(levelname)s] [%(trace_id)s] %(message)s")
+# 同じ Webhook イベントのログ行を trace_id（= webhookEventId）で結び付ける
+install_log_filter()
+
+# WRITE_BEHIND=1 の時はスコア登録をまとめて書き込む（前回落ちたワーカーのジャーナルもここで再送）
+if write_behind.ENABLED:
+    write_behind.start()
 
 # --- LINE SDK v3 初期化 ---
-configuration = Configuration(access_token=os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
+# 負荷試験ではローカルのスタンドインに向けられるよう接続先を上書き可能にする
+LINE_API_ENDPOINT = os.getenv("LINE_API_ENDPOINT", "https://api.line.me")
+LINE_API_DATA_ENDPOINT = os.getenv("LINE_API_DATA_ENDPOINT", "https://api-data.line.me")
 handler = WebhookHandler(os.getenv("LINE_CHANNEL_SECRET"))
-line_bot_api_v2 = LineBotApi(os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
 user_send_history = {}
+RATE_LIMIT_MESSAGE = "⚠️ 一度に送れる画像は最大2枚までです。"
+IMAGE_ERROR_MESSAGE = "❌ 画像処理に失敗しました。再送信してください。"
+STATS_ERROR_MESSAGE = "⚠️ 成績情報取得失敗"
+# 画像認識（Vision）の回路が開いている間の返信
+VISION_UNAVAILABLE_MESSAGE = "⚠️ 現在、画像の読み取りが混み合っています。しばらくしてから再送信してください。"
+# 予算に応じた縮退時の返信（utils/cost_meter.py）
+TEMPLATE_NOTE = "ℹ️ 混雑のため曲名・アーティストは自動入力していません。「修正」で入力できます。"
+DEFERRED_MESSAGE = "📥 混雑のため画像の受け付けのみ行いました。順番に登録し、結果はあとでお知らせします。"
+DEFERRED_FULL_MESSAGE = "⚠️ 現在、受け付けられる画像の上限に達しています。時間をおいて再送信してください。"
+
+_configuration = None
+_line_bot_api_v2 = None
+
+def line_configuration():
+    global _configuration
+    if _configuration is None:
+        from linebot.v3.messaging import Configuration
+        _configuration = Configuration(host=LINE_API_ENDPOINT, access_token=os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
+    return _configuration
+
+def _fetch_display_name(user_id):
+    from linebot.v3.messaging import ApiClient, MessagingApi
+    with ApiClient(line_configuration()) as api_client:
+        return MessagingApi(api_client).get_profile(user_id).display_name or "unknown"
+
+# 表示名が古くなったら裏で取り直す
+profile_cache.set_refresher(_fetch_display_name)
+
+def line_bot_api_v2():
+    # 画像コンテンツ取得用（v3 の MessagingApiBlob は接続先を上書きできないため v2 を使う）
+    global _line_bot_api_v2
+    if _line_bot_api_v2 is None:
+        from linebot import LineBotApi
+        _line_bot_api_v2 = LineBotApi(
+            os.getenv("LINE_CHANNEL_ACCESS_TOKEN"),
+            endpoint=LINE_API_ENDPOINT,
+            data_endpoint=LINE_API_DATA_ENDPOINT
+        )
+    return _line_bot_api_v2
+
+# --- REST API の処理時間計測 ---
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _observe_request(response):
+    started = g.pop("request_started", None)
+    if started is not None and request.url_rule is not None:
+        observe("http_request_seconds", time.perf_counter() - started,
+                route=request.url_rule.rule, method=request.method, status=response.status_code)
+    return response
 
 # --- ルート定義 ---
 @app.route("/", methods=["GET"])
@@ -63,6 +126,7 @@ def index():
 
 @app.route("/create-richmenu", methods=["GET"])
 def create_richmenu():
+    from utils.richmenu import create_and_link_rich_menu
     try:
         menu_id = create_and_link_rich_menu()
         return f"✅ リッチメニュー作成成功｜ID: {menu_id}"
@@ -86,12 +150,15 @@ def webhook():
 
 # --- イベント処理 ---
 @handler.add(FollowEvent)
+@traced
 def handle_follow(event):
+    from linebot.v3.messaging import ApiClient, MessagingApi
+    from utils.onboarding import handle_user_onboarding
     user_id = event.source.user_id
-    with ApiClient(configuration) as api_client:
+    with ApiClient(line_configuration()) as api_client:
         messaging_api = MessagingApi(api_client)
-        profile = messaging_api.get_profile(user_id)
-        name = profile.display_name or "unknown"
+        with timed("line_profile"):
+            name = profile_cache.get_display_name(user_id, _fetch_display_name)
         handle_user_onboarding(
             line_sub=user_id,
             user_name=name,
@@ -100,149 +167,327 @@ def handle_follow(event):
         )
 
 @handler.add(MessageEvent)
+@traced
 def handle_event(event):
     msg = event.message
     if hasattr(msg, "content_provider") and msg.content_provider.type != "none":
-        handle_image(event)
+        with timed("image_total"):
+            handle_image(event)
     elif isinstance(msg, TextMessageContent):
         handle_text(event)
 
 def handle_image(event):
-    image_path = None
     try:
         user_id = event.source.user_id
-        now_ts = time.time()
-        history = user_send_history.setdefault(user_id, [])
-        history[:] = [t for t in history if now_ts - t < 80]
-        history.append(now_ts)
-        if len(history) > 5:
-            _reply(event.reply_token, "⚠️ 一度に送れる画像は最大2枚までです。")
+        if _is_rate_limited(user_id):
+            _reply(event.reply_token, RATE_LIMIT_MESSAGE)
             return
 
-        # 画像保存
-        content = line_bot_api_v2.get_message_content(event.message.id)
-        image_path = f"/tmp/{event.message.id}.jpg"
-        with open(image_path, "wb") as f:
-            for chunk in content.iter_content():
-                f.write(chunk)
+        # 予算の消化状況で処理の段階を決める（utils/cost_meter.py）
+        with timed("cost_meter"):
+            tier = cost_meter.tier_for(user_id)
 
-        # OCR
-        client = vision.ImageAnnotatorClient()
-        with open(image_path, "rb") as f:
-            texts = client.text_detection(image=vision.Image(content=f.read())).text_annotations
+        # 画像取得
+        with timed("content_download"):
+            content = b"".join(line_bot_api_v2().get_message_content(event.message.id).iter_content())
 
-        score = _extract_score(texts)
-        parsed = parse_text_with_gpt(texts[0].description if texts else "")
-        parsed["score"] = score
-
-        if score is None:
-            _reply(event.reply_token, "⚠️ スコアが読み取れませんでした。画像を確認してください。")
-            return
-        if not validate_score_range(score):
-            _reply(event.reply_token, "⚠️ スコアは30.000以上100.000未満で入力してください。")
+        if tier == cost_meter.DEFERRED:
+            _reply(event.reply_token, _defer_image(user_id, event.message.id, content))
             return
+        source = group_session.source_of(event)
+        _reply(event.reply_token, process_image(user_id, content, tier, source_id=source[1] if source else None))
 
-        now_iso = datetime.utcnow().isoformat()
-        artist_name = parsed.get("artist_name")
-        mb_result = search_artist_in_musicbrainz(artist_name) if artist_name else None
-        musicbrainz_id = mb_result.get("musicbrainz_id") if mb_result else None
-        artist_name_normalized = mb_result.get("name_normalized") if mb_result else None
-        genre_tags = mb_result.get("genre_tags") if mb_result else []
-
-        # LINEユーザー情報取得
-        with ApiClient(configuration) as api_client:
-            messaging_api = MessagingApi(api_client)
-            profile = messaging_api.get_profile(user_id)
-            user_name = profile.display_name or "unknown"
-
-        # Supabase: ユーザー情報更新・登録
-        u = supabase.table("users").select("score_count,user_code").eq("id", user_id).maybe_single().execute().data or {}
-        supabase.table("users").upsert({
-            "id": user_id,
-            "name": user_name,
-            "user_code": u.get("user_code") or generate_unique_user_code(),
-            "score_count": (u.get("score_count") or 0) + 1,
-            "last_score_at": now_iso
-        }).execute()
-
-        # スコア登録
-        supabase.table("scores").insert({
-            "user_id": user_id,
-            "score": score,
-            "song_name": parsed.get("song_name"),
-            "artist_name": artist_name,
-            "artist_name_normalized": artist_name_normalized,
-            "musicbrainz_id": musicbrainz_id,
-            "genre_tags": genre_tags,
-            "comment": None,
-            "created_at": now_iso
-        }).execute()
-
-        # 平均スコア更新（UUID変換せず直接渡す）
-        try:
-            logging.info(f"📣 平均スコア更新を開始します（user_id={user_id}）")
-            response = supabase.rpc("update_average_score", {"p_user_id": user_id}).execute()
-            logging.info(f"✅ 平均スコア更新成功: {response}")
-        except Exception as e:
-            logging.error(f"❌ 平均スコア更新に失敗: {e}")
-        
-        # 成績メッセージ生成
-        stats = build_user_stats_message(user_id) or "⚠️ 成績情報取得失敗"
-        reply_text = (
-            f"✅ スコア登録完了！\n"
-            f"点数: {score}\n"
-            f"曲名: {parsed.get('song_name') or '---'}\n"
-            f"アーティスト: {artist_name_normalized or artist_name or '---'}\n\n"
-            f"{stats}"
-        )
-        _reply(event.reply_token, reply_text)
-
+    except CircuitOpenError as e:
+        logging.warning(f"⏭️ {e}（画像処理を中止）")
+        _reply(event.reply_token, VISION_UNAVAILABLE_MESSAGE)
     except Exception as e:
         logging.exception(f"❌ Image processing error: {e}")
-        _reply(event.reply_token, "❌ 画像処理に失敗しました。再送信してください。")
+        _reply(event.reply_token, IMAGE_ERROR_MESSAGE)
+
+
+def _defer_image(user_id, message_id, content):
+    with timed("cost_defer"):
+        queued = cost_meter.defer_image(user_id, message_id, content)
+    return DEFERRED_MESSAGE if queued else DEFERRED_FULL_MESSAGE
+
+
+def process_image(user_id, content, tier=cost_meter.FULL, source_id=None):
+    """
+    画像1枚を OCR → 構造化 → 登録し、返信文を返す（scripts/drain_deferred.py からも使う）。
+    tier が no_enrichment なら MusicBrainz を、template なら GPT も使わない。
+    source_id（グループ・トークルーム）で大会が開催中なら、成績の代わりに大会の順位表を返す
+    """
+    calls = {"vision": 0, "openai": 0, "musicbrainz": 0}
+    try:
+        return _process_image(user_id, content, tier, calls, source_id)
     finally:
-        if image_path and os.path.exists(image_path):
-            os.remove(image_path)
+        cost_meter.record(user_id, calls)
+
+
+def _process_image(user_id, content, tier, calls, source_id=None):
+    # OCR（Vision が使えない・遅い時はローカルのエンジン。utils/ocr_backends.py）
+    try:
+        ocr = ocr_backends.recognize(content, need_text=tier != cost_meter.TEMPLATE)
+    except Exception as e:
+        if ocr_backends.vision_called(e):
+            calls["vision"] += 1
+        raise
+    if ocr.vision_called:
+        calls["vision"] += 1
+    score, error = _read_score(user_id, ocr)
+    if error:
+        return error
+
+    gpt_input = _gpt_input(tier, ocr)
+    if gpt_input is not None:
+        with timed("gpt"):
+            calls["openai"] += 1
+            parsed = parse_text_with_gpt(gpt_input)
+    else:
+        parsed = _template_parse()
+
+    mb_result = None
+    if _wants_enrichment(tier, parsed):
+        with timed("musicbrainz"):
+            calls["musicbrainz"] += 1
+            mb_result = search_artist_in_musicbrainz(parsed["artist_name"])
+
+    # LINEユーザー情報（キャッシュ。無ければ _store_score の users の読み出しで DB の名前を使う）
+    with timed("line_profile"):
+        user_name = profile_cache.cached_display_name(user_id)
+        if _needs_profile_fetch(user_name):
+            user_name = profile_cache.get_display_name(user_id, _fetch_display_name)
+
+    score_row = _build_score_row(score, parsed, mb_result)
+    headline = _song_headline(user_id, score_row)
+    if write_behind.ENABLED:
+        # 書き込みはまとめて後で行い、成績は未書き込み分を足してローカルで計算する
+        with timed("write_behind_submit"):
+            write_behind.submit_score(user_id, user_name, score_row)
+        standings = _session_standings(source_id, user_id, user_name, score_row)
+        with timed("stats"):
+            stats = standings or write_behind.build_user_stats_message(user_id)
+    else:
+        user_name = _store_score(user_id, user_name, score_row)
+        standings = _session_standings(source_id, user_id, user_name, score_row)
+        with timed("stats"):
+            stats = standings or build_user_stats_message(user_id)
+    _archive_registered(user_id, ocr, score_row)
+    return _registration_reply(score_row, tier, ocr, headline, stats)
+
+
+# --- 画像1件の処理の共通部分（aio_app.handle_image も使う。I/O の呼び出し方だけを各モードで持つ） ---
+
+def _read_score(user_id, ocr):
+    """
+    OCR 結果から点数を取り出して検証する。(点数, None)、登録しない時は (None, 返信文)
+    """
+    score = _extract_score(ocr.response.text_annotations)
+    if score is not None and validate_score_range(score):
+        return score, None
+    # 登録しない画像も、抽出ロジックの改善後に読み直せるよう応答は残す
+    ocr_archive.save(user_id, None, ocr.response, {"score": score})
+    if score is None:
+        return None, "⚠️ スコアが読み取れませんでした。画像を確認してください。"
+    return None, "⚠️ スコアは30.000以上100.000未満で入力してください。"
+
+def _score_only(ocr):
+    # 点数しか読めないエンジンの結果なら、GPT は使わず template と同じ扱いにする
+    return not ocr_backends.get(ocr.engine).provides_text
+
+def _gpt_input(tier, ocr):
+    """
+    GPT に渡す全文。template 段階・点数だけの OCR 結果では GPT を使わない（None）
+    """
+    if tier == cost_meter.TEMPLATE or _score_only(ocr):
+        return None
+    texts = ocr.response.text_annotations
+    return texts[0].description if texts else ""
+
+def _template_parse():
+    # template 段階では GPT を呼ばず、曲名・アーティストは空のまま登録する
+    return {"song_name": None, "artist_name": None}
+
+def _wants_enrichment(tier, parsed):
+    return bool(parsed.get("artist_name")) and tier == cost_meter.FULL
+
+def _needs_profile_fetch(user_name):
+    # 書き込み遅延中は users を読まないため、キャッシュに無ければ LINE から取る
+    return user_name is None and write_behind.ENABLED
+
+def _name_from_user_row(user_id, u):
+    """
+    プロフィールがキャッシュに無い時は DB の名前を使い、LINE の最新値は裏で取り直す（DB にも無ければ None）
+    """
+    user_name = u.get("name")
+    if user_name:
+        profile_cache.put(user_id, user_name, refresh=True)
+    return user_name
+
+def _user_row(user_id, u, user_name, score_row, code):
+    row = {
+        "id": user_id,
+        "user_code": u.get("user_code") or code,
+        "score_count": (u.get("score_count") or 0) + 1,
+        "last_score_at": score_row["created_at"]
+    }
+    # 名前が変わっていなければ書かない
+    if user_name != u.get("name"):
+        row["name"] = user_name
+    return row
+
+def _build_score_row(score, parsed, mb_result):
+    return {
+        "client_id": str(uuid.uuid4()),
+        "score": score,
+        "song_name": parsed.get("song_name"),
+        "artist_name": parsed.get("artist_name"),
+        "artist_name_normalized": mb_result.get("name_normalized") if mb_result else None,
+        "musicbrainz_id": mb_result.get("musicbrainz_id") if mb_result else None,
+        "genre_tags": mb_result.get("genre_tags") if mb_result else [],
+        "comment": None,
+        "created_at": datetime.utcnow().isoformat()
+    }
+
+def _format_headline(user_id, before, score_row):
+    if write_behind.ENABLED:
+        before = song_stats.fold_pending(before, score_row["song_name"], write_behind.buffer.pending_for(user_id))
+    return song_stats.format_song_headline(before, score_row["score"], score_row["song_name"])
+
+def _archive_registered(user_id, ocr, score_row):
+    ocr_archive.save(user_id, score_row["client_id"], ocr.response, {
+        "score": score_row["score"], "song_name": score_row["song_name"], "artist_name": score_row["artist_name"]
+    })
+
+def _registration_reply(score_row, tier, ocr, headline, stats):
+    note = f"{TEMPLATE_NOTE}\n\n" if tier == cost_meter.TEMPLATE or _score_only(ocr) else ""
+    headline = f"{headline}\n\n" if headline else ""
+    return (
+        f"✅ スコア登録完了！\n"
+        f"点数: {score_row['score']}\n"
+        f"曲名: {score_row['song_name'] or '---'}\n"
+        f"アーティスト: {score_row['artist_name_normalized'] or score_row['artist_name'] or '---'}\n\n"
+        f"{note}"
+        f"{headline}"
+        f"{stats or STATS_ERROR_MESSAGE}"
+    )
+
+
+def _session_standings(source_id, user_id, user_name, score_row):
+    """
+    大会が開催中なら今回のスコアを足し込んだ順位表（utils/group_session.py）。開催中でなければ None
+    """
+    if source_id is None:
+        return None
+    with timed("group_session"):
+        return group_session.record_score(source_id, user_id, user_name, score_row)
+
+
+def _song_headline(user_id, score_row):
+    """
+    登録前の曲ごとの集計に今回のスコアを足した見出し（自己ベスト更新など）。取得に失敗しても登録は続ける
+    """
+    try:
+        with timed("song_stats"):
+            before = song_stats.get_song_stats(user_id, score_row["song_name"])
+        return _format_headline(user_id, before, score_row)
+    except Exception as e:
+        logging.warning(f"⚠️ 曲ごとの集計の取得に失敗: {e}")
+        return None
+
+
+def _store_score(user_id, user_name, score_row):
+    """
+    users の更新と scores の登録。登録に使った表示名を返す
+    """
+    # Supabase: ユーザー情報更新・登録
+    with timed("supabase_user"):
+        u_resp = supabase.table("users").select("score_count,user_code,name").eq("id", user_id).maybe_single().execute()
+        u = (u_resp.data if u_resp else None) or {}
+    if user_name is None:
+        user_name = _name_from_user_row(user_id, u)
+    if user_name is None:
+        with timed("line_profile"):
+            user_name = profile_cache.get_display_name(user_id, _fetch_display_name)
+    with timed("supabase_user"):
+        with_unique_user_code(
+            user_id, lambda code: supabase.table("users").upsert(_user_row(user_id, u, user_name, score_row, code)).execute()
+        )
+
+    # スコア登録
+    with timed("supabase_score"):
+        supabase.table("scores").insert({"user_id": user_id, **score_row}).execute()
+    mark_written(user_id)
+
+    # 平均スコア更新（UUID変換せず直接渡す）
+    try:
+        logging.info(f"📣 平均スコア更新を開始します（user_id={user_id}）")
+        with timed("supabase_rating"):
+            response = supabase.rpc("update_average_score", {"p_user_id": user_id}).execute()
+        logging.info(f"✅ 平均スコア更新成功: {response}")
+    except Exception as e:
+        logging.error(f"❌ 平均スコア更新に失敗: {e}")
+    return user_name
 
 
 # --- テキスト処理 ---
 @handler.add(MessageEvent, message=TextMessageContent)
+@traced
 def handle_text(event):
-    from linebot.v3.messaging.models import TextMessage as V3TextMessage
+    with timed("text_total"):
+        _handle_text(event)
+
+def _handle_text(event):
+    from linebot.v3.messaging import ApiClient, MessagingApi
+    from linebot.v3.messaging.models import ReplyMessageRequest, TextMessage as V3TextMessage
     from supabase_client import supabase
     from utils.ocr_utils import (
         is_correction_command, get_correction_menu,
         is_correction_field_selection, set_user_correction_step,
-        get_user_correction_step, clear_user_correction_step,
-        validate_score_range
+        clear_user_correction_step
+    )
+    from utils.correction_ui import get_correction_form
+    from utils.score_correction import (
+        FORM_COMMAND, COMPLETE_COMMAND, parse_inline_correction, coerce_correction_value,
+        apply_correction, format_correction_reply, get_correction_state,
+        start_correction_form, stage_correction_value, format_pending
     )
 
     user_id = event.source.user_id
     text = event.message.text.strip()
 
-    with ApiClient(configuration) as api_client:
+    with ApiClient(line_configuration()) as api_client:
         messaging_api = MessagingApi(api_client)
 
         try:
+            # グループの大会モード（開始・順位表・終了）
+            session_reply = group_session.handle_command(event, text)
+            if session_reply:
+                _reply_text(messaging_api, event.reply_token, session_reply)
+                return
+
             # 名前変更開始
             if text == "名前変更":
-                supabase.table("name_change_requests").upsert({
-                    "user_id": user_id,
-                    "waiting": True
-                }).execute()
-                messaging_api.reply_message(ReplyMessageRequest(
+                with timed("supabase_name_change"):
+                    supabase.table("name_change_requests").upsert({
+                        "user_id": user_id,
+                        "waiting": True
+                    }).execute()
+                _reply_message(messaging_api, ReplyMessageRequest(
                     reply_token=event.reply_token,
                     messages=[V3TextMessage(text="📝 新しい名前を入力してください")]
                 ))
                 return
 
             # 名前変更確定
-            name_req = supabase.table("name_change_requests").select("*").eq("user_id", user_id).maybe_single().execute()
+            with timed("supabase_name_change"):
+                name_req = supabase.table("name_change_requests").select("*").eq("user_id", user_id).maybe_single().execute()
             if name_req and name_req.data and name_req.data.get("waiting"):
                 new_name = text
-                supabase.table("users").update({"name": new_name}).eq("id", user_id).execute()
-                supabase.table("name_change_requests").delete().eq("user_id", user_id).execute()
-                messaging_api.reply_message(ReplyMessageRequest(
+                with timed("supabase_name_change"):
+                    supabase.table("users").update({"name": new_name}).eq("id", user_id).execute()
+                    supabase.table("name_change_requests").delete().eq("user_id", user_id).execute()
+                _reply_message(messaging_api, ReplyMessageRequest(
                     reply_token=event.reply_token,
                     messages=[V3TextMessage(text=f"✅ 名前を「{new_name}」に変更しました！")]
                 ))
@@ -251,23 +496,59 @@ def handle_text(event):
             # 成績確認
             if text == "成績確認":
                 try:
-                    stats_msg = build_user_stats_message(user_id)
-                    messaging_api.reply_message(ReplyMessageRequest(
+                    with timed("stats"):
+                        stats_msg = build_user_stats_message(user_id)
+                    _reply_message(messaging_api, ReplyMessageRequest(
                         reply_token=event.reply_token,
                         messages=[V3TextMessage(text=stats_msg)]
                     ))
                 except Exception:
                     logging.exception("❌ 成績確認の生成に失敗しました")
-                    messaging_api.reply_message(ReplyMessageRequest(
+                    _reply_message(messaging_api, ReplyMessageRequest(
                         reply_token=event.reply_token,
                         messages=[V3TextMessage(text="⚠️ 成績情報の取得に失敗しました。")]
                     ))
                 return
 
+            # 週次サマリーの個人の記録（配信のクイックリプライから。配信した週が付いてくる）
+            week = weekly_summary.parse_command(text)
+            if week is not None:
+                with timed("weekly_summary"):
+                    try:
+                        reply = weekly_summary.build_reply(user_id, week or None)
+                    except Exception:
+                        logging.exception("❌ 今週の記録の取得に失敗しました")
+                        reply = "⚠️ 記録の取得に失敗しました。"
+                _reply_text(messaging_api, event.reply_token, reply)
+                return
+
+            # 修正フォーム表示（複数項目を入力して「修正完了」でまとめて反映）
+            if text == FORM_COMMAND:
+                with timed("supabase_correction"):
+                    start_correction_form(user_id)
+                _reply_message(messaging_api, ReplyMessageRequest(
+                    reply_token=event.reply_token,
+                    messages=[get_correction_form()]
+                ))
+                return
+
+            # 1通でまとめて修正（例: 修正 曲名:〇〇 スコア:88.5）
+            try:
+                changes = parse_inline_correction(text)
+            except ValueError as e:
+                _reply_text(messaging_api, event.reply_token, str(e))
+                return
+            if changes:
+                with timed("supabase_correction"):
+                    row = apply_correction(user_id, changes)
+                _reply_text(messaging_api, event.reply_token,
+                            format_correction_reply(row) if row else "⚠️ 修正できるスコアがありません。")
+                return
+
             # 修正メニュー表示
             if is_correction_command(text):
                 clear_user_correction_step(user_id)
-                messaging_api.reply_message(ReplyMessageRequest(
+                _reply_message(messaging_api, ReplyMessageRequest(
                     reply_token=event.reply_token,
                     messages=[get_correction_menu()]
                 ))
@@ -276,73 +557,95 @@ def handle_text(event):
             # 修正項目選択
             if is_correction_field_selection(text):
                 set_user_correction_step(user_id, text)
-                messaging_api.reply_message(ReplyMessageRequest(
+                _reply_message(messaging_api, ReplyMessageRequest(
                     reply_token=event.reply_token,
                     messages=[V3TextMessage(text=f"📝 新しい {text} を入力してください")]
                 ))
                 return
 
             # 修正入力反映
-            field = get_user_correction_step(user_id)
-            if field:
-                value = text
-                if field == "スコア":
-                    try:
-                        value = float(text.replace("．", ".").replace("。", ".").replace(",", "."))
-                        if not validate_score_range(value):
-                            messaging_api.reply_message(ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[V3TextMessage(text="⚠️ スコアは30.000以上100.000未満で入力してください。")]
-                            ))
-                            return
-                    except ValueError:
-                        messaging_api.reply_message(ReplyMessageRequest(
-                            reply_token=event.reply_token,
-                            messages=[V3TextMessage(text="⚠️ スコアが数値として認識できませんでした。")]
-                        ))
-                        return
-
-                latest = supabase.table("scores").select("id").eq("user_id", user_id).order("created_at", desc=True).limit(1).execute()
-                if latest.data:
-                    score_id = latest.data[0]["id"]
-                    supabase.table("scores").update({
-                        get_supabase_field(field): value
-                    }).eq("id", score_id).execute()
-
-                    updated = supabase.table("scores").select("*").eq("id", score_id).single().execute()
+            with timed("supabase_correction"):
+                state = get_correction_state(user_id)
+            pending = state.get("pending") if state else None
+
+            # 修正フォームの確定
+            if text == COMPLETE_COMMAND and pending is not None:
+                if not pending:
+                    _reply_text(messaging_api, event.reply_token, "⚠️ 修正する項目がありません。")
+                    return
+                with timed("supabase_correction"):
+                    row = apply_correction(user_id, pending)
                     clear_user_correction_step(user_id)
+                _reply_text(messaging_api, event.reply_token,
+                            format_correction_reply(row) if row else "⚠️ 修正できるスコアがありません。")
+                return
 
-                    data = updated.data or {}
-                    msg = (
-                        f"✅ 修正完了！\n"
-                        f"点数: {data.get('score') or '---'}\n"
-                        f"曲名: {data.get('song_name') or '---'}\n"
-                        f"アーティスト: {data.get('artist_name') or '---'}"
-                    )
-                    messaging_api.reply_message(ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[V3TextMessage(text=msg)]
+            field = state.get("field") if state else None
+            if field:
+                column = get_supabase_field(field)
+                try:
+                    value = coerce_correction_value(column, text)
+                except ValueError as e:
+                    _reply_text(messaging_api, event.reply_token, str(e))
+                    return
+
+                # フォーム入力中は溜めるだけ
+                if pending is not None:
+                    with timed("supabase_correction"):
+                        pending = stage_correction_value(user_id, column, value, pending)
+                    _reply_text(messaging_api, event.reply_token, (
+                        f"📝 修正内容\n{format_pending(pending)}\n\n"
+                        f"他の項目も選べます。「{COMPLETE_COMMAND}」でまとめて反映します。"
                     ))
                     return
 
-            # 処理対象外
-            messaging_api.reply_message(ReplyMessageRequest(
+                with timed("supabase_correction"):
+                    row = apply_correction(user_id, {column: value})
+                if row:
+                    clear_user_correction_step(user_id)
+                    _reply_text(messaging_api, event.reply_token, format_correction_reply(row))
+                    return
+
+            # 処理対象外（グループ・トークルームでは会話に割り込まないよう返信しない）
+            if group_session.source_of(event) is not None:
+                return
+            _reply_message(messaging_api, ReplyMessageRequest(
                 reply_token=event.reply_token,
                 messages=[V3TextMessage(text="⚠️ このメッセージは処理対象外です。")]
             ))
 
         except Exception:
             logging.exception("❌ テキスト処理エラー")
-            messaging_api.reply_message(ReplyMessageRequest(
+            _reply_message(messaging_api, ReplyMessageRequest(
                 reply_token=event.reply_token,
                 messages=[V3TextMessage(text="❌ エラーが発生しました。もう一度お試しください。")]
             ))
 
 # --- ヘルパー ---
+def _reply_text(messaging_api, reply_token, text):
+    from linebot.v3.messaging.models import ReplyMessageRequest, TextMessage
+    _reply_message(messaging_api, ReplyMessageRequest(
+        reply_token=reply_token,
+        messages=[TextMessage(text=text)]
+    ))
+
+def _is_rate_limited(user_id):
+    now_ts = time.time()
+    history = user_send_history.setdefault(user_id, [])
+    history[:] = [t for t in history if now_ts - t < 80]
+    history.append(now_ts)
+    return len(history) > 5
+
 def _reply(token, text):
-    with ApiClient(configuration) as api_client:
+    from linebot.v3.messaging import ApiClient, MessagingApi
+    from linebot.v3.messaging.models import ReplyMessageRequest, TextMessage
+    with timed("line_reply"), ApiClient(line_configuration()) as api_client:
         MessagingApi(api_client).reply_message(
             ReplyMessageRequest(reply_token=token, messages=[TextMessage(text=text)])
         )
+
+def _reply_message(messaging_api, reply_request):
+    with timed("line_reply"):
+        messaging_api.reply_message(reply_request)
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 8000)), debug=DEBUG)
\ No newline at end of file
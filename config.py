@@ -0,0 +1,10 @@
+# config.py
+# 環境変数の読み込み（.env.dev / .env.production を最初の import で1度だけ読む）
+#
+# 起動時に環境変数を参照するモジュールより先に import すること（app.py / aio_app.py / supabase_client.py）
+
+import os
+from dotenv import load_dotenv
+
+ENV_FILE = os.getenv("ENV_FILE", ".env.dev")
+load_dotenv(dotenv_path=ENV_FILE)
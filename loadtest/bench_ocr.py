@@ -0,0 +1,128 @@
+# loadtest/bench_ocr.py
+# OCR エンジン（utils/ocr_backends.py）の読み取り精度と所要時間をフィクスチャ画像で比較する
+#
+# フィクスチャはファイル名に正解の点数を含めた画像（例: 92.170_dam.jpg）を置いたディレクトリ。
+# 実機の画面写真が無い環境向けに、点数画面を模した合成画像も作れる。
+#
+#   python -m loadtest.bench_ocr --synthesize 100 --fixtures /tmp/ocr_fixtures
+#   python -m loadtest.bench_ocr --fixtures ./fixtures --engines digits,tesseract
+#   python -m loadtest.bench_ocr --fixtures ./fixtures --engines vision,digits,policy   # Vision は認証情報が必要
+
+import argparse
+import glob
+import os
+import random
+import re
+import time
+from loadtest.compare_modes import percentile
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+LABEL_PATTERN = re.compile(r"(\d{2,3}\.\d{3})")
+
+
+def synthesize(directory: str, count: int, seed: int = 0):
+    """
+    カラオケの採点画面を模した画像（点数・ラベル・背景の模様・ノイズ・ぼかし・傾き）を書き出す
+    """
+    import cv2
+    import numpy as np
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    fonts = [cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX, cv2.FONT_HERSHEY_TRIPLEX]
+    for i in range(count):
+        score = f"{rng.uniform(60, 99.999):.3f}"
+        w, h = rng.choice([(1280, 720), (1080, 1080), (960, 1280)])
+        dark = rng.random() < 0.7
+        background = np.full((h, w, 3), rng.randint(0, 60) if dark else rng.randint(190, 255), dtype=np.uint8)
+        for _ in range(rng.randint(3, 8)):
+            color = tuple(rng.randint(0, 255) for _ in range(3))
+            cv2.circle(background, (rng.randint(0, w), rng.randint(0, h)), rng.randint(20, 200), color, -1)
+        background = cv2.GaussianBlur(background, (51, 51), 0)
+        ink = (255, 255, 255) if dark else (20, 20, 20)
+        font = rng.choice(fonts)
+        scale = rng.uniform(2.5, 5.0) * w / 1280
+        thickness = max(2, int(scale * rng.uniform(1.5, 3)))
+        (tw, th), _ = cv2.getTextSize(score, font, scale, thickness)
+        x = rng.randint(10, max(11, w - tw - 10))
+        y = rng.randint(th + 120, max(th + 121, h - 20))
+        cv2.putText(background, "SCORE", (x, y - th - 40), cv2.FONT_HERSHEY_SIMPLEX, scale / 3, ink, 2, cv2.LINE_AA)
+        cv2.putText(background, score, (x, y), font, scale, ink, thickness, cv2.LINE_AA)
+        cv2.putText(background, "pts", (x + tw + 10, y), cv2.FONT_HERSHEY_SIMPLEX, scale / 3, ink, 2, cv2.LINE_AA)
+        # 撮影のゆがみ（わずかな回転・ぼかし・ノイズ・JPEG 圧縮）
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), rng.uniform(-3, 3), 1.0)
+        image = cv2.warpAffine(background, matrix, (w, h), borderMode=cv2.BORDER_REPLICATE)
+        if rng.random() < 0.5:
+            image = cv2.GaussianBlur(image, (5, 5), 0)
+        noise = np.random.default_rng(seed + i).normal(0, rng.uniform(2, 12), image.shape)
+        image = np.clip(image + noise, 0, 255).astype(np.uint8)
+        cv2.imwrite(os.path.join(directory, f"{score}_{i:04d}.jpg"), image,
+                    [cv2.IMWRITE_JPEG_QUALITY, rng.randint(60, 95)])
+
+
+def load_fixtures(directory: str):
+    paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(directory, pattern)))
+    fixtures = []
+    for path in paths:
+        match = LABEL_PATTERN.search(os.path.basename(path))
+        if match:
+            with open(path, "rb") as f:
+                fixtures.append((path, float(match.group(1)), f.read()))
+    return fixtures
+
+
+def run_engine(name, fixtures):
+    from utils import ocr_backends
+    if name == "policy":
+        read = ocr_backends.recognize
+    else:
+        engine = ocr_backends.get(name)
+        if not engine.available():
+            print(f"{name:<10} 使用不可（依存パッケージ・認証情報が無い）")
+            return
+        read = engine.read
+    latencies, correct, wrong, missing = [], [], [], 0
+    engines = {}
+    for path, expected, content in fixtures:
+        started = time.perf_counter()
+        try:
+            result = read(content)
+        except Exception as e:
+            result = None
+            print(f"  ⚠️ {os.path.basename(path)}: {e}")
+        latencies.append(time.perf_counter() - started)
+        if result is None or result.score is None:
+            missing += 1
+            continue
+        engines[result.engine] = engines.get(result.engine, 0) + 1
+        (correct if abs(result.score - expected) < 1e-6 else wrong).append(result.confidence)
+    n = len(fixtures)
+    ms = sorted(x * 1000 for x in latencies)
+
+    def mean(values):
+        return f"{sum(values) / len(values):.2f}" if values else "-"
+
+    print(
+        f"{name:<10} 正解 {len(correct):>4}/{n}（{len(correct) / n * 100:5.1f}%）"
+        f" 誤読 {len(wrong):>3} 未検出 {missing:>3}"
+        f" | p50 {percentile(ms, 50):7.1f}ms p95 {percentile(ms, 95):7.1f}ms"
+        f" | 確信度 正解 {mean(correct)} / 誤読 {mean(wrong)}"
+        + (f" | 使用 {engines}" if name == "policy" else "")
+    )
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="OCR エンジンの比較")
+    ap.add_argument("--fixtures", required=True, help="フィクスチャ画像のディレクトリ（ファイル名に正解の点数）")
+    ap.add_argument("--synthesize", type=int, default=0, help="合成画像をこの枚数だけ --fixtures に書き出してから計測")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--engines", default="digits,tesseract",
+                    help="比較するエンジン（vision, digits, tesseract, policy=現在の方針で選択）")
+    args = ap.parse_args()
+
+    if args.synthesize:
+        synthesize(args.fixtures, args.synthesize, args.seed)
+    fixtures = load_fixtures(args.fixtures)
+    print(f"フィクスチャ: {len(fixtures)} 枚（{args.fixtures}）")
+    if fixtures:
+        for name in [e.strip() for e in args.engines.split(",") if e.strip()]:
+            run_engine(name, fixtures)
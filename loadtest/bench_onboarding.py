@@ -0,0 +1,90 @@
+# loadtest/bench_onboarding.py
+# 友だち追加時のユーザー登録レイテンシ計測（旧フロー vs 1往復の insert-if-absent）
+#
+#   python -m loadtest.bench_onboarding --follows 200 --latency-ms 20
+
+import argparse
+import os
+import random
+import statistics
+import string
+import subprocess
+import sys
+import time
+import uuid
+from loadtest.fake_backends import build_env
+from loadtest.compare_modes import percentile
+
+
+def legacy_register(supabase, line_sub, user_name):
+    """
+    変更前の handle_user_onboarding と同じ問い合わせ順
+    （コード未使用確認 → 既存ユーザー確認 → insert）
+    """
+    while True:
+        code = "".join(random.choices(string.ascii_uppercase + string.digits, k=8))
+        if not supabase.table("users").select("id").eq("user_code", code).execute().data:
+            break
+    resp = supabase.table("users").select("id").eq("id", line_sub).execute()
+    if not resp.data:
+        supabase.table("users").insert({
+            "id": line_sub,
+            "name": user_name,
+            "user_code": code,
+            "score_count": 0
+        }).execute()
+
+def measure(label, register, supabase, user_ids):
+    requests = []
+    supabase.postgrest.session.event_hooks["request"] = [lambda r: requests.append(r)]
+    latencies = []
+    for user_id in user_ids:
+        started = time.perf_counter()
+        register(user_id, "bench")
+        latencies.append(time.perf_counter() - started)
+    print(
+        f"  {label:30s} n={len(latencies):4d}  round trips/follow={len(requests) / len(latencies):.2f}  "
+        f"p50={percentile(latencies, 50) * 1000:7.2f}ms  p95={percentile(latencies, 95) * 1000:7.2f}ms  "
+        f"mean={statistics.fmean(latencies) * 1000:7.2f}ms"
+    )
+
+def main(args):
+    from supabase_client import supabase
+    from utils.onboarding import register_user_if_absent
+
+    legacy = lambda user_id, name: legacy_register(supabase, user_id, name)
+    before_users = [f"U{uuid.uuid4().hex}" for _ in range(args.follows)]
+    after_users = [f"U{uuid.uuid4().hex}" for _ in range(args.follows)]
+
+    print("\n=== 新規ユーザーの友だち追加 ===")
+    measure("before (probe+select+insert)", legacy, supabase, before_users)
+    measure("after (insert-if-absent)", register_user_if_absent, supabase, after_users)
+
+    print("\n=== ブロック解除（既存ユーザー）の友だち追加 ===")
+    measure("before (probe+select+insert)", legacy, supabase, before_users)
+    measure("after (insert-if-absent)", register_user_if_absent, supabase, after_users)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="友だち追加時のユーザー登録レイテンシ計測")
+    ap.add_argument("--follows", type=int, default=200)
+    ap.add_argument("--latency-ms", type=float, default=20, help="スタンドイン PostgREST の応答遅延")
+    ap.add_argument("--backend-port", type=int, default=9100)
+    ap.add_argument("--grpc-port", type=int, default=9101)
+    args = ap.parse_args()
+
+    os.environ.update(build_env(args.backend_port, args.grpc_port))
+    os.environ["ENV_FILE"] = os.devnull
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    backends = subprocess.Popen(
+        [sys.executable, "-m", "loadtest.fake_backends",
+         "--port", str(args.backend_port), "--grpc-port", str(args.grpc_port),
+         "--latency-ms", str(args.latency_ms)],
+        cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        time.sleep(2)
+        main(args)
+    finally:
+        backends.terminate()
+        backends.wait()
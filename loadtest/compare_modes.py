@@ -0,0 +1,160 @@
+# loadtest/compare_modes.py
+# 同期（Flask + gunicorn gthread）と非同期（aiohttp）サービングモードを
+# 同じスタンドイン・バックエンドに対して比較する。
+#
+#   python -m loadtest.compare_modes --requests 400 --concurrency 100 --latency-ms 50
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+import aiohttp
+from loadtest.fake_backends import build_env
+from loadtest.payloads import sign_body, image_event, webhook_body, make_id_token
+
+CHANNEL_SECRET = "loadtest-channel-secret"
+LOGIN_CLIENT_ID = "loadtest-client"
+LOGIN_CLIENT_SECRET = "loadtest-login-secret"
+
+MODES = {
+    "sync": lambda port, threads: [
+        sys.executable, "-m", "gunicorn", "app:app",
+        "-b", f"127.0.0.1:{port}", "-w", "1", "-k", "gthread",
+        "--threads", str(threads), "--timeout", "300",
+    ],
+    "async": lambda port, threads: [
+        sys.executable, "-m", "gunicorn", "aio_app:create_app",
+        "-b", f"127.0.0.1:{port}", "-w", "1",
+        "-k", "aiohttp.GunicornWebWorker", "--timeout", "300",
+    ],
+}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def wait_until_up(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} が起動しませんでした")
+
+async def run_load(base_url, total, concurrency, webhook_ratio):
+    """
+    Webhook（画像イベント）と /api/scores を混ぜて投げ、各リクエストの所要時間を記録
+    """
+    sem = asyncio.Semaphore(concurrency)
+    results = {"webhook": [], "scores": []}
+    errors = {"webhook": 0, "scores": 0}
+
+    async def one(session, i):
+        # レート制限（1ユーザー80秒5枚）に掛からないよう毎回別ユーザー
+        user_id = f"U{uuid.uuid4().hex}"
+        kind = "webhook" if (i % 100) < webhook_ratio * 100 else "scores"
+        async with sem:
+            started = time.perf_counter()
+            try:
+                if kind == "webhook":
+                    body = webhook_body([image_event(user_id)])
+                    headers = {"X-Line-Signature": sign_body(body, CHANNEL_SECRET),
+                               "Content-Type": "application/json"}
+                    async with session.post(f"{base_url}/webhook", data=body.encode(), headers=headers) as resp:
+                        await resp.read()
+                        ok = resp.status == 200
+                else:
+                    token = make_id_token(user_id, LOGIN_CLIENT_ID, LOGIN_CLIENT_SECRET)
+                    async with session.get(f"{base_url}/api/scores",
+                                           headers={"Authorization": f"Bearer {token}"}) as resp:
+                        await resp.read()
+                        ok = resp.status == 200
+            except aiohttp.ClientError:
+                ok = False
+            elapsed = time.perf_counter() - started
+        if ok:
+            results[kind].append(elapsed)
+        else:
+            errors[kind] += 1
+
+    timeout = aiohttp.ClientTimeout(total=600)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(session, i) for i in range(total)))
+        wall = time.perf_counter() - started
+    return wall, results, errors
+
+def report(mode, wall, results, errors):
+    done = sum(len(v) for v in results.values())
+    print(f"\n=== {mode} ===  {done / wall:.1f} req/s  (wall {wall:.1f}s)")
+    for kind, latencies in results.items():
+        if not latencies and not errors[kind]:
+            continue
+        print(
+            f"  {kind:8s} n={len(latencies):5d} err={errors[kind]:4d}  "
+            f"p50={percentile(latencies, 50) * 1000:8.1f}ms  "
+            f"p95={percentile(latencies, 95) * 1000:8.1f}ms  "
+            f"p99={percentile(latencies, 99) * 1000:8.1f}ms  "
+            f"mean={(statistics.fmean(latencies) if latencies else 0) * 1000:8.1f}ms"
+        )
+
+async def main(args):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {
+        **os.environ,
+        **build_env(args.backend_port, args.grpc_port),
+        "LINE_CHANNEL_SECRET": CHANNEL_SECRET,
+        "LINE_CHANNEL_ACCESS_TOKEN": "loadtest-access-token",
+        "LINE_LOGIN_CLIENT_ID": LOGIN_CLIENT_ID,
+        "LINE_LOGIN_CLIENT_SECRET": LOGIN_CLIENT_SECRET,
+        "ENV_FILE": os.devnull,
+    }
+    backends = subprocess.Popen(
+        [sys.executable, "-m", "loadtest.fake_backends",
+         "--port", str(args.backend_port), "--grpc-port", str(args.grpc_port),
+         "--latency-ms", str(args.latency_ms)],
+        cwd=root, env=env,
+    )
+    try:
+        for mode in args.modes:
+            server = subprocess.Popen(MODES[mode](args.port, args.threads), cwd=root, env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                await wait_until_up(f"http://127.0.0.1:{args.port}/")
+                wall, results, errors = await run_load(
+                    f"http://127.0.0.1:{args.port}", args.requests, args.concurrency, args.webhook_ratio
+                )
+                report(mode, wall, results, errors)
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        backends.terminate()
+        backends.wait()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="同期 / 非同期サービングモードの負荷比較")
+    ap.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    ap.add_argument("--requests", type=int, default=400)
+    ap.add_argument("--concurrency", type=int, default=100)
+    ap.add_argument("--webhook-ratio", type=float, default=0.5)
+    ap.add_argument("--latency-ms", type=float, default=50, help="スタンドイン各APIの応答遅延")
+    ap.add_argument("--threads", type=int, default=8, help="同期モードの gthread スレッド数")
+    ap.add_argument("--port", type=int, default=9000)
+    ap.add_argument("--backend-port", type=int, default=9100)
+    ap.add_argument("--grpc-port", type=int, default=9101)
+    asyncio.run(main(ap.parse_args()))
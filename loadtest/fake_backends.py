@@ -0,0 +1,800 @@
+# loadtest/fake_backends.py
+# 負荷試験用のローカル・スタンドイン
+#
+#   python -m loadtest.fake_backends --port 9100 --grpc-port 9101 --latency-ms 50 \
+#       --service-latency-ms openai=800 vision=300 --service-error-rate openai=0.05
+#
+# 1つの HTTP ポートで LINE Messaging API / PostgREST(Supabase) / OpenAI / MusicBrainz を、
+# 別ポートの gRPC で Google Cloud Vision を模倣する。
+# サービスごとに応答遅延（±ジッター）とエラー応答（HTTP 503 / gRPC UNAVAILABLE）を注入でき、
+# GET /_stats でサービス別の受信数・注入エラー数と、LINE に返された返信の内訳を返す。
+# --multicast-rate を指定するとマルチキャストに毎秒の上限を設け、超えた分に 429 を返す。
+# アプリ側は以下の環境変数でこちらに向ける（build_env 参照）。
+#   LINE_API_ENDPOINT, LINE_API_DATA_ENDPOINT, SUPABASE_URL, OPENAI_BASE_URL,
+#   MUSICBRAINZ_BASE_URL, VISION_API_ENDPOINT
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+from datetime import datetime
+from aiohttp import web
+import grpc
+from google.cloud import vision
+from utils import rating
+from utils.constants import SCORE_EVAL_COUNT
+from utils.rating_predictor import predict_next_rating
+from utils.song_stats import song_key, fold
+
+# 最小限の JPEG（中身は見ない）
+FAKE_IMAGE = b"\xff\xd8\xff\xe0" + b"\x00" * 1024 + b"\xff\xd9"
+FAKE_SONGS = [
+    ("マリーゴールド", "あいみょん"),
+    ("残酷な天使のテーゼ", "高橋洋子"),
+    ("天体観測", "BUMP OF CHICKEN"),
+    ("366日", "HY"),
+]
+# maybe_single() が「0 件」と判定する PostgREST のエラー応答
+PGRST_NO_ROWS = {
+    "code": "PGRST116",
+    "details": "The result contains 0 rows",
+    "hint": None,
+    "message": "JSON object requested, multiple (or no) rows returned",
+}
+
+# 本番スキーマの一意制約（主キー以外）
+UNIQUE_COLUMNS = {
+    "users": ["user_code"],
+}
+
+SERVICES = ("line", "supabase", "openai", "musicbrainz", "vision")
+
+
+class Faults:
+    """
+    サービスごとの遅延・ジッター・エラー率
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, latencies=None, error_rates=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.latencies = latencies or {}
+        self.error_rates = error_rates or {}
+
+    def delay(self, service) -> float:
+        base = self.latencies.get(service, self.latency)
+        return max(0.0, base + random.uniform(-self.jitter, self.jitter))
+
+    def should_fail(self, service) -> bool:
+        return random.random() < self.error_rates.get(service, self.error_rate)
+
+    def describe(self) -> str:
+        return ", ".join(
+            f"{s}={self.latencies.get(s, self.latency) * 1000:.0f}ms"
+            f"/{self.error_rates.get(s, self.error_rate) * 100:g}%"
+            for s in SERVICES
+        ) + f" (jitter ±{self.jitter * 1000:.0f}ms)"
+
+
+def new_stats():
+    return {
+        "services": {s: {"requests": 0, "injected_errors": 0} for s in SERVICES},
+        # LINE へ返された返信メッセージの先頭記号で分類
+        "replies": {"ok": 0, "warning": 0, "error": 0, "other": 0},
+        # プッシュ（保留画像の登録結果など）も同じ分類で数える
+        "pushes": {"ok": 0, "warning": 0, "error": 0, "other": 0},
+        # マルチキャスト: 受け付けた宛先数・Retry-Key の重複（409）・レート制限（429）
+        "multicast": {"requests": 0, "recipients": 0, "duplicates": 0, "rate_limited": 0},
+    }
+
+FAULTS = web.AppKey("faults", Faults)
+STATS = web.AppKey("stats", dict)
+
+
+class UniqueViolation(Exception):
+    def __init__(self, table, column, value):
+        super().__init__(f'duplicate key value violates unique constraint "{table}_{column}_key"')
+        self.details = f"Key ({column})=({value}) already exists."
+
+
+# ==============================
+# PostgREST（インメモリ）
+# ==============================
+
+class PostgrestStore:
+    """
+    supabase-py が発行する範囲のクエリだけを解釈するインメモリ PostgREST
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self._ids = itertools.count(1)
+        self._rating_versions = itertools.count(1)
+
+    def rows(self, table):
+        return self.tables.setdefault(table, [])
+
+    def select(self, table, params):
+        rows = [r for r in self.rows(table) if _match(r, params)]
+        order = params.get("order")
+        if order:
+            for part in reversed(order.split(",")):
+                col, _, direction = part.partition(".")
+                rows.sort(key=lambda r: (r.get(col) is None, r.get(col) or ""),
+                          reverse=direction.startswith("desc"))
+        offset = int(params.get("offset", 0))
+        limit = params.get("limit")
+        rows = rows[offset:offset + int(limit)] if limit else rows[offset:]
+        return [_project(r, params.get("select", "*")) for r in rows]
+
+    def insert(self, table, payload, params, resolution=None):
+        keys = [k.strip() for k in params.get("on_conflict", "id").split(",") if k.strip()]
+        result = []
+        for row in payload if isinstance(payload, list) else [payload]:
+            row = dict(row)
+            existing = None
+            if resolution and all(k in row for k in keys):
+                existing = next((r for r in self.rows(table)
+                                 if all(r.get(k) == row[k] for k in keys)), None)
+            self._check_unique(table, row, existing)
+            if existing is not None:
+                if resolution == "merge":
+                    existing.update(row)
+                    result.append(existing)
+                continue
+            row.setdefault("id", next(self._ids))
+            row.setdefault("created_at", datetime.utcnow().isoformat())
+            self.rows(table).append(row)
+            result.append(row)
+        self._bump_score_version(table, result)
+        return result
+
+    def _bump_score_version(self, table, rows, old_user_ids=()):
+        # 本番では scores_version_* トリガーが文単位で進める（sql/014_scores_version.sql）
+        if table != "scores":
+            return
+        for user_id in {r.get("user_id") for r in rows} | set(old_user_ids):
+            for user in self.rows("users"):
+                if user.get("id") == user_id:
+                    user["score_version"] = (user.get("score_version") or 0) + 1
+
+    def _check_unique(self, table, row, existing):
+        for col in UNIQUE_COLUMNS.get(table, []):
+            if row.get(col) is None:
+                continue
+            for other in self.rows(table):
+                if other is not existing and other.get(col) == row[col]:
+                    raise UniqueViolation(table, col, row[col])
+
+    def update(self, table, payload, params):
+        matched = [r for r in self.rows(table) if _match(r, params)]
+        old_user_ids = [r.get("user_id") for r in matched]
+        for row in matched:
+            row.update(payload)
+        if matched:
+            self._bump_score_version(table, matched, old_user_ids)
+        return matched
+
+    def delete(self, table, params):
+        matched = [r for r in self.rows(table) if _match(r, params)]
+        self.tables[table] = [r for r in self.rows(table) if r not in matched]
+        self._bump_score_version(table, matched)
+        return matched
+
+    def update_average_score(self, user_id):
+        scores = [s["score"] for s in self.select("scores", {
+            "user_id": f"eq.{user_id}", "order": "created_at.desc", "limit": str(SCORE_EVAL_COUNT)
+        }) if s.get("score") is not None]
+        if not scores:
+            return None
+        average = round(sum(scores) / len(scores), 3)
+        prediction = predict_next_rating(scores)
+        self.update("users", {
+            "average_score": average,
+            "average_rating": rating.get_rank(average),
+            "next_up_score": prediction.get("next_up_score"),
+            "next_down_score": prediction.get("next_down_score"),
+            **self._rating_stamp(),
+        }, {"id": f"eq.{user_id}"})
+        return None
+
+    def _rating_stamp(self):
+        # 本番では users_rating_version トリガーが採番する（ここでは即コミットなので xid も同じ番号）
+        version = next(self._rating_versions)
+        return {"rating_version": version, "rating_xid": version}
+
+    def get_rating_changes(self, since_xid, after, limit):
+        users = [r for r in self.rows("users") if (r.get("rating_version") or 0) > after
+                 and (since_xid is None or r.get("rating_xid", 0) >= int(since_xid))]
+        users.sort(key=lambda r: r["rating_version"])
+        xmin = max((r.get("rating_xid") or 0 for r in self.rows("users")), default=0) + 1
+        return {
+            "xmin": str(xmin),
+            "rows": [{k: r.get(k) for k in ("id", "average_score", "rating_version")} for r in users[:limit]],
+        }
+
+
+    def get_user_stats(self, user_id):
+        # 本番は集計テーブルを読むだけ（sql/004_score_summaries.sql）。ここでは都度集計で代用
+        rows = [r for r in self.rows("scores") if r.get("user_id") == user_id and r.get("score") is not None]
+
+        def summarize(key_name, keys_of):
+            groups = {}
+            for r in rows:
+                for key in keys_of(r):
+                    count, total = groups.get(key, (0, 0.0))
+                    groups[key] = (count + 1, total + r["score"])
+            return [{key_name: k, "count": c, "average": round(t / c, 3)} for k, (c, t) in groups.items()]
+
+        histogram = {}
+        for r in rows:
+            histogram[int(r["score"])] = histogram.get(int(r["score"]), 0) + 1
+        return {
+            "histogram": [{"bucket": b, "count": c} for b, c in sorted(histogram.items())],
+            "artists": summarize("artist", lambda r: [a] if (a := r.get("artist_name_normalized") or r.get("artist_name")) else []),
+            "genres": summarize("genre", lambda r: r.get("genre_tags") or []),
+            "monthly": sorted(summarize("month", lambda r: [str(r.get("created_at", ""))[:7]]), key=lambda m: m["month"]),
+        }
+
+
+    def apply_score_batch(self, rows):
+        # 本番は sql/007_write_behind.sql の apply_score_batch
+        known = {r.get("client_id") for r in self.rows("scores") if r.get("client_id")}
+        per_user = {}
+        for row in rows:
+            if row["client_id"] in known:
+                continue
+            known.add(row["client_id"])
+            score = {k: v for k, v in row.items() if k != "user_name"}
+            self.insert("scores", score, {})
+            n, last_at, _ = per_user.get(row["user_id"], (0, "", None))
+            per_user[row["user_id"]] = (n + 1, max(last_at, row["created_at"]), row["user_name"])
+        for user_id, (n, last_at, user_name) in per_user.items():
+            for user in self.rows("users"):
+                if user["id"] == user_id:
+                    user["score_count"] = (user.get("score_count") or 0) + n
+                    user["last_score_at"] = max(user.get("last_score_at") or "", last_at)
+                    user["name"] = user_name or user.get("name")
+                    self.update_average_score(user_id)
+        return sum(n for n, _, _ in per_user.values())
+
+    def import_scores(self, user_id, rows):
+        # 本番は sql/019_score_import_atomic.sql の import_scores（1トランザクション）
+        known = {r.get("client_id") for r in self.rows("scores") if r.get("client_id")}
+        new_rows = [dict(r, user_id=user_id) for r in rows if r["client_id"] not in known]
+        if new_rows:
+            self.insert("scores", new_rows, {})
+            for user in self.rows("users"):
+                if user["id"] == user_id:
+                    user["score_count"] = (user.get("score_count") or 0) + len(new_rows)
+            self.update_average_score(user_id)
+        return len(new_rows)
+
+    def apply_score_correction(self, user_id, changes):
+        # 本番は sql/008_score_correction.sql の apply_score_correction
+        rows = [r for r in self.rows("scores") if r.get("user_id") == user_id]
+        if not rows:
+            return None
+        row = max(rows, key=lambda r: (str(r["created_at"]), r["id"]))
+        previous = row.get("score")
+        row.update({k: v for k, v in changes.items() if k in ("score", "song_name", "artist_name", "comment")})
+        self._bump_score_version("scores", [row])
+        if row.get("score") != previous:
+            self.update_average_score(user_id)
+        user = next((u for u in self.rows("users") if u["id"] == user_id), None)
+        columns = ("average_score", "average_rating", "next_up_score", "next_down_score", "score_count", "rating_version")
+        return {**row, "previous_score": previous, "user": {c: user.get(c) for c in columns} if user else None}
+
+    def get_song_stats(self, user_id, song_name):
+        # 本番は user_song_stats の主キー参照（sql/010_song_stats.sql）。ここでは都度集計で代用
+        key = song_key(song_name)
+        stats = None
+        rows = [r for r in self.rows("scores") if r.get("user_id") == user_id and r.get("score") is not None
+                and key and song_key(r.get("song_name")) == key]
+        for r in sorted(rows, key=lambda r: (str(r["created_at"]), r["id"])):
+            stats = fold(stats, r["score"], str(r["created_at"]), r["song_name"])
+        return {"user_id": user_id, "song_key": key, **stats} if stats else None
+
+    def get_weekly_summaries(self, since, until, window, after, limit, only_user=None):
+        # 本番は sql/016_weekly_summary_user.sql の get_weekly_summaries
+        history = {}
+        for r in sorted(self.rows("scores"), key=lambda r: str(r["created_at"]), reverse=True):
+            if r.get("score") is not None:
+                history.setdefault(r["user_id"], []).append(r)
+
+        def average_before(user_id, until_at):
+            scores = [r["score"] for r in history[user_id] if str(r["created_at"]) < until_at][:window]
+            return sum(scores) / len(scores) if scores else None
+
+        by_user = {}
+        for user_id, rows in history.items():
+            week = [r for r in rows if since <= str(r["created_at"]) < until]
+            if week and user_id > after:
+                by_user[user_id] = week
+        result = []
+        if only_user is not None:
+            by_user = {only_user: by_user[only_user]} if only_user in by_user else {}
+        for user_id in sorted(by_user)[:limit]:
+            rows = by_user[user_id]
+            best = max(rows, key=lambda r: r["score"])
+            result.append({
+                "user_id": user_id, "count": len(rows),
+                "songs": len({song_key(r.get("song_name")) for r in rows if song_key(r.get("song_name"))}),
+                "best_score": best["score"], "best_song": best.get("song_name"),
+                "week_average": sum(r["score"] for r in rows) / len(rows),
+                "average_after": average_before(user_id, until), "average_before": average_before(user_id, since),
+            })
+        return result
+
+    def add_usage(self, user_id, day, month, calls, units):
+        # 本番は sql/012_cost_metering.sql の add_usage
+        daily = next((r for r in self.rows("usage_daily") if r["user_id"] == user_id and r["day"] == day), None)
+        if daily is None:
+            daily = {"user_id": user_id, "day": day, "calls": {}, "units": 0}
+            self.rows("usage_daily").append(daily)
+        for service, n in calls.items():
+            daily["calls"][service] = daily["calls"].get(service, 0) + n
+        daily["units"] += units
+        monthly = next((r for r in self.rows("usage_monthly") if r["month"] == month), None)
+        if monthly is None:
+            monthly = {"month": month, "units": 0}
+            self.rows("usage_monthly").append(monthly)
+        monthly["units"] += units
+
+    def get_usage(self, user_id, day, month):
+        return {
+            "user_day": next((r["units"] for r in self.rows("usage_daily")
+                              if r["user_id"] == user_id and r["day"] == day), 0),
+            "global_month": next((r["units"] for r in self.rows("usage_monthly") if r["month"] == month), 0),
+        }
+
+    def get_usage_report(self, month, day, limit):
+        by_user = {}
+        for r in self.rows("usage_daily"):
+            if r["day"][:7] == month[:7]:
+                u = by_user.setdefault(r["user_id"], {"user_id": r["user_id"], "month_units": 0, "today": 0})
+                u["month_units"] += r["units"]
+                if r["day"] == day:
+                    u["today"] += r["units"]
+        codes = {r["id"]: r.get("user_code") for r in self.rows("users")}
+        top = sorted(by_user.values(), key=lambda u: u["month_units"], reverse=True)[:limit]
+        return {
+            "global_month": self.get_usage(None, day, month)["global_month"],
+            "top_users": [{"user_code": codes.get(u.pop("user_id")), **u} for u in top],
+            "deferred_images": len(self.rows("deferred_images")),
+        }
+
+    def get_recent_score_windows(self, window, after, limit):
+        by_user = {}
+        for r in self.rows("scores"):
+            if r.get("score") is not None and r["user_id"] > after:
+                by_user.setdefault(r["user_id"], []).append(r)
+        result = []
+        for user_id in sorted(by_user)[:limit]:
+            rows = sorted(by_user[user_id], key=lambda r: (str(r["created_at"]), r["id"]), reverse=True)
+            result.append({"user_id": user_id, "scores": [r["score"] for r in rows[:window]]})
+        return result
+
+
+STORE = web.AppKey("store", PostgrestStore)
+
+
+def _coerce(value):
+    if value == "null":
+        return None
+    if value in ("true", "false"):
+        return value == "true"
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+def _equals(actual, raw):
+    return actual == _coerce(raw) or str(actual) == raw
+
+def _split_top_level(expr):
+    parts, depth, quoted, current = [], 0, False, ""
+    for ch in expr:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and ch == "," and depth == 0:
+            parts.append(current)
+            current = ""
+            continue
+        current += ch
+    return parts + [current]
+
+def _match_logic(row, conj, expr):
+    """
+    or=(a.lt.1,and(b.eq.2,c.lt.3)) 形式の論理式
+    """
+    results = []
+    for term in _split_top_level(expr[1:-1]):
+        if term.startswith(("and(", "or(")):
+            name, _, inner = term.partition("(")
+            results.append(_match_logic(row, name, "(" + inner))
+        else:
+            col, _, cond = term.partition(".")
+            results.append(_match(row, {col: cond}))
+    return any(results) if conj == "or" else all(results)
+
+def _match(row, params):
+    for col, expr in params.items():
+        if col in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+            continue
+        if col in ("or", "and"):
+            if not _match_logic(row, col, expr):
+                return False
+            continue
+        op, _, raw = expr.partition(".")
+        raw = raw.strip('"')
+        actual = row.get(col)
+        if op == "in":
+            if not any(_equals(actual, v.strip('"')) for v in raw.strip("()").split(",")):
+                return False
+            continue
+        if op in ("eq", "is") and not _equals(actual, raw):
+            return False
+        if op == "neq" and _equals(actual, raw):
+            return False
+        expected = _coerce(raw)
+        if op in ("gt", "gte", "lt", "lte"):
+            if actual is None:
+                return False
+            if op == "gt" and not actual > expected:
+                return False
+            if op == "gte" and not actual >= expected:
+                return False
+            if op == "lt" and not actual < expected:
+                return False
+            if op == "lte" and not actual <= expected:
+                return False
+    return True
+
+def _project(row, select):
+    if select.strip() == "*":
+        return dict(row)
+    return {c.strip(): row.get(c.strip()) for c in select.split(",")}
+
+
+async def postgrest_table(request):
+    store = request.app[STORE]
+    table = request.match_info["table"]
+    params = dict(request.query)
+    single = "vnd.pgrst.object" in request.headers.get("Accept", "")
+    prefer = request.headers.get("Prefer", "")
+
+    resolution = None
+    if "resolution=" in prefer:
+        resolution = prefer.split("resolution=")[1].split("-duplicates")[0]
+
+    try:
+        if request.method == "GET":
+            rows = store.select(table, params)
+        elif request.method == "POST":
+            rows = store.insert(table, await request.json(), params, resolution)
+        elif request.method == "PATCH":
+            rows = store.update(table, await request.json(), params)
+        else:
+            rows = store.delete(table, params)
+    except UniqueViolation as e:
+        return web.json_response({
+            "code": "23505", "details": e.details, "hint": None, "message": str(e)
+        }, status=409)
+
+    if single:
+        if len(rows) != 1:
+            return web.json_response(PGRST_NO_ROWS, status=406)
+        return web.json_response(rows[0])
+    return web.json_response(rows, status=201 if request.method == "POST" else 200)
+
+async def postgrest_rpc(request):
+    payload = await request.json()
+    fn = request.match_info["fn"]
+    if fn == "update_average_score":
+        return web.json_response(request.app[STORE].update_average_score(payload.get("p_user_id")))
+    if fn == "get_user_stats":
+        return web.json_response(request.app[STORE].get_user_stats(payload.get("p_user_id")))
+    if fn == "get_recent_score_windows":
+        return web.json_response(request.app[STORE].get_recent_score_windows(
+            payload["p_window"], payload["p_after"], payload["p_limit"]))
+    if fn == "get_song_stats":
+        return web.json_response(request.app[STORE].get_song_stats(payload["p_user_id"], payload["p_song_name"]))
+    if fn == "rebuild_user_song_stats":
+        store = request.app[STORE]
+        return web.json_response(len({(r["user_id"], song_key(r.get("song_name"))) for r in store.rows("scores")
+                                      if r["user_id"] in payload["p_user_ids"] and song_key(r.get("song_name"))}))
+    if fn == "get_weekly_summaries":
+        return web.json_response(request.app[STORE].get_weekly_summaries(
+            payload["p_since"], payload["p_until"], payload["p_window"], payload["p_after"], payload["p_limit"],
+            payload.get("p_user_id")))
+    if fn == "add_usage":
+        request.app[STORE].add_usage(payload["p_user_id"], payload["p_day"], payload["p_month"],
+                                     payload["p_calls"], payload["p_units"])
+        return web.json_response(None)
+    if fn == "get_usage":
+        return web.json_response(request.app[STORE].get_usage(payload["p_user_id"], payload["p_day"], payload["p_month"]))
+    if fn == "get_usage_report":
+        return web.json_response(request.app[STORE].get_usage_report(payload["p_month"], payload["p_day"], payload["p_limit"]))
+    if fn == "import_scores":
+        return web.json_response(request.app[STORE].import_scores(payload["p_user_id"], payload["p_rows"]))
+    if fn == "apply_score_batch":
+        return web.json_response(request.app[STORE].apply_score_batch(payload["p_rows"]))
+    if fn == "apply_score_correction":
+        return web.json_response(request.app[STORE].apply_score_correction(payload["p_user_id"], payload["p_changes"]))
+    if fn == "get_rating_changes":
+        return web.json_response(request.app[STORE].get_rating_changes(
+            payload["p_since_xid"], payload["p_after_version"], payload["p_limit"]))
+    if fn == "apply_rating_batch":
+        store = request.app[STORE]
+        updated = sum(len(store.update("users", {**{k: v for k, v in row.items() if k != "id"}, **store._rating_stamp()},
+                                       {"id": f"eq.{row['id']}"})) for row in payload["p_rows"])
+        return web.json_response(updated)
+    return web.json_response({"message": f"function {fn} not found"}, status=404)
+
+
+# ==============================
+# LINE Messaging API
+# ==============================
+
+async def line_content(request):
+    return web.Response(body=FAKE_IMAGE, content_type="image/jpeg")
+
+async def line_profile(request):
+    user_id = request.match_info["user_id"]
+    return web.json_response({"userId": user_id, "displayName": f"user-{user_id[-6:]}"})
+
+def _classify_reply(text):
+    if text.startswith("✅"):
+        return "ok"
+    if text.startswith("⚠️"):
+        return "warning"
+    if text.startswith("❌"):
+        return "error"
+    return "other"
+
+async def line_reply(request):
+    payload = await request.json()
+    messages = payload.get("messages") or [{}]
+    kind = _classify_reply(messages[0].get("text") or "")
+    request.app[STATS]["replies"][kind] += 1
+    return web.json_response({"sentMessages": [{"id": str(random.getrandbits(48)), "quoteToken": "q"}]})
+
+async def line_push(request):
+    payload = await request.json()
+    messages = payload.get("messages") or [{}]
+    request.app[STATS]["pushes"][_classify_reply(messages[0].get("text") or "")] += 1
+    return web.json_response({"sentMessages": [{"id": str(random.getrandbits(48)), "quoteToken": "q"}]})
+
+
+MULTICAST_RATE = web.AppKey("multicast_rate", float)
+# 直近1秒に受け付けたマルチキャストの時刻
+MULTICAST_WINDOW = web.AppKey("multicast_window", list)
+RETRY_KEYS = web.AppKey("retry_keys", set)
+
+async def line_multicast(request):
+    """
+    宛先は最大 500 人。MULTICAST_RATE（件/秒）を超えたら 429、受付済みの X-Line-Retry-Key は 409
+    """
+    payload = await request.json()
+    counters = request.app[STATS]["multicast"]
+    if len(payload.get("to") or []) > 500:
+        return web.json_response({"message": "The property, 'to', size must be between 1 and 500"}, status=400)
+    rate = request.app[MULTICAST_RATE]
+    if rate:
+        now = asyncio.get_running_loop().time()
+        window = request.app[MULTICAST_WINDOW]
+        while window and window[0] <= now - 1:
+            window.pop(0)
+        if len(window) >= rate:
+            counters["rate_limited"] += 1
+            return web.json_response({"message": "The API rate limit has been exceeded."},
+                                     status=429, headers={"Retry-After": "1"})
+        window.append(now)
+    retry_key = request.headers.get("X-Line-Retry-Key")
+    if retry_key and retry_key in request.app[RETRY_KEYS]:
+        counters["duplicates"] += 1
+        return web.json_response({"message": "The retry key is already accepted"}, status=409,
+                                 headers={"x-line-accepted-request-id": retry_key})
+    if retry_key:
+        request.app[RETRY_KEYS].add(retry_key)
+    counters["requests"] += 1
+    counters["recipients"] += len(payload["to"])
+    return web.json_response({})
+
+
+# ==============================
+# OpenAI / MusicBrainz
+# ==============================
+
+async def openai_chat(request):
+    await request.read()
+    song, artist = random.choice(FAKE_SONGS)
+    content = json.dumps({"song_name": song, "artist_name": artist}, ensure_ascii=False)
+    return web.json_response({
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(datetime.utcnow().timestamp()),
+        "model": "gpt-3.5-turbo",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    })
+
+async def musicbrainz_artist(request):
+    name = request.query.get("query", "")
+    return web.json_response({"artists": [{
+        "id": f"mbid-{abs(hash(name)) % 10**8:08d}",
+        "name": name,
+        "tags": [{"name": "j-pop"}],
+    }]})
+
+
+# ==============================
+# Google Cloud Vision（gRPC）
+# ==============================
+
+def _fake_annotation():
+    score = f"{random.uniform(70, 99.999):.3f}"
+    words = ["精密採点", score, "点"]
+    return vision.AnnotateImageResponse(text_annotations=[
+        vision.EntityAnnotation(description="\n".join(words)),
+        *[vision.EntityAnnotation(description=w) for w in words],
+    ])
+
+def build_vision_server(port, faults, stats):
+    async def batch_annotate(request, context):
+        stats["services"]["vision"]["requests"] += 1
+        await asyncio.sleep(faults.delay("vision"))
+        if faults.should_fail("vision"):
+            stats["services"]["vision"]["injected_errors"] += 1
+            await context.abort(grpc.StatusCode.UNAVAILABLE, "injected fault")
+        return vision.BatchAnnotateImagesResponse(
+            responses=[_fake_annotation() for _ in request.requests]
+        )
+
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(
+        "google.cloud.vision.v1.ImageAnnotator",
+        {"BatchAnnotateImages": grpc.unary_unary_rpc_method_handler(
+            batch_annotate,
+            request_deserializer=vision.BatchAnnotateImagesRequest.deserialize,
+            response_serializer=vision.BatchAnnotateImagesResponse.serialize,
+        )},
+    ),))
+    server.add_insecure_port(f"127.0.0.1:{port}")
+    return server
+
+
+# ==============================
+# 起動
+# ==============================
+
+def _service_of(path):
+    if path.startswith("/v2/bot/"):
+        return "line"
+    if path.startswith("/rest/v1/"):
+        return "supabase"
+    if path.startswith("/v1/"):
+        return "openai"
+    if path.startswith("/ws/2/"):
+        return "musicbrainz"
+    return None
+
+@web.middleware
+async def fault_middleware(request, handler):
+    service = _service_of(request.path)
+    if service is None:
+        return await handler(request)
+    counters = request.app[STATS]["services"][service]
+    counters["requests"] += 1
+    faults = request.app[FAULTS]
+    await asyncio.sleep(faults.delay(service))
+    if faults.should_fail(service):
+        counters["injected_errors"] += 1
+        return web.json_response({"code": "fake", "message": "injected fault"}, status=503)
+    return await handler(request)
+
+async def get_stats(request):
+    return web.json_response(request.app[STATS])
+
+async def reset_stats(request):
+    request.app[STATS].update(new_stats())
+    return web.json_response(request.app[STATS])
+
+def build_http_app(faults, stats=None, multicast_rate=0.0):
+    app = web.Application(middlewares=[fault_middleware], client_max_size=16 * 1024 ** 2)
+    app[FAULTS] = faults
+    app[STATS] = stats if stats is not None else new_stats()
+    app[STORE] = PostgrestStore()
+    app[MULTICAST_RATE] = multicast_rate
+    app[MULTICAST_WINDOW] = []
+    app[RETRY_KEYS] = set()
+    app.router.add_get("/_stats", get_stats)
+    app.router.add_post("/_stats/reset", reset_stats)
+    app.router.add_get("/v2/bot/message/{message_id}/content", line_content)
+    app.router.add_get("/v2/bot/profile/{user_id}", line_profile)
+    app.router.add_post("/v2/bot/message/reply", line_reply)
+    app.router.add_post("/v2/bot/message/push", line_push)
+    app.router.add_post("/v2/bot/message/multicast", line_multicast)
+    app.router.add_post("/v1/chat/completions", openai_chat)
+    app.router.add_get("/ws/2/artist/", musicbrainz_artist)
+    app.router.add_post("/rest/v1/rpc/{fn}", postgrest_rpc)
+    app.router.add_route("*", "/rest/v1/{table}", postgrest_table)
+    return app
+
+def parse_service_value(text):
+    service, _, value = text.partition("=")
+    if service not in SERVICES:
+        raise argparse.ArgumentTypeError(f"unknown service: {service}")
+    return service, float(value)
+
+def build_env(port, grpc_port):
+    """
+    アプリをスタンドインに向けるための環境変数
+    """
+    base = f"http://127.0.0.1:{port}"
+    return {
+        "LINE_API_ENDPOINT": base,
+        "LINE_API_DATA_ENDPOINT": base,
+        "SUPABASE_URL": base,
+        # supabase-py は JWT 形式のキーしか受け付けない
+        "SUPABASE_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.fake",
+        "OPENAI_BASE_URL": f"{base}/v1",
+        "OPENAI_API_KEY": "fake",
+        "MUSICBRAINZ_BASE_URL": f"{base}/ws/2",
+        "VISION_API_ENDPOINT": f"127.0.0.1:{grpc_port}",
+        # app.py が起動時に参照する（スタンドイン接続時は使われない）
+        "GOOGLE_APPLICATION_CREDENTIALS": os.devnull,
+    }
+
+async def serve(port, grpc_port, faults, multicast_rate=0.0):
+    stats = new_stats()
+    runner = web.AppRunner(build_http_app(faults, stats, multicast_rate), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    vision_server = build_vision_server(grpc_port, faults, stats)
+    await vision_server.start()
+    logging.info(f"✅ fake backends: http=:{port} grpc=:{grpc_port} {faults.describe()}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await vision_server.stop(None)
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="LINE / Supabase / OpenAI / MusicBrainz / Vision のスタンドイン")
+    ap.add_argument("--port", type=int, default=9100)
+    ap.add_argument("--grpc-port", type=int, default=9101)
+    ap.add_argument("--latency-ms", type=float, default=50, help="全サービス共通の応答遅延")
+    ap.add_argument("--jitter-ms", type=float, default=0, help="遅延に加える ±ゆらぎ")
+    ap.add_argument("--error-rate", type=float, default=0, help="全サービス共通のエラー注入率（0〜1）")
+    ap.add_argument("--service-latency-ms", nargs="*", default=[], metavar="SERVICE=MS",
+                    type=parse_service_value, help=f"サービス別の遅延（{', '.join(SERVICES)}）")
+    ap.add_argument("--service-error-rate", nargs="*", default=[], metavar="SERVICE=RATE",
+                    type=parse_service_value, help="サービス別のエラー注入率")
+    ap.add_argument("--multicast-rate", type=float, default=0, help="マルチキャストの毎秒の上限（超えると 429。0 で無制限）")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    asyncio.run(serve(args.port, args.grpc_port, Faults(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        latencies={s: v / 1000 for s, v in args.service_latency_ms},
+        error_rates=dict(args.service_error_rate),
+    ), args.multicast_rate))
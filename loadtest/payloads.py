@@ -0,0 +1,75 @@
+# loadtest/payloads.py
+# 負荷試験用の Webhook ボディ・署名・IDトークン生成
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from jose import jwt as jose_jwt
+
+
+def sign_body(body: str, channel_secret: str) -> str:
+    """
+    X-Line-Signature（HMAC-SHA256 → Base64）を計算
+    """
+    digest = hmac.new(channel_secret.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+def _source(user_id):
+    return {"type": "user", "userId": user_id}
+
+def _base_event(user_id):
+    return {
+        "timestamp": int(time.time() * 1000),
+        "source": _source(user_id),
+        "replyToken": uuid.uuid4().hex,
+        "mode": "active",
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": False},
+    }
+
+def image_event(user_id: str) -> dict:
+    return {
+        **_base_event(user_id),
+        "type": "message",
+        "message": {
+            "type": "image",
+            "id": str(uuid.uuid4().int % 10**18),
+            "quoteToken": "q",
+            "contentProvider": {"type": "line"},
+        },
+    }
+
+def text_event(user_id: str, text: str) -> dict:
+    return {
+        **_base_event(user_id),
+        "type": "message",
+        "message": {
+            "type": "text",
+            "id": str(uuid.uuid4().int % 10**18),
+            "quoteToken": "q",
+            "text": text,
+        },
+    }
+
+def follow_event(user_id: str) -> dict:
+    return {**_base_event(user_id), "type": "follow", "follow": {"isUnblocked": False}}
+
+def webhook_body(events: list, destination: str = "Ufakebot") -> str:
+    return json.dumps({"destination": destination, "events": events}, ensure_ascii=False)
+
+def make_id_token(user_id: str, client_id: str, client_secret: str, ttl: int = 3600) -> str:
+    """
+    LINE ログインの IDトークン（HS256）を模倣
+    """
+    now = int(time.time())
+    return jose_jwt.encode({
+        "iss": "https://access.line.me",
+        "sub": user_id,
+        "aud": client_id,
+        "iat": now,
+        "exp": now + ttl,
+        "name": f"user-{user_id[-6:]}",
+    }, client_secret, algorithm="HS256")
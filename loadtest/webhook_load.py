@@ -0,0 +1,223 @@
+# loadtest/webhook_load.py
+# 署名付き Webhook（画像・テキストイベント）を一定レートで送り込み、
+# gunicorn 上の app.py のスループット・レイテンシ・エラー率を計測する（ネットワーク不要）。
+#
+#   python -m loadtest.webhook_load --rate 20 --duration 30 --workers 2 --threads 8 \
+#       --latency-ms 50 --service-latency-ms openai=800 --service-error-rate openai=0.05
+#   python -m loadtest.webhook_load --rate 20 --write-behind   # スコア登録の書き込み遅延あり
+#
+# 送信はオープンループ（応答を待たずに予定時刻どおり送る）。レイテンシは予定時刻から測るため、
+# サーバーが詰まって送信が遅れた分も含まれる（coordinated omission を避ける）。
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+import aiohttp
+from loadtest.fake_backends import build_env
+from loadtest.payloads import sign_body, image_event, text_event, webhook_body
+from loadtest.compare_modes import percentile, wait_until_up, CHANNEL_SECRET
+
+TEXTS = ["成績確認", "成績確認", "こんにちは"]
+# 画像のレート制限（1ユーザー 80 秒に 5 枚）に掛からない範囲でユーザーを使い回す
+IMAGES_PER_USER = 4
+
+
+def gunicorn_command(args):
+    return [
+        sys.executable, "-m", "gunicorn", "app:app",
+        "-b", f"127.0.0.1:{args.port}", "-w", str(args.workers),
+        "-k", "gthread", "--threads", str(args.threads), "--timeout", "300",
+    ]
+
+def backend_command(args):
+    command = [
+        sys.executable, "-m", "loadtest.fake_backends",
+        "--port", str(args.backend_port), "--grpc-port", str(args.grpc_port),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--error-rate", str(args.error_rate),
+    ]
+    if args.service_latency_ms:
+        command += ["--service-latency-ms", *args.service_latency_ms]
+    if args.service_error_rate:
+        command += ["--service-error-rate", *args.service_error_rate]
+    return command
+
+
+class EventSource:
+    """
+    画像とテキストを image_ratio の割合で混ぜた署名済み Webhook ボディを作る
+    """
+
+    def __init__(self, image_ratio):
+        self.image_ratio = image_ratio
+        self.user_id = None
+        self.images = IMAGES_PER_USER
+
+    def _image_user(self):
+        if self.images >= IMAGES_PER_USER:
+            self.user_id = f"U{uuid.uuid4().hex}"
+            self.images = 0
+        self.images += 1
+        return self.user_id
+
+    def next(self):
+        if random.random() < self.image_ratio:
+            kind, event = "image", image_event(self._image_user())
+        else:
+            kind, event = "text", text_event(self.user_id or f"U{uuid.uuid4().hex}", random.choice(TEXTS))
+        body = webhook_body([event])
+        return kind, body, sign_body(body, CHANNEL_SECRET)
+
+
+async def run_load(base_url, rate, duration, image_ratio, poisson, timeout):
+    source = EventSource(image_ratio)
+    results = {"image": [], "text": []}
+    errors = {"image": {}, "text": {}}
+    tasks = []
+
+    async def one(session, kind, body, signature, scheduled):
+        try:
+            async with session.post(f"{base_url}/webhook", data=body.encode("utf-8"), headers={
+                "X-Line-Signature": signature, "Content-Type": "application/json"
+            }) as resp:
+                await resp.read()
+                status = resp.status
+        except asyncio.TimeoutError:
+            status = "timeout"
+        except aiohttp.ClientError as e:
+            status = type(e).__name__
+        if status == 200:
+            results[kind].append(time.perf_counter() - scheduled)
+        else:
+            errors[kind][status] = errors[kind].get(status, 0) + 1
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        started = time.perf_counter()
+        scheduled = started
+        while scheduled - started < duration:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            kind, body, signature = source.next()
+            tasks.append(asyncio.create_task(one(session, kind, body, signature, scheduled)))
+            scheduled += random.expovariate(rate) if poisson else 1 / rate
+        sent_for = time.perf_counter() - started
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - started
+    return len(tasks), sent_for, wall, results, errors
+
+async def fetch_json(url, method="GET"):
+    async with aiohttp.ClientSession() as session:
+        async with session.request(method, url) as resp:
+            return await resp.json()
+
+async def fetch_text(url):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as resp:
+            return await resp.text()
+
+def stage_errors(metrics_text):
+    """
+    /metrics から例外で終わった段階の件数を拾う（値は応答したワーカー1つ分）
+    """
+    counts = {}
+    for line in metrics_text.splitlines():
+        if line.startswith("scorebot_stage_errors_total{"):
+            labels, _, value = line.partition("} ")
+            counts[labels.split('stage="')[1].rstrip('"')] = float(value)
+    return counts
+
+def report(args, sent, sent_for, wall, results, errors, backend_stats, app_stage_errors):
+    done = sum(len(v) for v in results.values())
+    failed = sum(sum(e.values()) for e in errors.values())
+    print(f"\n=== webhook load: target {args.rate:g} ev/s × {args.duration:g}s "
+          f"(gunicorn -w {args.workers} --threads {args.threads}) ===")
+    print(f"  送信 {sent} 件（実レート {sent / sent_for:.1f} ev/s）  完了 {done} 件  "
+          f"スループット {done / wall:.1f} ev/s  HTTP エラー率 {failed / max(sent, 1) * 100:.2f}%")
+    for kind, latencies in results.items():
+        n_err = sum(errors[kind].values())
+        if not latencies and not n_err:
+            continue
+        print(
+            f"  {kind:6s} n={len(latencies):5d} err={n_err:4d}  "
+            f"p50={percentile(latencies, 50) * 1000:8.1f}ms  "
+            f"p95={percentile(latencies, 95) * 1000:8.1f}ms  "
+            f"p99={percentile(latencies, 99) * 1000:8.1f}ms  "
+            f"max={(max(latencies) if latencies else 0) * 1000:8.1f}ms  "
+            f"mean={(statistics.fmean(latencies) if latencies else 0) * 1000:8.1f}ms"
+            + (f"  {errors[kind]}" if n_err else "")
+        )
+
+    replies = backend_stats["replies"]
+    total_replies = sum(replies.values())
+    print(f"\n  LINE への返信 {total_replies} 件: " + "  ".join(
+        f"{k}={v} ({v / max(total_replies, 1) * 100:.1f}%)" for k, v in replies.items()
+    ))
+    print("  スタンドイン受信数 / 注入エラー:")
+    for service, c in backend_stats["services"].items():
+        print(f"    {service:12s} {c['requests']:6d} / {c['injected_errors']:4d}")
+    if app_stage_errors:
+        print("  アプリ側で例外になった段階（/metrics, 1ワーカー分）: " +
+              ", ".join(f"{k}={v:g}" for k, v in sorted(app_stage_errors.items())))
+
+async def main(args):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    backend_url = f"http://127.0.0.1:{args.backend_port}"
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = {
+        **os.environ,
+        **build_env(args.backend_port, args.grpc_port),
+        "LINE_CHANNEL_SECRET": CHANNEL_SECRET,
+        "LINE_CHANNEL_ACCESS_TOKEN": "loadtest-access-token",
+        "ENV_FILE": os.devnull,
+    }
+    if args.write_behind:
+        env["WRITE_BEHIND"] = "1"
+    backends = subprocess.Popen(backend_command(args), cwd=root, env=env)
+    server = None
+    try:
+        server = subprocess.Popen(gunicorn_command(args), cwd=root, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        await wait_until_up(f"{base_url}/")
+        await fetch_json(f"{backend_url}/_stats/reset", "POST")
+
+        sent, sent_for, wall, results, errors = await run_load(
+            base_url, args.rate, args.duration, args.image_ratio, args.poisson, args.timeout
+        )
+        backend_stats = await fetch_json(f"{backend_url}/_stats")
+        app_stage_errors = stage_errors(await fetch_text(f"{base_url}/metrics"))
+        report(args, sent, sent_for, wall, results, errors, backend_stats, app_stage_errors)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        backends.terminate()
+        backends.wait()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="署名付き Webhook の定レート負荷試験（gunicorn + app.py）")
+    ap.add_argument("--rate", type=float, default=10, help="送信レート（イベント/秒）")
+    ap.add_argument("--duration", type=float, default=30, help="送信時間（秒）")
+    ap.add_argument("--image-ratio", type=float, default=0.5, help="画像イベントの割合")
+    ap.add_argument("--poisson", action="store_true", help="送信間隔を指数分布にする（既定は等間隔）")
+    ap.add_argument("--timeout", type=float, default=120, help="1リクエストのタイムアウト（秒）")
+    ap.add_argument("--write-behind", action="store_true", help="スコア登録をまとめて書き込む（WRITE_BEHIND=1）")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--latency-ms", type=float, default=50)
+    ap.add_argument("--jitter-ms", type=float, default=0)
+    ap.add_argument("--error-rate", type=float, default=0)
+    ap.add_argument("--service-latency-ms", nargs="*", default=[], metavar="SERVICE=MS")
+    ap.add_argument("--service-error-rate", nargs="*", default=[], metavar="SERVICE=RATE")
+    ap.add_argument("--port", type=int, default=9000)
+    ap.add_argument("--backend-port", type=int, default=9100)
+    ap.add_argument("--grpc-port", type=int, default=9101)
+    asyncio.run(main(ap.parse_args()))
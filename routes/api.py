@@ -1,27 +1,12 @@
 # routes/api.py
 
 from flask import Blueprint, request, jsonify
-import os
-from jose import jwt as jose_jwt
-from supabase_client import supabase
+from supabase_client import reader
+from utils import singleflight
+from utils.auth import verify_id_token
 
 api_bp = Blueprint("api", __name__, url_prefix="/api")
 
-# 環境変数から設定読み込み
-LINE_CLIENT_ID = os.getenv("LINE_LOGIN_CLIENT_ID")
-LINE_CHANNEL_SECRET = os.getenv("LINE_LOGIN_CLIENT_SECRET")
-
-# IDトークン検証関数
-def verify_id_token(id_token: str):
-    payload = jose_jwt.decode(
-        id_token,
-        LINE_CHANNEL_SECRET,
-        algorithms=["HS256"],
-        audience=LINE_CLIENT_ID,
-        issuer="https://access.line.me"
-    )
-    return payload
-
 # /api/me エンドポイント
 @api_bp.route("/me", methods=["GET"])
 def get_me():
@@ -39,7 +24,10 @@ def get_me():
         return jsonify({"error": f"Invalid id_token: {str(e)}"}), 401
 
     # Supabaseからユーザー情報取得
-    user = supabase.table("users").select("*").eq("id", line_user_id).maybe_single().execute()
+    user = singleflight.do(
+        ("me", line_user_id),
+        lambda: reader(line_user_id).table("users").select("*").eq("id", line_user_id).maybe_single().execute()
+    )
     if not user or not user.data:
         return jsonify({"error": "User not found"}), 404
 
@@ -0,0 +1,37 @@
+# routes/debug.py
+
+from flask import Blueprint, Response, jsonify, request, abort
+from utils import profiler
+
+debug_bp = Blueprint("debug", __name__, url_prefix="/debug")
+
+@debug_bp.before_request
+def _require_debug_token():
+    # DEBUG_TOKEN 未設定・不一致ではエンドポイントの存在自体を見せない
+    if not profiler.is_authorized(request.headers.get("Authorization")):
+        abort(404)
+
+@debug_bp.route("/profiler", methods=["GET"])
+def profiler_status():
+    return jsonify(profiler.status())
+
+@debug_bp.route("/profiler/start", methods=["POST"])
+def profiler_start():
+    try:
+        interval = float(request.args.get("interval_ms", profiler.DEFAULT_INTERVAL * 1000)) / 1000
+        duration = float(request.args.get("duration_s", profiler.MAX_DURATION))
+    except ValueError:
+        return jsonify({"error": "interval_ms and duration_s must be numbers"}), 400
+    return jsonify(profiler.start(interval, duration))
+
+@debug_bp.route("/profiler/stop", methods=["POST"])
+def profiler_stop():
+    return jsonify(profiler.stop())
+
+@debug_bp.route("/profiler/collapsed", methods=["GET"])
+def profiler_collapsed():
+    try:
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    return Response(profiler.collapsed(limit), mimetype="text/plain")
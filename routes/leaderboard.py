@@ -0,0 +1,46 @@
+# routes/leaderboard.py
+
+from flask import Blueprint, jsonify, request
+from supabase_client import supabase
+from utils.auth import verify_id_token
+from utils.leaderboard import leaderboard
+
+leaderboard_bp = Blueprint("leaderboard", __name__, url_prefix="/api")
+
+MAX_TOP = 100
+
+@leaderboard_bp.route("/leaderboard", methods=["GET"])
+def get_leaderboard():
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return jsonify({"error": "Missing or invalid Authorization header"}), 401
+
+    try:
+        user_info = verify_id_token(auth_header.split(" ")[1])
+    except Exception as e:
+        return jsonify({"error": f"Invalid token: {str(e)}"}), 401
+
+    try:
+        limit = min(MAX_TOP, max(1, int(request.args.get("limit", 10))))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    leaderboard.maybe_sync()
+    top = leaderboard.top(limit)
+
+    # 他ユーザーの LINE ID は返さず、表示名とユーザーコードに置き換える
+    profiles = {}
+    if top:
+        resp = supabase.table("users").select("id, name, user_code") \
+            .in_("id", [t["user_id"] for t in top]).execute()
+        profiles = {u["id"]: u for u in resp.data or []}
+
+    return jsonify({
+        "top": [{
+            "rank": t["rank"],
+            "name": profiles.get(t["user_id"], {}).get("name"),
+            "user_code": profiles.get(t["user_id"], {}).get("user_code"),
+            "average_score": t["average_score"]
+        } for t in top],
+        "me": leaderboard.rank(user_info["sub"])
+    })
@@ -1,9 +1,8 @@
 import os
 import time
-import requests
 from flask import Blueprint, request, redirect, jsonify
 from flask_cors import CORS
-from jose import jwt as jose_jwt
+from utils import auth
 
 # === Blueprint 定義 ===
 login_bp = Blueprint("login", __name__, url_prefix="/login/line" )
@@ -39,6 +38,7 @@ def login_callback():
         "client_secret": LINE_CHANNEL_SECRET
     }
 
+    import requests
     token_response = requests.post(token_url, headers=headers, data=token_data)
     print("token_response status:", token_response.status_code)
     print("token_response json:", token_response.json())
@@ -76,6 +76,7 @@ def generate_client_assertion():
         "aud": "https://api.line.me/",
         "exp": now + 300
     }
+    from jose import jwt as jose_jwt
     token = jose_jwt.encode(payload, LINE_CHANNEL_SECRET, algorithm="HS256")
     return token
 
@@ -83,6 +84,7 @@ def generate_client_assertion():
 def verify_access_token(access_token: str):
     verify_url = "https://api.line.me/oauth2/v2.1/verify"
     params = {"access_token": access_token}
+    import requests
     response = requests.get(verify_url, params=params)
     print("access_token verify status:", response.status_code)
     print("access_token verify json:", response.json())
@@ -93,14 +95,7 @@ def verify_access_token(access_token: str):
 # === IDトークン検証 ===
 def verify_id_token(id_token: str):
     try:
-        user_info = jose_jwt.decode(
-            id_token,
-            LINE_CHANNEL_SECRET,
-            algorithms=["HS256"],
-            audience=LINE_CLIENT_ID,
-            issuer="https://access.line.me"
-        )
-        return user_info
+        return auth.verify_id_token(id_token)
     except Exception as e:
         raise Exception(f"IDトークン検証失敗: {str(e)}")
 
@@ -0,0 +1,12 @@
+# routes/metrics.py
+
+from flask import Blueprint, Response, request
+from utils.metrics import render, is_scrape_authorized, CONTENT_TYPE
+
+metrics_bp = Blueprint("metrics", __name__)
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    if not is_scrape_authorized(request.headers.get("Authorization")):
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,86 @@
+# routes/score_io.py
+
+import logging
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from supabase_client import supabase
+from utils.auth import verify_id_token
+from utils.score_io import (
+    IMPORT_MAX_ROWS,
+    iter_user_scores, iter_ndjson, iter_csv,
+    parse_import_body, validate_import_rows, import_key, import_scores
+)
+
+score_io_bp = Blueprint("score_io", __name__, url_prefix="/api")
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson; charset=utf-8", iter_ndjson),
+    "csv": ("text/csv; charset=utf-8", iter_csv),
+}
+
+
+def _authenticate():
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None, (jsonify({"error": "Missing or invalid Authorization header"}), 401)
+    try:
+        return verify_id_token(auth_header.split(" ")[1]), None
+    except Exception as e:
+        return None, (jsonify({"error": f"Invalid token: {str(e)}"}), 401)
+
+
+@score_io_bp.route("/scores/export", methods=["GET"])
+def export_scores():
+    user_info, error = _authenticate()
+    if error:
+        return error
+    line_user_id = user_info["sub"]
+
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    mimetype, render = EXPORT_FORMATS[fmt]
+
+    # 全件をメモリに載せず、ページ単位で読みながら逐次送信する
+    body = stream_with_context(render(iter_user_scores(line_user_id)))
+    return Response(body, mimetype=mimetype, headers={
+        "Content-Disposition": f'attachment; filename="scores.{fmt}"',
+        "Cache-Control": "private, no-store"
+    })
+
+
+@score_io_bp.route("/scores/import", methods=["POST"])
+def import_scores_route():
+    user_info, error = _authenticate()
+    if error:
+        return error
+    line_user_id = user_info["sub"]
+
+    body = request.get_data(as_text=True)
+    try:
+        rows = parse_import_body(body, request.content_type)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not rows:
+        return jsonify({"error": "no rows"}), 400
+    if len(rows) > IMPORT_MAX_ROWS:
+        return jsonify({"error": f"too many rows (max {IMPORT_MAX_ROWS})"}), 413
+
+    # 1行でも不正があれば何も登録しない
+    cleaned, errors = validate_import_rows(rows)
+    if errors:
+        return jsonify({"error": "validation failed", "errors": errors}), 400
+
+    user = supabase.table("users").select("id").eq("id", line_user_id).maybe_single().execute()
+    if not user or not user.data:
+        return jsonify({"error": "User not found"}), 404
+
+    # 1トランザクションで登録するため、失敗時は1件も入っていない（同じ本文・Idempotency-Key で再送できる）
+    key = import_key(line_user_id, body, request.headers.get("Idempotency-Key"))
+    try:
+        inserted = import_scores(line_user_id, cleaned, key)
+    except Exception as e:
+        logging.error(f"❌ スコアインポートに失敗（user_id={line_user_id}）: {e}")
+        return jsonify({"error": "import failed", "imported": 0}), 503
+    return jsonify({
+        "line_user_id": line_user_id, "imported": inserted, "skipped": len(cleaned) - inserted
+    }), 201
@@ -1,11 +1,102 @@
 # routes/scores.py
 
-from flask import Blueprint, jsonify, request
-from supabase_client import supabase
-from routes.login import verify_id_token
+import json
+import base64
+import hashlib
+from flask import Blueprint, jsonify, request, make_response
+from supabase_client import reader
+from utils import singleflight, score_series
+from utils.auth import verify_id_token
 
 scores_bp = Blueprint("scores", __name__, url_prefix="/api")
 
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+# fields で指定できるカラム
+SCORE_FIELDS = [
+    "id", "score", "song_name", "artist_name", "artist_name_normalized",
+    "musicbrainz_id", "genre_tags", "comment", "created_at",
+]
+# カーソル生成に必要なため常に返すカラム
+KEY_FIELDS = ["created_at", "id"]
+
+
+# ==============================
+# クエリ組み立て（aio_app と共用）
+# ==============================
+
+def parse_scores_params(args):
+    """
+    limit / cursor / fields を検証して (limit, cursor, fields) を返す。不正なら ValueError
+    """
+    try:
+        limit = int(args.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+
+    cursor = None
+    if args.get("cursor"):
+        try:
+            raw = base64.urlsafe_b64decode(args["cursor"].encode("ascii") + b"==")
+            created_at, score_id = json.loads(raw)
+            cursor = (str(created_at), int(score_id))
+        except Exception:
+            raise ValueError("invalid cursor")
+
+    fields = None  # 未指定なら全カラム
+    if args.get("fields"):
+        requested = [f.strip() for f in args["fields"].split(",") if f.strip()]
+        unknown = [f for f in requested if f not in SCORE_FIELDS]
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(unknown)}")
+        fields = KEY_FIELDS + [f for f in requested if f not in KEY_FIELDS]
+
+    return limit, cursor, fields
+
+def encode_cursor(row) -> str:
+    raw = json.dumps([row["created_at"], row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def build_scores_query(table, user_id, limit, cursor, fields):
+    """
+    (created_at, id) の降順でキーセット・ページネーション。
+    次ページ有無の判定のため limit + 1 件取得する。
+    """
+    query = table.select(",".join(fields) if fields else "*").eq("user_id", user_id)
+    if cursor:
+        created_at, score_id = cursor
+        query = query.or_(
+            f'created_at.lt."{created_at}",'
+            f'and(created_at.eq."{created_at}",id.lt.{score_id})'
+        )
+    return query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1)
+
+def build_version_query(table, user_id):
+    """
+    ETag 判定用。users.score_version は scores の行が増える・変わる・消えるたびに進む
+    （sql/014_scores_version.sql。過去日付のインポートや再抽出で古い行が変わった時も含む）
+    """
+    return table.select("score_version").eq("id", user_id).limit(1)
+
+def score_version(rows):
+    return rows[0].get("score_version") if rows else None
+
+def compute_etag(version, limit, cursor, fields) -> str:
+    basis = json.dumps([version, limit, cursor, fields], sort_keys=True, default=str)
+    return hashlib.sha256(basis.encode("utf-8")).hexdigest()[:32]
+
+def build_page(user_id, rows, limit):
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "line_user_id": user_id,
+        "scores": rows,
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None
+    }
+
+
 @scores_bp.route("/scores", methods=["GET"])
 def get_scores():
     # 1. Authorizationヘッダからid_token取得
@@ -15,7 +106,7 @@ def get_scores():
 
     id_token = auth_header.split(" ")[1]
 
-    # 2. IDトークン検証（verify_id_token関数を再利用）
+    # 2. IDトークン検証
     try:
         user_info = verify_id_token(id_token)
     except Exception as e:
@@ -23,15 +114,76 @@ def get_scores():
 
     line_user_id = user_info["sub"]
 
-    # 3. Supabaseからスコア履歴取得
-    scores = supabase.table("scores") \
-        .select("*") \
-        .eq("user_id", line_user_id) \
-        .order("created_at", desc=True) \
-        .limit(50) \
-        .execute()
-
-    return jsonify({
-        "line_user_id": line_user_id,
-        "scores": scores.data
-    })
+    try:
+        limit, cursor, fields = parse_scores_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # 3. スコアが書き換わっていなければ 304（本体の取得を省略）
+    db = reader(line_user_id)
+    version = singleflight.do(
+        ("scores_version", line_user_id),
+        lambda: build_version_query(db.table("users"), line_user_id).execute()
+    )
+    etag = compute_etag(score_version(version.data), limit, cursor, fields)
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        return response
+
+    # 4. Supabaseからスコア履歴取得
+    scores = singleflight.do(
+        ("scores_page", line_user_id, limit, cursor, tuple(fields or ())),
+        lambda: build_scores_query(db.table("scores"), line_user_id, limit, cursor, fields).execute()
+    )
+
+    response = make_response(jsonify(build_page(line_user_id, scores.data, limit)))
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@scores_bp.route("/scores/series", methods=["GET"])
+def get_score_series():
+    """
+    グラフ用：スコアと直近 SCORE_EVAL_COUNT 件の平均の時系列を points 点以内に間引いて返す
+    """
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return jsonify({"error": "Missing or invalid Authorization header"}), 401
+
+    try:
+        user_info = verify_id_token(auth_header.split(" ")[1])
+    except Exception as e:
+        return jsonify({"error": f"Invalid token: {str(e)}"}), 401
+
+    line_user_id = user_info["sub"]
+
+    try:
+        points = score_series.parse_points(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # スコアが書き換わっていなければ 304、キャッシュがあれば履歴を読み直さない
+    db = reader(line_user_id)
+    current = singleflight.do(
+        ("scores_version", line_user_id),
+        lambda: build_version_query(db.table("users"), line_user_id).execute()
+    )
+    version = score_version(current.data)
+    etag = score_series.compute_etag(version, points)
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        return response
+
+    series = score_series.cached_series(line_user_id, version, points)
+    if series is None:
+        history = singleflight.do(("score_history", line_user_id),
+                                  lambda: score_series.load_history(db, line_user_id))
+        series = score_series.store_series(line_user_id, version, history, points)
+
+    response = make_response(jsonify(series))
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
@@ -0,0 +1,33 @@
+# routes/stats.py
+
+from flask import Blueprint, jsonify, request
+from supabase_client import supabase
+from utils.auth import verify_id_token
+
+stats_bp = Blueprint("stats", __name__, url_prefix="/api")
+
+@stats_bp.route("/stats", methods=["GET"])
+def get_stats():
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return jsonify({"error": "Missing or invalid Authorization header"}), 401
+
+    try:
+        user_info = verify_id_token(auth_header.split(" ")[1])
+    except Exception as e:
+        return jsonify({"error": f"Invalid token: {str(e)}"}), 401
+
+    line_user_id = user_info["sub"]
+
+    # 集計テーブル（sql/004_score_summaries.sql）をトリガーで差分更新しているため、
+    # 履歴件数に関係なく1往復・定数サイズの読み出しで済む
+    resp = supabase.rpc("get_user_stats", {"p_user_id": line_user_id}).execute()
+    stats = resp.data or {}
+
+    return jsonify({
+        "line_user_id": line_user_id,
+        "histogram": stats.get("histogram", []),
+        "artists": stats.get("artists", []),
+        "genres": stats.get("genres", []),
+        "monthly": stats.get("monthly", [])
+    })
@@ -0,0 +1,17 @@
+# routes/usage.py
+
+from flask import Blueprint, jsonify, request, abort
+from utils import cost_meter
+
+usage_bp = Blueprint("usage", __name__)
+
+@usage_bp.route("/usage", methods=["GET"])
+def get_usage():
+    # METRICS_TOKEN 未設定・不一致ではエンドポイントの存在自体を見せない（/debug と同じ）
+    if not cost_meter.is_report_authorized(request.headers.get("Authorization")):
+        abort(404)
+    try:
+        limit = min(int(request.args.get("limit", 20)), 100)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    return jsonify(cost_meter.report(limit))
@@ -0,0 +1,44 @@
+# scripts/backfill_song_stats.py
+# 曲ごとの自己ベスト（user_song_stats）を既存の scores から作り直す
+# （sql/010_song_stats.sql の適用直後に1度。以降はトリガーが更新する）
+#
+#   python -m scripts.backfill_song_stats                  # 全ユーザー
+#   python -m scripts.backfill_song_stats --user Uxxxx     # 特定のユーザーのみ
+
+import argparse
+import logging
+import time
+from supabase_client import supabase
+
+# 1回の RPC で作り直すユーザー数（PostgREST の statement_timeout に収まる範囲）
+PAGE_SIZE = 200
+
+
+def iter_user_pages(page_size):
+    after = ""
+    while True:
+        rows = supabase.table("users").select("id").gt("id", after).order("id").limit(page_size).execute().data or []
+        if rows:
+            yield [r["id"] for r in rows]
+        if len(rows) < page_size:
+            return
+        after = rows[-1]["id"]
+
+def rebuild(user_ids) -> int:
+    return supabase.rpc("rebuild_user_song_stats", {"p_user_ids": user_ids}).execute().data or 0
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="曲ごとの自己ベストの作り直し")
+    ap.add_argument("--user", action="append", help="対象のユーザー ID（複数指定可。省略時は全ユーザー）")
+    ap.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    started = time.perf_counter()
+    users = songs = 0
+    for user_ids in ([args.user] if args.user else iter_user_pages(args.page_size)):
+        songs += rebuild(user_ids)
+        users += len(user_ids)
+        logging.info(f"🔁 {users} 人 / {songs} 曲")
+    print(f"作り直し: {users} 人 / {songs} 曲（{time.perf_counter() - started:.1f}s）")
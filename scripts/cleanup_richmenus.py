@@ -0,0 +1,19 @@
+# scripts/cleanup_richmenus.py
+# このボットが作ったリッチメニューのうち、現在の定義に一致しない（過去の友だち追加で量産された）ものを削除する
+# （コンソールや他のツールで作ったメニューは対象外）
+#
+#   python -m scripts.cleanup_richmenus --dry-run
+#   python -m scripts.cleanup_richmenus
+
+import argparse
+import logging
+from utils.richmenu import cleanup_stale_rich_menus
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="不要なリッチメニューの削除")
+    ap.add_argument("--dry-run", action="store_true", help="削除せずに対象を表示する")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    stale = cleanup_stale_rich_menus(dry_run=args.dry_run)
+    print(f"{'削除対象' if args.dry_run else '削除'}: {len(stale)} 件")
@@ -0,0 +1,92 @@
+# scripts/drain_deferred.py
+# 予算超過中に受け付けて保留した画像（deferred_images）を古い順に登録し、結果をプッシュで知らせる
+# （cron などで定期実行。ユーザーの予算がまだ戻っていない画像はそのまま残す）
+#
+#   python -m scripts.drain_deferred                 # 処理できる分をすべて
+#   python -m scripts.drain_deferred --limit 100
+#   python -m scripts.drain_deferred --dry-run       # 処理できる件数を数えるだけ
+
+import argparse
+import logging
+import time
+from supabase_client import supabase
+from utils import cost_meter
+from utils.ocr_archive import from_bytea
+from utils.resilience import CircuitOpenError
+import app as sync_app
+
+PAGE_SIZE = 50
+# これ以上失敗した画像は諦めて消す
+MAX_ATTEMPTS = 3
+FAILED_MESSAGE = "❌ お預かりした画像を登録できませんでした。お手数ですが再送信してください。"
+
+
+def iter_deferred(page_size):
+    after = 0
+    while True:
+        rows = supabase.table("deferred_images").select("id,user_id,message_id,payload,attempts") \
+            .gt("id", after).order("id").limit(page_size).execute().data or []
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = rows[-1]["id"]
+
+def push(user_id, text):
+    from linebot.v3.messaging import ApiClient, MessagingApi
+    from linebot.v3.messaging.models import PushMessageRequest, TextMessage
+    with ApiClient(sync_app.line_configuration()) as api_client:
+        MessagingApi(api_client).push_message(PushMessageRequest(to=user_id, messages=[TextMessage(text=text)]))
+
+def drain_one(row, tier) -> str:
+    """
+    1件を登録して結果をプッシュする。"done" / "retry" / "dropped" を返す
+    """
+    try:
+        reply = sync_app.process_image(row["user_id"], from_bytea(row["payload"]), tier)
+    except CircuitOpenError as e:
+        # 外部 API 側の障害。回数を数えずに次回に回す
+        logging.warning(f"⏭️ {e}（id={row['id']} は次回に処理）")
+        return "retry"
+    except Exception as e:
+        attempts = (row.get("attempts") or 0) + 1
+        logging.exception(f"❌ 保留画像の処理に失敗（id={row['id']}, {attempts} 回目）: {e}")
+        if attempts < MAX_ATTEMPTS:
+            supabase.table("deferred_images").update({"attempts": attempts}).eq("id", row["id"]).execute()
+            return "retry"
+        reply = FAILED_MESSAGE
+    try:
+        push(row["user_id"], f"📥 お預かりしていた画像の結果です\n\n{reply}")
+    except Exception as e:
+        # 登録は済んでいるので、通知できなくても消す（再処理すると二重登録になる）
+        logging.warning(f"⚠️ 結果のプッシュに失敗（user_id={row['user_id']}）: {e}")
+    supabase.table("deferred_images").delete().eq("id", row["id"]).execute()
+    return "done" if reply is not FAILED_MESSAGE else "dropped"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="保留中の画像の登録")
+    ap.add_argument("--limit", type=int, help="処理する最大件数")
+    ap.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    ap.add_argument("--dry-run", action="store_true", help="処理できる件数を数えるだけで登録しない")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    started = time.perf_counter()
+    result = {"done": 0, "retry": 0, "dropped": 0, "waiting": 0}
+    # 予算の判定はユーザーごとに1件ずつ（処理するたびに消化が進むため毎回読み直す）
+    for row in iter_deferred(args.page_size):
+        if args.limit is not None and result["done"] + result["dropped"] >= args.limit:
+            break
+        tier = cost_meter.tier_for(row["user_id"])
+        if tier == cost_meter.DEFERRED:
+            result["waiting"] += 1
+            continue
+        if args.dry_run:
+            result["done"] += 1
+            continue
+        result[drain_one(row, tier)] += 1
+
+    print(
+        f"{'処理可能' if args.dry_run else '登録'}: {result['done']} 件 / 予算待ち: {result['waiting']} 件 / "
+        f"再試行: {result['retry']} 件 / 断念: {result['dropped']} 件（{time.perf_counter() - started:.1f}s）"
+    )
@@ -0,0 +1,103 @@
+# scripts/import_cost.py
+# 起動コストの計測: モジュール別の import 時間と、プロセス起動から / が 200 を返すまでの時間
+#
+#   python -m scripts.import_cost                 # app の import 内訳
+#   python -m scripts.import_cost --module aio_app
+#   python -m scripts.import_cost --first-request --runs 5
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module: str) -> list:
+    """
+    python -X importtime の出力を (自身の μs, 累積 μs, 深さ, モジュール名) のリストにする
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return rows
+
+def report_imports(module: str, top: int):
+    rows = import_times(module)
+    total = next(c for _, c, _, name in rows if name == module)
+    print(f"\n=== import {module}: {total / 1000:.0f}ms ===")
+
+    # 対象モジュールが直接 import したもの（累積時間順）
+    target_depth = next(d for _, _, d, name in rows if name == module)
+    direct = [(c, name) for _, c, d, name in rows if d == target_depth + 1]
+    print("\n  直接 import（累積）")
+    for c, name in sorted(direct, reverse=True)[:top]:
+        print(f"    {c / 1000:8.1f}ms  {name}")
+
+    # トップレベルパッケージ単位の自身時間の合計
+    packages = {}
+    for s, _, _, name in rows:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + s
+    print("\n  パッケージ別（自身時間の合計）")
+    for package, s in sorted(packages.items(), key=lambda p: p[1], reverse=True)[:top]:
+        print(f"    {s / 1000:8.1f}ms  {package}")
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def time_to_first_200(module: str, timeout: float = 60) -> float:
+    """
+    gunicorn を起動し、GET / が 200 を返すまでの秒数
+    """
+    port = _free_port()
+    target = "app:app" if module == "app" else f"{module}:create_app"
+    command = [sys.executable, "-m", "gunicorn", target, "-b", f"127.0.0.1:{port}", "-w", "1"]
+    if module != "app":
+        command += ["-k", "aiohttp.GunicornWebWorker"]
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError("起動しませんでした")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="import 時間と初回応答までの時間の計測")
+    ap.add_argument("--module", default="app")
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--first-request", action="store_true", help="gunicorn 起動から / の 200 までを計測")
+    ap.add_argument("--runs", type=int, default=3)
+    args = ap.parse_args()
+
+    report_imports(args.module, args.top)
+    if args.first_request:
+        samples = [time_to_first_200(args.module) for _ in range(args.runs)]
+        print(f"\n=== time to first 200 on / ({args.runs} runs) ===")
+        print(f"  median {statistics.median(samples) * 1000:.0f}ms  "
+              f"min {min(samples) * 1000:.0f}ms  max {max(samples) * 1000:.0f}ms")
@@ -0,0 +1,57 @@
+# scripts/recompute_ratings.py
+# 全ユーザーのレーティングを一括再計算する / しきい値・集計件数変更の影響を試算する
+#
+#   python -m scripts.recompute_ratings                         # 再計算結果の集計のみ
+#   python -m scripts.recompute_ratings --apply                 # users へ書き戻し
+#   python -m scripts.recompute_ratings --window 15 --threshold SS=96 --threshold SA=91
+
+import argparse
+import logging
+import time
+from utils import rating
+from utils.constants import SCORE_EVAL_COUNT
+from utils.rating_batch import load_score_windows, compute_ratings, to_user_rows, write_back, simulate
+
+
+def parse_thresholds(pairs):
+    thresholds = dict(rating.RANK_THRESHOLDS)
+    for pair in pairs or []:
+        name, _, value = pair.partition("=")
+        thresholds[name.strip()] = float(value)
+    return thresholds
+
+def print_simulation(report):
+    print(f"\n対象ユーザー: {report['users']} 人")
+    print(f"  ランクアップ: {report['up']} 人 / ランクダウン: {report['down']} 人 / 変化なし: {report['unchanged']} 人")
+    print("\n  ランク    現行 →   変更後")
+    for name in sorted(set(report["before"]) | set(report["after"]),
+                       key=lambda n: rating.RANK_ORDER.index(n) if n in rating.RANK_ORDER else -1, reverse=True):
+        print(f"  {name:6s} {report['before'].get(name, 0):7d} → {report['after'].get(name, 0):7d}")
+    print("\n  移動（現行 → 変更後: 人数）")
+    for (old, new), count in sorted(report["transitions"].items(), key=lambda kv: -kv[1]):
+        if old != new:
+            print(f"  {old:>3s} → {new:<3s}: {count}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="レーティング一括再計算・what-if 試算")
+    ap.add_argument("--apply", action="store_true", help="現行設定での再計算結果を users に書き戻す")
+    ap.add_argument("--window", type=int, default=SCORE_EVAL_COUNT, help="試算する集計件数")
+    ap.add_argument("--threshold", action="append", metavar="RANK=SCORE", help="試算するランクしきい値")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    started = time.perf_counter()
+    windows = load_score_windows(max(SCORE_EVAL_COUNT, args.window))
+    loaded = time.perf_counter()
+    result = compute_ratings(windows)
+    computed = time.perf_counter()
+    print(f"読み込み {loaded - started:.2f}s / 計算 {(computed - loaded) * 1000:.1f}ms（{len(windows.user_ids)} 人）")
+
+    new_thresholds = parse_thresholds(args.threshold)
+    if args.window != SCORE_EVAL_COUNT or new_thresholds != rating.RANK_THRESHOLDS:
+        print_simulation(simulate(windows, SCORE_EVAL_COUNT, rating.RANK_THRESHOLDS, args.window, new_thresholds))
+
+    if args.apply:
+        updated = write_back(to_user_rows(windows, result))
+        print(f"書き戻し: {updated} 人（{time.perf_counter() - computed:.2f}s）")
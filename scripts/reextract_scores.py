@@ -0,0 +1,189 @@
+# scripts/reextract_scores.py
+# 保管した Vision の応答（ocr_annotations）を現在の抽出ロジックで読み直し、登録時との差分を出す / 反映する
+# （Vision は呼ばない。--gpt を付けた時だけ曲名・アーティストも GPT で構造化し直す）
+#
+#   python -m scripts.reextract_scores                      # 差分の集計のみ
+#   python -m scripts.reextract_scores --gpt --show 50      # 曲名・アーティストも比較し、差分を 50 件表示
+#   python -m scripts.reextract_scores --apply              # 差分を scores に反映し、平均スコアを再計算
+
+import argparse
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from multiprocessing import Pool
+from supabase_client import supabase
+from utils import ocr_archive
+from utils.ocr_utils import _extract_score, validate_score_range
+
+PAGE_SIZE = 500
+FIELDS = ("score", "song_name", "artist_name")
+
+LABELS = {
+    "unchanged": "変化なし",
+    "changed": "変更あり（反映対象）",
+    "corrected": "変更あり・ユーザーが修正済みのため対象外",
+    "regressed": "登録済みだが読み取れなくなった",
+    "newly_readable": "未登録だったが読み取れるようになった",
+    "unregistered": "未登録のまま",
+}
+
+
+def iter_pages(page_size, after=0):
+    """
+    ocr_annotations を id のキーセットで1ページずつ読む
+    """
+    while True:
+        rows = supabase.table(ocr_archive.TABLE) \
+            .select("id, user_id, client_id, codec, payload, extracted") \
+            .gt("id", after) \
+            .order("id") \
+            .limit(page_size) \
+            .execute().data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        after = rows[-1]["id"]
+
+
+# ==============================
+# ワーカープロセス側
+# ==============================
+
+_use_gpt = False
+
+def _init_worker(use_gpt):
+    global _use_gpt
+    _use_gpt = use_gpt
+    # 読み取れない画像ごとの警告は集計で見るため出さない
+    logging.getLogger().setLevel(logging.ERROR)
+
+def reextract(item):
+    payload, codec = item
+    annotation = ocr_archive.decode(ocr_archive.from_bytea(payload), codec)
+    texts = annotation.text_annotations
+    result = {"score": _extract_score(texts)}
+    if _use_gpt and result["score"] is not None:
+        from utils.gpt_parser import parse_text_with_gpt
+        parsed = parse_text_with_gpt(texts[0].description if texts else "")
+        result["song_name"] = parsed.get("song_name")
+        result["artist_name"] = parsed.get("artist_name")
+    return result
+
+
+# ==============================
+# 比較・反映（メインプロセス）
+# ==============================
+
+def _readable(score):
+    return score is not None and validate_score_range(score)
+
+def classify(row, current, new, fields):
+    """
+    current: 対応する scores 行（無ければ None）。戻り値は (区分, 変わった項目 → 新しい値)
+    """
+    old = row.get("extracted") or {}
+    diff = {f: new.get(f) for f in fields if new.get(f) != old.get(f)}
+    if not diff:
+        return "unchanged", diff
+    if current is None:
+        if _readable(new["score"]) and not _readable(old.get("score")):
+            return "newly_readable", diff
+        return "unregistered", diff
+    if "score" in diff and not _readable(new["score"]):
+        return "regressed", diff
+    # 登録時の抽出結果から変わっている項目はユーザーが手で直したもの
+    if any(current.get(f) != old.get(f) for f in diff):
+        return "corrected", diff
+    return "changed", diff
+
+def load_current(rows):
+    client_ids = [r["client_id"] for r in rows if r.get("client_id")]
+    if not client_ids:
+        return {}
+    resp = supabase.table("scores") \
+        .select("client_id, user_id, score, song_name, artist_name") \
+        .in_("client_id", client_ids) \
+        .execute()
+    return {r["client_id"]: r for r in resp.data or []}
+
+def apply_change(row, diff):
+    update = dict(diff)
+    if "artist_name" in diff:
+        from utils.musicbrainz import search_artist_in_musicbrainz
+        mb_result = search_artist_in_musicbrainz(diff["artist_name"]) if diff["artist_name"] else None
+        update["artist_name_normalized"] = mb_result.get("name_normalized") if mb_result else None
+        update["musicbrainz_id"] = mb_result.get("musicbrainz_id") if mb_result else None
+        update["genre_tags"] = mb_result.get("genre_tags") if mb_result else []
+    supabase.table("scores").update(update).eq("client_id", row["client_id"]).execute()
+    supabase.table(ocr_archive.TABLE).update({
+        "extracted": {**(row.get("extracted") or {}), **diff},
+        "reextracted_at": datetime.utcnow().isoformat(),
+    }).eq("id", row["id"]).execute()
+
+
+class Report:
+    def __init__(self, show):
+        self.counts = Counter()
+        self.show = show
+        self.shown = 0
+        self.rescored_users = set()
+
+    def add(self, row, kind, diff):
+        self.counts[kind] += 1
+        if kind != "unchanged" and self.shown < self.show:
+            self.shown += 1
+            old = row.get("extracted") or {}
+            changes = ", ".join(f"{f}: {old.get(f)} → {v}" for f, v in diff.items())
+            print(f"  [{LABELS[kind]}] id={row['id']} user={row['user_id']} {changes}")
+
+    def print_summary(self, elapsed):
+        total = sum(self.counts.values())
+        print(f"\n対象: {total} 件（{elapsed:.1f}s, {total / elapsed if elapsed else 0:.0f} 件/s）")
+        for kind, label in LABELS.items():
+            print(f"  {label}: {self.counts.get(kind, 0)}")
+
+def handle_page(rows, results, fields, report, apply):
+    current = load_current(rows)
+    for row, new in zip(rows, results):
+        kind, diff = classify(row, current.get(row.get("client_id")), new, fields)
+        report.add(row, kind, diff)
+        if apply and kind == "changed":
+            apply_change(row, diff)
+            if "score" in diff:
+                report.rescored_users.add(row["user_id"])
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="保管した OCR 応答からの再抽出")
+    ap.add_argument("--apply", action="store_true", help="差分を scores に反映する（ユーザーが修正済みの行は除く）")
+    ap.add_argument("--gpt", action="store_true", help="曲名・アーティストも GPT で構造化し直して比較する")
+    ap.add_argument("--workers", type=int, default=os.cpu_count(), help="抽出に使うプロセス数")
+    ap.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    ap.add_argument("--after", type=int, default=0, help="この id より後の行だけ対象にする")
+    ap.add_argument("--show", type=int, default=20, help="表示する差分の件数")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    fields = FIELDS if args.gpt else ("score",)
+    report = Report(args.show)
+    started = time.perf_counter()
+    with Pool(args.workers, initializer=_init_worker, initargs=(args.gpt,)) as pool:
+        # ページ k をワーカーで抽出している間に、ページ k-1 の比較・反映とページ k+1 の読み込みを行う
+        previous = None
+        for rows in iter_pages(args.page_size, args.after):
+            job = pool.map_async(reextract, [(r["payload"], r["codec"]) for r in rows],
+                                 chunksize=max(1, len(rows) // (args.workers * 4)))
+            if previous:
+                handle_page(previous[0], previous[1].get(), fields, report, args.apply)
+            previous = (rows, job)
+        if previous:
+            handle_page(previous[0], previous[1].get(), fields, report, args.apply)
+    report.print_summary(time.perf_counter() - started)
+
+    if args.apply:
+        for user_id in report.rescored_users:
+            supabase.rpc("update_average_score", {"p_user_id": user_id}).execute()
+        print(f"反映: {report.counts.get('changed', 0)} 件 / 平均スコア再計算: {len(report.rescored_users)} 人")
@@ -0,0 +1,53 @@
+# scripts/weekly_summary.py
+# 週次サマリー「今週のカラオケ」を、その週にスコアを登録したユーザーへ LINE で配信する
+# （cron などで毎週月曜に実行。同じ週を再実行すると、送信済みの宛先は飛ばして続きから送る）
+# 本文・個人の記録の組み立ては utils/weekly_summary.py
+#
+#   python -m scripts.weekly_summary                     # 先週分（月曜〜日曜, JST）を配信
+#   python -m scripts.weekly_summary --week 2026-W42 --dry-run
+#   python -m scripts.weekly_summary --concurrency 8
+
+import argparse
+import logging
+import os
+import time
+from utils import multicast
+from utils.weekly_summary import week_id, week_range, load_summaries, format_broadcast, quick_reply
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="週次サマリーの一括配信")
+    ap.add_argument("--week", help="対象の週（例: 2026-W42。省略時は先週）")
+    ap.add_argument("--concurrency", type=int, default=multicast.MULTICAST_CONCURRENCY, help="同時に送るリクエスト数")
+    ap.add_argument("--dry-run", action="store_true", help="集計と宛先のまとめだけ行い、送信しない")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    since, until = week_range(args.week)
+    job_id = f"weekly-{week_id(since)}"
+
+    started = time.perf_counter()
+    # 本文はランクの変化ごとに共通（個人の記録は「今週の記録」への返信で返す）
+    messages = {row["user_id"]: format_broadcast(row, since, until) for row in load_summaries(since, until)}
+    # 送信済みの宛先は先に除いてからバッチを組む。前回と宛先が変わって（新しいユーザー・スコアの修正など）
+    # バッチの区切りがずれても、途中まで届いたバッチの宛先に二重に送らない（宛先が変わると Retry-Key も変わるため）
+    delivered = multicast.load_delivered(job_id)
+    pending = {user_id: text for user_id, text in messages.items() if user_id not in delivered}
+    batches = multicast.plan_batches(job_id, pending, quick_reply=quick_reply(since))
+    print(f"{job_id}: 対象 {len(messages)} 人（送信済み {len(messages) - len(pending)} 人）/ {len(batches)} バッチ"
+          f"（集計 {time.perf_counter() - started:.1f}s）")
+
+    if args.dry_run:
+        for text in list(dict.fromkeys(b.text for b in batches))[:3]:
+            print(f"\n{text}")
+    else:
+        from linebot.v3.messaging import Configuration
+        configuration = Configuration(host=os.getenv("LINE_API_ENDPOINT", "https://api.line.me"),
+                                      access_token=os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
+        sender = multicast.MulticastSender(configuration, args.concurrency)
+        result = sender.run(batches)
+        print(
+            f"送信: {result['sent_recipients']} 人（{result['sent_batches']} バッチ）/ "
+            f"失敗: {result['failed_recipients']} 人 / 429: {result['rate_limited']} 回"
+            f"（{time.perf_counter() - started:.1f}s）"
+        )
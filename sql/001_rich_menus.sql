@@ -0,0 +1,8 @@
+-- リッチメニューのプロビジョニング記録
+-- content_hash: メニュー定義と画像の SHA-256（utils/richmenu.menu_content_hash）
+create table if not exists rich_menus (
+    content_hash text primary key,
+    rich_menu_id text not null,
+    is_default boolean not null default false,
+    created_at timestamptz not null default now()
+);
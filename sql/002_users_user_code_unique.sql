@@ -0,0 +1,3 @@
+-- user_code は鍵付きハッシュから導出する（utils/user_code.generate_user_code）。
+-- 重複確認の SELECT は行わず、この一意制約だけで衝突を検出する。
+create unique index if not exists users_user_code_key on users (user_code);
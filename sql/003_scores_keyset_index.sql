@@ -0,0 +1,3 @@
+-- /api/scores のキーセット・ページネーション（created_at, id の降順）用
+create index if not exists scores_user_created_at_id_idx
+    on scores (user_id, created_at desc, id desc);
@@ -0,0 +1,154 @@
+-- /api/stats 用の集計テーブル
+-- scores の INSERT / UPDATE（修正）/ DELETE ごとにトリガーで差分更新するため、
+-- 参照時に scores を全件走査しない。
+
+create table if not exists user_score_histogram (
+    user_id text not null,
+    bucket integer not null,            -- floor(score)
+    count integer not null default 0,
+    primary key (user_id, bucket)
+);
+
+create table if not exists user_artist_stats (
+    user_id text not null,
+    artist text not null,               -- coalesce(artist_name_normalized, artist_name)
+    count integer not null default 0,
+    score_sum double precision not null default 0,
+    primary key (user_id, artist)
+);
+
+create table if not exists user_genre_stats (
+    user_id text not null,
+    genre text not null,
+    count integer not null default 0,
+    score_sum double precision not null default 0,
+    primary key (user_id, genre)
+);
+
+create table if not exists user_monthly_stats (
+    user_id text not null,
+    month date not null,                -- date_trunc('month', created_at)
+    count integer not null default 0,
+    score_sum double precision not null default 0,
+    primary key (user_id, month)
+);
+
+-- 1行分の寄与を p_sign (+1 / -1) で加減算
+create or replace function apply_score_summary(p_row scores, p_sign integer)
+returns void language plpgsql as $$
+declare
+    v_artist text := coalesce(p_row.artist_name_normalized, p_row.artist_name);
+    v_genre text;
+begin
+    if p_row.score is null then
+        return;
+    end if;
+
+    insert into user_score_histogram (user_id, bucket, count)
+    values (p_row.user_id, floor(p_row.score)::integer, p_sign)
+    on conflict (user_id, bucket) do update
+        set count = user_score_histogram.count + excluded.count;
+
+    if v_artist is not null then
+        insert into user_artist_stats (user_id, artist, count, score_sum)
+        values (p_row.user_id, v_artist, p_sign, p_sign * p_row.score)
+        on conflict (user_id, artist) do update
+            set count = user_artist_stats.count + excluded.count,
+                score_sum = user_artist_stats.score_sum + excluded.score_sum;
+    end if;
+
+    foreach v_genre in array coalesce(p_row.genre_tags, '{}'::text[]) loop
+        insert into user_genre_stats (user_id, genre, count, score_sum)
+        values (p_row.user_id, v_genre, p_sign, p_sign * p_row.score)
+        on conflict (user_id, genre) do update
+            set count = user_genre_stats.count + excluded.count,
+                score_sum = user_genre_stats.score_sum + excluded.score_sum;
+    end loop;
+
+    insert into user_monthly_stats (user_id, month, count, score_sum)
+    values (p_row.user_id, date_trunc('month', p_row.created_at)::date, p_sign, p_sign * p_row.score)
+    on conflict (user_id, month) do update
+        set count = user_monthly_stats.count + excluded.count,
+            score_sum = user_monthly_stats.score_sum + excluded.score_sum;
+
+    if p_sign < 0 then
+        delete from user_score_histogram where user_id = p_row.user_id and count <= 0;
+        delete from user_artist_stats where user_id = p_row.user_id and count <= 0;
+        delete from user_genre_stats where user_id = p_row.user_id and count <= 0;
+        delete from user_monthly_stats where user_id = p_row.user_id and count <= 0;
+    end if;
+end;
+$$;
+
+create or replace function scores_summary_trigger()
+returns trigger language plpgsql as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform apply_score_summary(old, -1);
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform apply_score_summary(new, 1);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists scores_summary on scores;
+create trigger scores_summary
+    after insert or delete or update of score, artist_name, artist_name_normalized, genre_tags, created_at
+    on scores
+    for each row execute function scores_summary_trigger();
+
+-- /api/stats が1往復で取得する集計結果
+create or replace function get_user_stats(p_user_id text)
+returns jsonb language sql stable as $$
+    select jsonb_build_object(
+        'histogram', coalesce((
+            select jsonb_agg(jsonb_build_object('bucket', bucket, 'count', count) order by bucket)
+            from user_score_histogram where user_id = p_user_id and count > 0
+        ), '[]'::jsonb),
+        'artists', coalesce((
+            select jsonb_agg(jsonb_build_object(
+                'artist', artist, 'count', count, 'average', round((score_sum / count)::numeric, 3)
+            ) order by count desc, artist)
+            from user_artist_stats where user_id = p_user_id and count > 0
+        ), '[]'::jsonb),
+        'genres', coalesce((
+            select jsonb_agg(jsonb_build_object(
+                'genre', genre, 'count', count, 'average', round((score_sum / count)::numeric, 3)
+            ) order by count desc, genre)
+            from user_genre_stats where user_id = p_user_id and count > 0
+        ), '[]'::jsonb),
+        'monthly', coalesce((
+            select jsonb_agg(jsonb_build_object(
+                'month', to_char(month, 'YYYY-MM'), 'count', count,
+                'average', round((score_sum / count)::numeric, 3)
+            ) order by month)
+            from user_monthly_stats where user_id = p_user_id and count > 0
+        ), '[]'::jsonb)
+    );
+$$;
+
+-- 既存データからの初期構築（導入時に1度だけ実行）
+truncate user_score_histogram, user_artist_stats, user_genre_stats, user_monthly_stats;
+
+insert into user_score_histogram (user_id, bucket, count)
+select user_id, floor(score)::integer, count(*)
+from scores where score is not null
+group by 1, 2;
+
+insert into user_artist_stats (user_id, artist, count, score_sum)
+select user_id, coalesce(artist_name_normalized, artist_name), count(*), sum(score)
+from scores where score is not null and coalesce(artist_name_normalized, artist_name) is not null
+group by 1, 2;
+
+insert into user_genre_stats (user_id, genre, count, score_sum)
+select s.user_id, g.genre, count(*), sum(s.score)
+from scores s cross join lateral unnest(s.genre_tags) as g(genre)
+where s.score is not null
+group by 1, 2;
+
+insert into user_monthly_stats (user_id, month, count, score_sum)
+select user_id, date_trunc('month', created_at)::date, count(*), sum(score)
+from scores where score is not null
+group by 1, 2;
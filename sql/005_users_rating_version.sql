@@ -0,0 +1,25 @@
+-- 順位インデックス（utils/leaderboard.py）の差分同期用。
+-- average_score が変わるたびにシーケンスで採番し、各ワーカーはこの値より新しい行だけを取り込む。
+create sequence if not exists users_rating_version_seq;
+
+alter table users add column if not exists rating_version bigint;
+
+create or replace function bump_rating_version()
+returns trigger language plpgsql as $$
+begin
+    new.rating_version := nextval('users_rating_version_seq');
+    return new;
+end;
+$$;
+
+drop trigger if exists users_rating_version on users;
+create trigger users_rating_version
+    before update of average_score on users
+    for each row
+    when (old.average_score is distinct from new.average_score)
+    execute function bump_rating_version();
+
+create index if not exists users_rating_version_idx on users (rating_version);
+
+update users set rating_version = nextval('users_rating_version_seq')
+where average_score is not null and rating_version is null;
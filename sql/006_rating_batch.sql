@@ -0,0 +1,48 @@
+-- 一括レーティング再計算（utils/rating_batch.py）用
+
+-- 全ユーザーの直近 p_window 件（新しい順）を user_id 順にページングして返す
+create or replace function get_recent_score_windows(p_window integer, p_after text, p_limit integer)
+returns table (user_id text, scores double precision[])
+language sql stable as $$
+    select s.user_id, array_agg(s.score order by s.created_at desc, s.id desc)
+    from (
+        select user_id, score, created_at, id,
+               row_number() over (partition by user_id order by created_at desc, id desc) as rn
+        from scores
+        where score is not null
+          and user_id in (
+              -- 点数の無い行しか無いユーザーを数えると、ページが p_limit 件に満たず呼び出し側が打ち切ってしまう
+              select distinct user_id from scores
+              where user_id > p_after and score is not null
+              order by user_id
+              limit p_limit
+          )
+    ) s
+    where s.rn <= p_window
+    group by s.user_id
+    order by s.user_id;
+$$;
+
+-- 再計算結果をまとめて1回の UPDATE で反映し、更新件数を返す
+create or replace function apply_rating_batch(p_rows jsonb)
+returns integer language sql as $$
+    with r as (
+        select * from jsonb_to_recordset(p_rows) as x(
+            id text,
+            average_score double precision,
+            average_rating text,
+            next_up_score integer,
+            next_down_score integer
+        )
+    ), updated as (
+        update users u
+        set average_score = r.average_score,
+            average_rating = r.average_rating,
+            next_up_score = r.next_up_score,
+            next_down_score = r.next_down_score
+        from r
+        where u.id = r.id
+        returning 1
+    )
+    select count(*)::integer from updated;
+$$;
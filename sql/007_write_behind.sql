@@ -0,0 +1,67 @@
+-- スコア登録の書き込み遅延（utils/write_behind.py）用
+
+-- 行ごとにアプリ側で採番する冪等キー。ジャーナルの再送で同じ行が届いても重複登録しない。
+-- 既存行は null のまま（一意インデックスは null を区別しない）
+alter table scores add column if not exists client_id uuid;
+create unique index if not exists scores_client_id_key on scores (client_id);
+
+-- 溜めたスコアを1回でまとめて登録し、実際に追加された行の分だけ
+-- users の score_count / last_score_at / name を進め、該当ユーザーの平均スコアを更新する。
+-- 追加した行数を返す（再送で全て重複なら 0）。
+create or replace function apply_score_batch(p_rows jsonb)
+returns integer language plpgsql as $$
+declare
+    v_users text[];
+    v_inserted integer;
+    v_user text;
+begin
+    with r as (
+        select * from jsonb_to_recordset(p_rows) as x(
+            client_id uuid,
+            user_id text,
+            user_name text,
+            score double precision,
+            song_name text,
+            artist_name text,
+            artist_name_normalized text,
+            musicbrainz_id text,
+            genre_tags text[],
+            comment text,
+            created_at timestamp
+        )
+    ), inserted as (
+        insert into scores (
+            client_id, user_id, score, song_name, artist_name,
+            artist_name_normalized, musicbrainz_id, genre_tags, comment, created_at
+        )
+        select client_id, user_id, score, song_name, artist_name,
+               artist_name_normalized, musicbrainz_id, coalesce(genre_tags, '{}'), comment, created_at
+        from r
+        on conflict (client_id) do nothing
+        returning client_id, user_id, created_at
+    ), per_user as (
+        select i.user_id,
+               count(*) as n,
+               max(i.created_at) as last_at,
+               (array_agg(r.user_name order by i.created_at desc))[1] as user_name
+        from inserted i join r using (client_id)
+        group by i.user_id
+    ), updated as (
+        update users u
+        set score_count = coalesce(u.score_count, 0) + p.n,
+            last_score_at = greatest(u.last_score_at, p.last_at),
+            name = coalesce(p.user_name, u.name)
+        from per_user p
+        where u.id = p.user_id
+        returning u.id, p.n
+    )
+    select coalesce(array_agg(id), '{}'), coalesce(sum(n), 0)::integer
+    into v_users, v_inserted
+    from updated;
+
+    foreach v_user in array v_users loop
+        perform update_average_score(v_user);
+    end loop;
+    return v_inserted;
+end;
+$$;
@@ -0,0 +1,44 @@
+-- スコア修正（utils/score_correction.py）用
+
+-- 修正フォームで入力済みの項目（「修正完了」でまとめて反映するまでの一時保存）。
+-- null の間は従来どおり1項目ずつ即時反映する。
+alter table corrections add column if not exists pending jsonb;
+
+-- ユーザーの最新スコアに p_changes（score / song_name / artist_name / comment のうち指定分）を
+-- 1回の UPDATE で反映し、修正後の行を返す。点数が変わった時だけそのユーザーの
+-- レーティングを再計算し、結果を "user" に含める。対象のスコアが無ければ null。
+create or replace function apply_score_correction(p_user_id text, p_changes jsonb)
+returns jsonb language plpgsql as $$
+declare
+    v_old scores%rowtype;
+    v_new scores%rowtype;
+    v_user jsonb;
+begin
+    select * into v_old from scores
+    where user_id = p_user_id
+    order by created_at desc, id desc
+    limit 1
+    for update;
+    if not found then
+        return null;
+    end if;
+
+    update scores set
+        score = case when p_changes ? 'score' then (p_changes->>'score')::double precision else score end,
+        song_name = case when p_changes ? 'song_name' then p_changes->>'song_name' else song_name end,
+        artist_name = case when p_changes ? 'artist_name' then p_changes->>'artist_name' else artist_name end,
+        comment = case when p_changes ? 'comment' then p_changes->>'comment' else comment end
+    where id = v_old.id
+    returning * into v_new;
+
+    if v_new.score is distinct from v_old.score then
+        perform update_average_score(p_user_id);
+    end if;
+
+    select to_jsonb(u) into v_user from (
+        select average_score, average_rating, next_up_score, next_down_score, score_count, rating_version
+        from users where id = p_user_id
+    ) u;
+    return to_jsonb(v_new) || jsonb_build_object('previous_score', v_old.score, 'user', v_user);
+end;
+$$;
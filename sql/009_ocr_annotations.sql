@@ -0,0 +1,22 @@
+-- Vision の応答の保管（utils/ocr_archive.py）と再抽出（scripts/reextract_scores.py）用
+
+-- handle_image は書き込み遅延の有無によらず client_id を付けて登録する（007 と同じ列）
+alter table scores add column if not exists client_id uuid;
+create unique index if not exists scores_client_id_key on scores (client_id);
+
+-- payload: codec の形式で圧縮した AnnotateImageResponse（pb-zlib = protobuf + zlib）
+-- client_id: 対応する scores.client_id。読み取れず登録しなかった画像は null
+--   （書き込み遅延中は scores 行がまだ無いため外部キーにはしない）
+-- extracted: 登録時点の抽出結果 {score, song_name, artist_name}。
+--   scores 側の値と異なればユーザーが手で修正したものとみなし、再抽出では上書きしない
+create table if not exists ocr_annotations (
+    id bigserial primary key,
+    user_id text not null,
+    client_id uuid,
+    codec text not null,
+    payload bytea not null,
+    extracted jsonb,
+    created_at timestamptz not null default now(),
+    reextracted_at timestamptz
+);
+create index if not exists ocr_annotations_client_id_idx on ocr_annotations (client_id);
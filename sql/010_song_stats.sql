@@ -0,0 +1,123 @@
+-- 曲ごとの自己ベスト（utils/song_stats.py）用
+-- scores の INSERT はトリガーで1行分を差分更新する。修正（UPDATE）・削除は最大値を引き戻せないため、
+-- 該当する (ユーザー, 曲) の行だけを scores_user_song_idx で集計し直す（ユーザーの全履歴は読まない）。
+
+-- 曲名の表記ゆれ（全角・半角、大文字・小文字、空白）を吸収したキー。utils/song_stats.song_key と同じ規則
+create or replace function song_key(p_song_name text)
+returns text language sql immutable as $$
+    select nullif(lower(regexp_replace(normalize(p_song_name, NFKC), '\s+', '', 'g')), '');
+$$;
+
+create index if not exists scores_user_song_idx on scores (user_id, song_key(song_name));
+
+create table if not exists user_song_stats (
+    user_id text not null,
+    song_key text not null,
+    song_name text,                     -- 最新の登録時の表記
+    count integer not null default 0,
+    score_sum double precision not null default 0,
+    best_score double precision,
+    best_at timestamp,
+    latest_score double precision,
+    latest_at timestamp,
+    previous_score double precision,    -- 最新の1つ前（伸びているかの比較用）
+    primary key (user_id, song_key)
+);
+
+-- (ユーザー, 曲) 1件を scores から作り直す
+create or replace function refresh_user_song_stats(p_user_id text, p_song_key text)
+returns void language plpgsql as $$
+begin
+    if p_song_key is null then
+        return;
+    end if;
+    delete from user_song_stats where user_id = p_user_id and song_key = p_song_key;
+    insert into user_song_stats (user_id, song_key, song_name, count, score_sum,
+                                 best_score, best_at, latest_score, latest_at, previous_score)
+    select p_user_id, p_song_key,
+           (array_agg(song_name order by created_at desc, id desc))[1],
+           count(*), sum(score),
+           max(score),
+           (array_agg(created_at order by score desc, created_at))[1],
+           (array_agg(score order by created_at desc, id desc))[1],
+           max(created_at),
+           (array_agg(score order by created_at desc, id desc))[2]
+    from scores
+    where user_id = p_user_id and song_key(song_name) = p_song_key and score is not null
+    having count(*) > 0;
+end;
+$$;
+
+create or replace function scores_song_stats_trigger()
+returns trigger language plpgsql as $$
+declare
+    v_key text;
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform refresh_user_song_stats(old.user_id, song_key(old.song_name));
+        if tg_op = 'UPDATE' and song_key(new.song_name) is distinct from song_key(old.song_name) then
+            perform refresh_user_song_stats(new.user_id, song_key(new.song_name));
+        end if;
+        return null;
+    end if;
+
+    v_key := song_key(new.song_name);
+    if v_key is null or new.score is null then
+        return null;
+    end if;
+    insert into user_song_stats as s (user_id, song_key, song_name, count, score_sum,
+                                      best_score, best_at, latest_score, latest_at, previous_score)
+    values (new.user_id, v_key, new.song_name, 1, new.score,
+            new.score, new.created_at, new.score, new.created_at, null)
+    on conflict (user_id, song_key) do update set
+        count = s.count + 1,
+        score_sum = s.score_sum + excluded.score_sum,
+        best_at = case when excluded.best_score > s.best_score then excluded.best_at else s.best_at end,
+        best_score = greatest(s.best_score, excluded.best_score),
+        -- 登録時刻が前後して届く（書き込み遅延の再送など）場合も最新は created_at で決める
+        song_name = case when excluded.latest_at >= s.latest_at then excluded.song_name else s.song_name end,
+        previous_score = case when excluded.latest_at >= s.latest_at then s.latest_score
+                              else s.previous_score end,
+        latest_score = case when excluded.latest_at >= s.latest_at then excluded.latest_score else s.latest_score end,
+        latest_at = greatest(s.latest_at, excluded.latest_at);
+    return null;
+end;
+$$;
+
+drop trigger if exists scores_song_stats on scores;
+create trigger scores_song_stats
+    after insert or delete or update of score, song_name, created_at
+    on scores
+    for each row execute function scores_song_stats_trigger();
+
+-- handle_image の返信用（主キー1件の参照）
+create or replace function get_song_stats(p_user_id text, p_song_name text)
+returns jsonb language sql stable as $$
+    select to_jsonb(s) from user_song_stats s
+    where user_id = p_user_id and song_key = song_key(p_song_name);
+$$;
+
+-- 既存データからの構築（scripts/backfill_song_stats.py がユーザーの範囲ごとに呼ぶ）
+create or replace function rebuild_user_song_stats(p_user_ids text[])
+returns integer language plpgsql as $$
+declare
+    v_rows integer;
+begin
+    delete from user_song_stats where user_id = any(p_user_ids);
+    insert into user_song_stats (user_id, song_key, song_name, count, score_sum,
+                                 best_score, best_at, latest_score, latest_at, previous_score)
+    select user_id, song_key(song_name),
+           (array_agg(song_name order by created_at desc, id desc))[1],
+           count(*), sum(score),
+           max(score),
+           (array_agg(created_at order by score desc, created_at))[1],
+           (array_agg(score order by created_at desc, id desc))[1],
+           max(created_at),
+           (array_agg(score order by created_at desc, id desc))[2]
+    from scores
+    where user_id = any(p_user_ids) and song_key(song_name) is not null and score is not null
+    group by 1, 2;
+    get diagnostics v_rows = row_count;
+    return v_rows;
+end;
+$$;
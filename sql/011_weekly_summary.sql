@@ -0,0 +1,57 @@
+-- 週次サマリーの配信（scripts/weekly_summary.py, utils/multicast.py）用
+
+create index if not exists scores_created_at_idx on scores (created_at);
+
+-- 配信済みの宛先（job_id = "weekly-2026-W42" など）。再実行時はここにある宛先を飛ばす
+create table if not exists push_deliveries (
+    job_id text not null,
+    user_id text not null,
+    sent_at timestamptz not null default now(),
+    primary key (job_id, user_id)
+);
+
+-- [p_since, p_until) にスコアを登録したユーザーの週次集計を user_id 順のキーセットで返す。
+-- 平均スコアは週の終わり時点・始まり時点それぞれの直近 p_window 件から計算する
+-- （users の現在値を使わないため、同じ週を再実行しても同じ本文になる）。
+create or replace function get_weekly_summaries(
+    p_since timestamp, p_until timestamp, p_window integer, p_after text, p_limit integer
+)
+returns table (
+    user_id text,
+    count bigint,
+    songs bigint,
+    best_score double precision,
+    best_song text,
+    week_average double precision,
+    average_after double precision,
+    average_before double precision
+)
+language sql stable as $$
+    with active as (
+        select s.user_id,
+               count(*) as count,
+               count(distinct song_key(s.song_name)) as songs,
+               max(s.score) as best_score,
+               (array_agg(s.song_name order by s.score desc, s.created_at))[1] as best_song,
+               avg(s.score) as week_average
+        from scores s
+        where s.created_at >= p_since and s.created_at < p_until
+          and s.score is not null and s.user_id > p_after
+        group by s.user_id
+        order by s.user_id
+        limit p_limit
+    )
+    select a.user_id, a.count, a.songs, a.best_score, a.best_song, a.week_average,
+           (select avg(w.score) from (
+                select score from scores
+                where scores.user_id = a.user_id and created_at < p_until and score is not null
+                order by created_at desc limit p_window
+           ) w),
+           (select avg(w.score) from (
+                select score from scores
+                where scores.user_id = a.user_id and created_at < p_since and score is not null
+                order by created_at desc limit p_window
+           ) w)
+    from active a
+    order by a.user_id;
+$$;
@@ -0,0 +1,74 @@
+-- 外部 API の利用量の計測と縮退（utils/cost_meter.py）用
+
+-- ユーザー別・日別（JST）の呼び出し回数とユニット
+create table if not exists usage_daily (
+    user_id text not null,
+    day date not null,
+    calls jsonb not null default '{}'::jsonb,   -- {"vision": 3, "openai": 2, ...}
+    units double precision not null default 0,
+    primary key (user_id, day)
+);
+
+-- 全体の月別ユニット（毎回 usage_daily を集計しないよう add_usage で同時に加算）
+create table if not exists usage_monthly (
+    month date primary key,
+    units double precision not null default 0
+);
+
+-- 予算超過中に受け付けた画像（scripts/drain_deferred.py が処理して消す）
+create table if not exists deferred_images (
+    id bigserial primary key,
+    user_id text not null,
+    message_id text not null,
+    payload bytea not null,
+    attempts integer not null default 0,
+    created_at timestamptz not null default now()
+);
+create index if not exists deferred_images_user_idx on deferred_images (user_id);
+
+create or replace function add_usage(p_user_id text, p_day date, p_month date, p_calls jsonb, p_units double precision)
+returns void language plpgsql as $$
+begin
+    insert into usage_daily as u (user_id, day, calls, units)
+    values (p_user_id, p_day, p_calls, p_units)
+    on conflict (user_id, day) do update set
+        calls = (
+            select coalesce(jsonb_object_agg(k, coalesce((u.calls->>k)::integer, 0) + coalesce((p_calls->>k)::integer, 0)), '{}'::jsonb)
+            from (select jsonb_object_keys(u.calls) as k union select jsonb_object_keys(p_calls)) keys
+        ),
+        units = u.units + excluded.units;
+
+    insert into usage_monthly as m (month, units) values (p_month, p_units)
+    on conflict (month) do update set units = m.units + excluded.units;
+end;
+$$;
+
+-- handle_image の処理前に読む（主キー参照2件）
+create or replace function get_usage(p_user_id text, p_day date, p_month date)
+returns jsonb language sql stable as $$
+    select jsonb_build_object(
+        'user_day', coalesce((select units from usage_daily where user_id = p_user_id and day = p_day), 0),
+        'global_month', coalesce((select units from usage_monthly where month = p_month), 0)
+    );
+$$;
+
+-- /usage 用
+create or replace function get_usage_report(p_month date, p_day date, p_limit integer)
+returns jsonb language sql stable as $$
+    select jsonb_build_object(
+        'global_month', coalesce((select units from usage_monthly where month = p_month), 0),
+        'top_users', coalesce((
+            select jsonb_agg(t order by t.month_units desc) from (
+                select user_id,
+                       sum(units) as month_units,
+                       coalesce(sum(units) filter (where day = p_day), 0) as today
+                from usage_daily
+                where day >= p_month and day < (p_month + interval '1 month')
+                group by user_id
+                order by 2 desc
+                limit p_limit
+            ) t
+        ), '[]'::jsonb),
+        'deferred_images', (select count(*) from deferred_images)
+    );
+$$;
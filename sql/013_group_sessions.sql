@@ -0,0 +1,17 @@
+-- グループ・トークルームの大会モード（utils/group_session.py）の結果
+-- 大会中の集計はワーカーのメモリ上で行い、終了時（「大会終了」・放置による自動終了）に要約を1行だけ書く
+
+create table if not exists group_sessions (
+    id bigserial primary key,
+    source_type text not null check (source_type in ('group', 'room')),
+    source_id text not null,
+    started_by text,
+    started_at timestamptz not null,
+    ended_at timestamptz not null default now(),
+    score_count integer not null,
+    -- {"members": [{user_id, name, count, best, best_song, average}, ...],
+    --  "head_to_head": [[user_id, user_id, 勝ち, 負け, 引き分け], ...], "songs": 曲数}
+    summary jsonb not null
+);
+
+create index if not exists group_sessions_source_idx on group_sessions (source_id, ended_at desc);
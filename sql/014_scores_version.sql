@@ -0,0 +1,41 @@
+-- /api/scores・/api/scores/series の ETag と時系列キャッシュ（utils/score_series.py）の判定用。
+-- scores の行が増える・変わる・消えるたびに、そのユーザーの score_version を進める。
+-- 最新行だけを見る判定では、過去日付のインポート（/api/scores/import）や
+-- 再抽出（scripts/reextract_scores.py --apply）による古い行の変更を拾えないため。
+alter table users add column if not exists score_version bigint not null default 0;
+
+-- 文単位で、変わった行のユーザーごとに1回だけ進める（インポートの数百行でも UPDATE は人数分）
+create or replace function bump_score_version()
+returns trigger language plpgsql as $$
+begin
+    if tg_op = 'INSERT' then
+        update users set score_version = score_version + 1
+        where id in (select distinct user_id from new_rows);
+    elsif tg_op = 'UPDATE' then
+        update users set score_version = score_version + 1
+        where id in (select user_id from new_rows union select user_id from old_rows);
+    else
+        update users set score_version = score_version + 1
+        where id in (select distinct user_id from old_rows);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists scores_version_insert on scores;
+create trigger scores_version_insert
+    after insert on scores
+    referencing new table as new_rows
+    for each statement execute function bump_score_version();
+
+drop trigger if exists scores_version_update on scores;
+create trigger scores_version_update
+    after update on scores
+    referencing old table as old_rows new table as new_rows
+    for each statement execute function bump_score_version();
+
+drop trigger if exists scores_version_delete on scores;
+create trigger scores_version_delete
+    after delete on scores
+    referencing old table as old_rows
+    for each statement execute function bump_score_version();
@@ -0,0 +1,13 @@
+-- スコアのインポート（utils/score_io.import_scores）の後処理。
+-- 取り込んだ件数を score_count に足し（読み出して足した値を書き戻すと、同時の登録・書き込み遅延の反映と競合する）、
+-- 平均スコアを再計算する。ETag 用の score_version も進める（sql/014_scores_version.sql）。
+create or replace function apply_score_import(p_user_id text, p_inserted integer)
+returns void language plpgsql as $$
+begin
+    update users
+    set score_count = coalesce(score_count, 0) + p_inserted,
+        score_version = score_version + 1
+    where id = p_user_id;
+    perform update_average_score(p_user_id);
+end;
+$$;
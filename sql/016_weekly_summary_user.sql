@@ -0,0 +1,49 @@
+-- 週次サマリーの個人の記録（「今週の記録」への返信, utils/weekly_summary.py）用に、
+-- get_weekly_summaries（sql/011_weekly_summary.sql）を1ユーザーに絞れるようにする。
+-- 配信の本文はランクの変化ごとに共通にしてマルチキャストでまとめて送り、個人の数字はこちらで返す。
+drop function if exists get_weekly_summaries(timestamp, timestamp, integer, text, integer);
+
+create or replace function get_weekly_summaries(
+    p_since timestamp, p_until timestamp, p_window integer, p_after text, p_limit integer,
+    p_user_id text default null
+)
+returns table (
+    user_id text,
+    count bigint,
+    songs bigint,
+    best_score double precision,
+    best_song text,
+    week_average double precision,
+    average_after double precision,
+    average_before double precision
+)
+language sql stable as $$
+    with active as (
+        select s.user_id,
+               count(*) as count,
+               count(distinct song_key(s.song_name)) as songs,
+               max(s.score) as best_score,
+               (array_agg(s.song_name order by s.score desc, s.created_at))[1] as best_song,
+               avg(s.score) as week_average
+        from scores s
+        where s.created_at >= p_since and s.created_at < p_until
+          and s.score is not null and s.user_id > p_after
+          and (p_user_id is null or s.user_id = p_user_id)
+        group by s.user_id
+        order by s.user_id
+        limit p_limit
+    )
+    select a.user_id, a.count, a.songs, a.best_score, a.best_song, a.week_average,
+           (select avg(w.score) from (
+                select score from scores
+                where scores.user_id = a.user_id and created_at < p_until and score is not null
+                order by created_at desc limit p_window
+           ) w),
+           (select avg(w.score) from (
+                select score from scores
+                where scores.user_id = a.user_id and created_at < p_since and score is not null
+                order by created_at desc limit p_window
+           ) w)
+    from active a
+    order by a.user_id;
+$$;
@@ -0,0 +1,25 @@
+-- /usage の top_users に LINE の user_id を出さず、users.user_code（鍵付きハッシュから導出した公開用 ID）を返す。
+-- users に行の無いユーザーは user_code が null になる。
+create or replace function get_usage_report(p_month date, p_day date, p_limit integer)
+returns jsonb language sql stable as $$
+    select jsonb_build_object(
+        'global_month', coalesce((select units from usage_monthly where month = p_month), 0),
+        'top_users', coalesce((
+            select jsonb_agg(jsonb_build_object(
+                       'user_code', u.user_code, 'month_units', t.month_units, 'today', t.today
+                   ) order by t.month_units desc)
+            from (
+                select user_id,
+                       sum(units) as month_units,
+                       coalesce(sum(units) filter (where day = p_day), 0) as today
+                from usage_daily
+                where day >= p_month and day < (p_month + interval '1 month')
+                group by user_id
+                order by 2 desc
+                limit p_limit
+            ) t
+            left join users u on u.id = t.user_id
+        ), '[]'::jsonb),
+        'deferred_images', (select count(*) from deferred_images)
+    );
+$$;
@@ -0,0 +1,36 @@
+-- 順位インデックス（utils/leaderboard.py）の差分同期を、コミット順で取りこぼさないようにする。
+-- rating_version は採番順でコミット順ではないため、大きな番号が先にコミットされて同期された後に
+-- 小さな番号（apply_rating_batch の一括更新など）がコミットされると、番号だけでは見つけられない。
+-- 行に更新したトランザクションの ID を残し、同期のたびに「前回の読み取り時点で実行中だった最古の
+-- トランザクション（スナップショットの xmin）」以降の行を読み直す。xmin より前のトランザクションは
+-- 前回の読み取りの時点でコミット（かロールバック）済みなので、前回すでに見えている。
+alter table users add column if not exists rating_xid xid8;
+
+create or replace function bump_rating_version()
+returns trigger language plpgsql as $$
+begin
+    new.rating_version := nextval('users_rating_version_seq');
+    new.rating_xid := pg_current_xact_id();
+    return new;
+end;
+$$;
+
+create index if not exists users_rating_xid_idx on users (rating_xid);
+
+-- p_since_xid が null の時は全件（初回）。xmin は次回の p_since_xid（同じスナップショットで読む）
+create or replace function get_rating_changes(p_since_xid text, p_after_version bigint, p_limit integer)
+returns jsonb language sql stable as $$
+    select jsonb_build_object(
+        'xmin', pg_snapshot_xmin(pg_current_snapshot())::text,
+        'rows', coalesce((
+            select jsonb_agg(t order by t.rating_version) from (
+                select id, average_score, rating_version
+                from users
+                where rating_version > p_after_version
+                  and (p_since_xid is null or rating_xid >= p_since_xid::xid8)
+                order by rating_version
+                limit p_limit
+            ) t
+        ), '[]'::jsonb)
+    );
+$$;
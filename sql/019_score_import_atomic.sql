@@ -0,0 +1,40 @@
+-- スコアのインポート（utils/score_io.import_scores）を1トランザクションで行う。
+-- 全行の insert・score_count の加算・平均スコアの再計算を1回の RPC にまとめ、途中で失敗しても何も残らないようにする
+-- （score_version は scores のトリガーで進む。sql/014_scores_version.sql）。
+-- 各行の client_id（sql/007_write_behind.sql）はインポートの冪等キーと行番号から決まるため、
+-- 同じインポートを再送しても既に入った行は無視し、新しく入った件数だけを返す。
+drop function if exists apply_score_import(text, integer);
+
+create or replace function import_scores(p_user_id text, p_rows jsonb)
+returns integer language plpgsql as $$
+declare
+    v_inserted integer;
+begin
+    with r as (
+        select * from jsonb_to_recordset(p_rows) as x(
+            client_id uuid,
+            score double precision,
+            song_name text,
+            artist_name text,
+            genre_tags text[],
+            comment text,
+            created_at timestamp
+        )
+    ), inserted as (
+        insert into scores (client_id, user_id, score, song_name, artist_name, genre_tags, comment, created_at)
+        select client_id, p_user_id, score, song_name, artist_name, coalesce(genre_tags, '{}'), comment, created_at
+        from r
+        on conflict (client_id) do nothing
+        returning 1
+    )
+    select count(*)::integer into v_inserted from inserted;
+
+    if v_inserted > 0 then
+        update users
+        set score_count = coalesce(score_count, 0) + v_inserted
+        where id = p_user_id;
+        perform update_average_score(p_user_id);
+    end if;
+    return v_inserted;
+end;
+$$;
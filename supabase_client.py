@@ -1,16 +1,200 @@
 # supabase_client.py
+#
+# ・PostgREST への接続は SUPABASE_POOL_SIZE 本までのプール（HTTP/2, keep-alive）で使い回す
+# ・読み取り専用のクエリ（成績メッセージ, /api/me, /api/scores）は reader() 経由で
+#   SUPABASE_READ_URL（リードレプリカなど。未設定なら書き込みと同じ接続先）へ送る。
+#   ただし直近 SUPABASE_READ_AFTER_WRITE 秒以内に書き込んだユーザーの読み取りは、
+#   レプリカの遅延で自分の書き込みが見えないことがないよう書き込み先から読む
+# ・クエリごとの所要時間（応答ヘッダーを受け取るまで）を supabase_query_seconds に記録する
 
-from supabase import create_client
 import os
-from dotenv import load_dotenv
-
-# .env.dev または .env.production を自動で読み込み
-env_file = os.getenv("ENV_FILE", ".env.dev")
-load_dotenv(dotenv_path=env_file)
+import time
+import threading
+import config  # noqa: F401  .env の読み込み
+from utils.metrics import observe
 
 # 接続情報
 url = os.getenv("SUPABASE_URL")
 key = os.getenv("SUPABASE_KEY")
+read_url = os.getenv("SUPABASE_READ_URL") or url
+read_key = os.getenv("SUPABASE_READ_KEY") or key
+
+# 接続プール（クライアント1つあたり）
+POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", 20))
+POOL_KEEPALIVE = int(os.getenv("SUPABASE_POOL_KEEPALIVE", POOL_SIZE))
+KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", 60))
+HTTP2 = os.getenv("SUPABASE_HTTP2", "1") != "0"
+TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", 10))
+# 書き込み後この秒数は、そのユーザーの読み取りも書き込み先へ送る
+READ_AFTER_WRITE = float(os.getenv("SUPABASE_READ_AFTER_WRITE", 10))
+
+_client = None
+_read_client = None
+_client_lock = threading.Lock()
+
+
+def _limits():
+    import httpx
+    return httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_KEEPALIVE,
+                        keepalive_expiry=KEEPALIVE_EXPIRY)
+
+def _options(async_=False):
+    from supabase.lib.client_options import AsyncClientOptions, SyncClientOptions
+    options_cls = AsyncClientOptions if async_ else SyncClientOptions
+    return options_cls(postgrest_client_timeout=TIMEOUT)
+
+def _query_target(request) -> str:
+    # /rest/v1/scores → "scores", /rest/v1/rpc/get_usage → "rpc/get_usage"
+    return request.url.path.split("/rest/v1/", 1)[-1] or "-"
+
+def _hooks(endpoint):
+    def on_request(request):
+        request.extensions["scorebot_started"] = time.perf_counter()
+
+    def on_response(response):
+        started = response.request.extensions.get("scorebot_started")
+        if started is not None:
+            observe("supabase_query_seconds", time.perf_counter() - started, endpoint=endpoint,
+                    target=_query_target(response.request), method=response.request.method)
+    return {"request": [on_request], "response": [on_response]}
+
+def _async_hooks(endpoint):
+    hooks = _hooks(endpoint)
+    async def on_request(request):
+        hooks["request"][0](request)
+    async def on_response(response):
+        hooks["response"][0](response)
+    return {"request": [on_request], "response": [on_response]}
+
+def _tune(client, endpoint, async_=False):
+    """
+    SDK が作る PostgREST のセッションを、プール設定と計測フック付きのものに差し替える
+    """
+    from postgrest.utils import AsyncClient, SyncClient
+    postgrest = client.postgrest
+    old = postgrest.session
+    session_cls = AsyncClient if async_ else SyncClient
+    postgrest.session = session_cls(
+        base_url=old.base_url, headers=old.headers, timeout=old.timeout,
+        follow_redirects=True, http2=HTTP2, limits=_limits(),
+        event_hooks=(_async_hooks if async_ else _hooks)(endpoint),
+    )
+    return client, old
+
+
+def get_supabase():
+    """
+    Supabase クライアントを初回呼び出し時に生成する（SDK の import もここで行う）
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from supabase import create_client
+                client, old = _tune(create_client(url, key, _options()), "primary")
+                old.close()
+                _client = client
+    return _client
+
+def get_supabase_read():
+    """
+    読み取り専用クライアント。SUPABASE_READ_URL 未設定なら書き込みと同じクライアント
+    """
+    global _read_client
+    if read_url == url and read_key == key:
+        return get_supabase()
+    if _read_client is None:
+        with _client_lock:
+            if _read_client is None:
+                from supabase import create_client
+                client, old = _tune(create_client(read_url, read_key, _options()), "read")
+                old.close()
+                _read_client = client
+    return _read_client
+
+
+class _LazySupabase:
+    """
+    `from supabase_client import supabase` の互換用。属性に触れた時点で実クライアントを生成する
+    """
+
+    def __init__(self, factory=get_supabase):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+
+# Supabase クライアント（起動時には生成しない）
+supabase = _LazySupabase()
+supabase_read = _LazySupabase(get_supabase_read)
+
+
+# ==============================
+# 書き込み直後の読み取り
+# ==============================
+
+# user_id → 最後に書き込んだ時刻（time.monotonic）
+_recent_writes = {}
+_recent_writes_lock = threading.Lock()
+
+def mark_written(user_id: str):
+    """
+    user_id の行を書き込んだことを記録する（しばらくの読み取りを書き込み先へ送る）。
+    同じユーザーの読み取りの相乗り（utils/singleflight.py）と時系列のキャッシュ（utils/score_series.py）も捨てる
+    """
+    from utils.singleflight import forget
+    from utils.score_series import invalidate
+    now = time.monotonic()
+    with _recent_writes_lock:
+        _recent_writes[user_id] = now
+        if len(_recent_writes) > 10000:
+            for uid, at in list(_recent_writes.items()):
+                if now - at > READ_AFTER_WRITE:
+                    del _recent_writes[uid]
+    forget(user_id)
+    invalidate(user_id)
+
+def _read_stale(user_id) -> bool:
+    if user_id is None:
+        return False
+    with _recent_writes_lock:
+        at = _recent_writes.get(user_id)
+    return at is not None and time.monotonic() - at < READ_AFTER_WRITE
+
+def reader(user_id: str = None):
+    """
+    読み取り用のクライアント（user_id が直近に書き込んでいれば書き込み先）
+    """
+    return get_supabase() if _read_stale(user_id) else get_supabase_read()
+
+
+# ==============================
+# 非同期モード用クライアント（イベントループ上で初回に生成）
+# ==============================
+
+_async_supabase = None
+_async_read_supabase = None
+
+async def get_async_supabase():
+    global _async_supabase
+    if _async_supabase is None:
+        from supabase import acreate_client
+        client, old = _tune(await acreate_client(url, key, _options(async_=True)), "primary", async_=True)
+        await old.aclose()
+        _async_supabase = client
+    return _async_supabase
+
+async def get_async_supabase_read():
+    global _async_read_supabase
+    if read_url == url and read_key == key:
+        return await get_async_supabase()
+    if _async_read_supabase is None:
+        from supabase import acreate_client
+        client, old = _tune(await acreate_client(read_url, read_key, _options(async_=True)), "read", async_=True)
+        await old.aclose()
+        _async_read_supabase = client
+    return _async_read_supabase
 
-# Supabase クライアント生成
-supabase = create_client(url, key)
+async def async_reader(user_id: str = None):
+    return await (get_async_supabase() if _read_stale(user_id) else get_async_supabase_read())
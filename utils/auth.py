@@ -0,0 +1,77 @@
+# utils/auth.py
+# LINE ログイン IDトークンの共通検証（検証済みトークンのキャッシュ付き）
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+LINE_CLIENT_ID = os.getenv("LINE_LOGIN_CLIENT_ID")
+LINE_CHANNEL_SECRET = os.getenv("LINE_LOGIN_CLIENT_SECRET")
+LINE_ISSUER = "https://access.line.me"
+
+# 保持する検証済みトークン数の上限
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 1024))
+
+# 検証コストの計測値（/metrics などから参照する）
+token_metrics = {
+    "cache_hits": 0,
+    "cache_misses": 0,
+    "verify_failures": 0,
+    "verify_seconds_total": 0.0,
+}
+
+# sha256(token) → (exp, payload)
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _decode(id_token: str) -> dict:
+    from jose import jwt as jose_jwt
+    return jose_jwt.decode(
+        id_token,
+        LINE_CHANNEL_SECRET,
+        algorithms=["HS256"],
+        audience=LINE_CLIENT_ID,
+        issuer=LINE_ISSUER
+    )
+
+def verify_id_token(id_token: str) -> dict:
+    """
+    IDトークンを検証してペイロードを返す。
+    同じトークンは exp を迎えるまで署名検証を省略する。
+    """
+    key = hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+    now = time.time()
+
+    with _lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > now:
+            _cache.move_to_end(key)
+            token_metrics["cache_hits"] += 1
+            return dict(entry[1])
+        if entry:
+            del _cache[key]
+
+    started = time.perf_counter()
+    try:
+        payload = _decode(id_token)
+    except Exception:
+        with _lock:
+            token_metrics["verify_failures"] += 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        with _lock:
+            token_metrics["cache_misses"] += 1
+            token_metrics["verify_seconds_total"] += elapsed
+
+    exp = payload.get("exp")
+    if exp is not None:
+        with _lock:
+            _cache[key] = (float(exp), payload)
+            _cache.move_to_end(key)
+            while len(_cache) > TOKEN_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return dict(payload)
@@ -1,12 +1,7 @@
 # ✅ correction_ui.py
 # フォーム風の一括修正をLINE Botで実現
 
-from linebot.models import (
-    TextSendMessage, FlexSendMessage, BubbleContainer, BoxComponent,
-    TextComponent, ButtonComponent, MessageAction
-)
-
-# 一時的な修正キャッシュ（後で Supabase に切り替え可能）
+# 一時的な修正キャッシュ（修正フォームの入力値は utils/score_correction.py で corrections.pending に保存）
 user_correction_cache = {}
 
 def set_temp_value(user_id, field, value):
@@ -18,67 +13,75 @@ def get_temp_value(user_id):
 def clear_temp_value(user_id):
     user_correction_cache.pop(user_id, None)
 
-def send_correction_form(reply_token, line_bot_api):
-    flex = FlexSendMessage(
-        alt_text="修正フォーム",
-        contents={
-            "type": "bubble",
-            "size": "mega",
-            "body": {
-                "type": "box",
-                "layout": "vertical",
-                "spacing": "md",
-                "contents": [
-                    {
-                        "type": "text",
-                        "text": "🛠 修正フォーム",
-                        "weight": "bold",
-                        "size": "xl",
-                        "margin": "md"
-                    },
-                    {
-                        "type": "text",
-                        "text": "修正したい項目を選んでください",
-                        "size": "sm",
-                        "color": "#888888",
-                        "wrap": True
-                    },
-                    {
-                        "type": "separator",
-                        "margin": "md"
-                    },
-                    {
-                        "type": "button",
-                        "action": {"type": "message", "label": "📊 点数を修正", "text": "スコア"},
-                        "style": "primary",
-                        "margin": "md"
-                    },
-                    {
-                        "type": "button",
-                        "action": {"type": "message", "label": "🎵 曲名を修正", "text": "曲名"},
-                        "style": "primary"
-                    },
-                    {
-                        "type": "button",
-                        "action": {"type": "message", "label": "👤 アーティストを修正", "text": "アーティスト"},
-                        "style": "primary"
-                    },
-                    {
-                        "type": "button",
-                        "action": {"type": "message", "label": "💬 コメントを修正", "text": "コメント"},
-                        "style": "primary"
-                    },
-                    {
-                        "type": "button",
-                        "action": {"type": "message", "label": "✅ 全て入力完了！", "text": "修正完了"},
-                        "style": "secondary",
-                        "color": "#aaaaaa",
-                        "margin": "lg"
-                    }
-                ]
+# 修正フォーム（ボタンの送信テキストは handle_text の修正フローに対応）
+CORRECTION_FORM = {
+    "type": "bubble",
+    "size": "mega",
+    "body": {
+        "type": "box",
+        "layout": "vertical",
+        "spacing": "md",
+        "contents": [
+            {
+                "type": "text",
+                "text": "🛠 修正フォーム",
+                "weight": "bold",
+                "size": "xl",
+                "margin": "md"
+            },
+            {
+                "type": "text",
+                "text": "修正したい項目を選んでください",
+                "size": "sm",
+                "color": "#888888",
+                "wrap": True
+            },
+            {
+                "type": "separator",
+                "margin": "md"
+            },
+            {
+                "type": "button",
+                "action": {"type": "message", "label": "📊 点数を修正", "text": "スコア"},
+                "style": "primary",
+                "margin": "md"
+            },
+            {
+                "type": "button",
+                "action": {"type": "message", "label": "🎵 曲名を修正", "text": "曲名"},
+                "style": "primary"
+            },
+            {
+                "type": "button",
+                "action": {"type": "message", "label": "👤 アーティストを修正", "text": "アーティスト"},
+                "style": "primary"
+            },
+            {
+                "type": "button",
+                "action": {"type": "message", "label": "💬 コメントを修正", "text": "コメント"},
+                "style": "primary"
+            },
+            {
+                "type": "button",
+                "action": {"type": "message", "label": "✅ 全て入力完了！", "text": "修正完了"},
+                "style": "secondary",
+                "color": "#aaaaaa",
+                "margin": "lg"
             }
-        }
-    )
+        ]
+    }
+}
+
+def get_correction_form():
+    """
+    Messaging API v3 の FlexMessage
+    """
+    from linebot.v3.messaging.models import FlexMessage, FlexContainer
+    return FlexMessage(alt_text="修正フォーム", contents=FlexContainer.from_dict(CORRECTION_FORM))
+
+def send_correction_form(reply_token, line_bot_api):
+    from linebot.models import FlexSendMessage
+    flex = FlexSendMessage(alt_text="修正フォーム", contents=CORRECTION_FORM)
     line_bot_api.reply_message(reply_token, flex)
 
 
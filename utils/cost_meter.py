@@ -0,0 +1,163 @@
+# utils/cost_meter.py
+# 外部 API の利用量（ユーザー別・全体）の計測と、予算に応じた処理の段階的な縮退
+#
+# 画像1枚ごとに Vision / GPT / MusicBrainz の呼び出しを単価（COST_UNIT_*）で換算した「ユニット」として記録し
+# （usage_daily / usage_monthly, sql/012_cost_metering.sql）、次の画像の処理前に
+# ユーザーの当日分と全体の当月分の消化率から処理の段階を決める。
+#
+#   full           … Vision + GPT + MusicBrainz（通常）
+#   no_enrichment  … アーティスト情報（MusicBrainz）を付けない
+#   template       … Vision + 点数の抽出のみ（GPT も使わない。曲名・アーティストは「修正」で入力）
+#   deferred       … 画像を受け付けるだけにして deferred_images に積み、予算が戻ってから
+#                     scripts/drain_deferred.py が登録して結果をプッシュで知らせる
+#
+# 全体の予算はユーザーが実際に使った分だけ消化する（縮退・保留中の画像は数えない）ため、
+# 1人が連投しても先にその人だけが縮退し、他のユーザーの処理や全体の支出には波及しない。
+
+import os
+import hmac
+import logging
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from utils.metrics import inc, METRICS_TOKEN
+
+FULL, NO_ENRICHMENT, TEMPLATE, DEFERRED = "full", "no_enrichment", "template", "deferred"
+TIERS = (FULL, NO_ENRICHMENT, TEMPLATE, DEFERRED)
+
+# 1回あたりのユニット（既定は Vision・GPT とも 1。MusicBrainz は無料だが回数は記録する）
+UNIT_COSTS = {
+    "vision": float(os.getenv("COST_UNIT_VISION", 1.0)),
+    "openai": float(os.getenv("COST_UNIT_OPENAI", 1.0)),
+    "musicbrainz": float(os.getenv("COST_UNIT_MUSICBRAINZ", 0.0)),
+}
+# 0 は無制限
+USER_DAILY_BUDGET = float(os.getenv("COST_USER_DAILY_BUDGET", 40))
+GLOBAL_MONTHLY_BUDGET = float(os.getenv("COST_GLOBAL_MONTHLY_BUDGET", 0))
+# 予算の消化率がこれ以上で no_enrichment / template / deferred に落とす
+DEGRADE_AT = [float(x) for x in os.getenv("COST_DEGRADE_AT", "0.7,0.85,1.0").split(",")]
+# 保留できる画像の数（1ユーザーあたり）。超えた分は受け付けない
+DEFERRED_MAX_PER_USER = int(os.getenv("COST_DEFERRED_MAX_PER_USER", 10))
+
+JST = timezone(timedelta(hours=9))
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cost-meter")
+
+
+def today():
+    return datetime.now(JST).date()
+
+def _tier_of(used: float, budget: float) -> str:
+    if not budget:
+        return FULL
+    ratio = used / budget
+    tier = FULL
+    for step, threshold in zip(TIERS[1:], DEGRADE_AT):
+        if ratio >= threshold:
+            tier = step
+    return tier
+
+def choose_tier(usage: dict) -> str:
+    """
+    usage = {"user_day": 当日のユーザーの消化ユニット, "global_month": 当月の全体の消化ユニット}
+    """
+    user_tier = _tier_of(usage.get("user_day") or 0, USER_DAILY_BUDGET)
+    global_tier = _tier_of(usage.get("global_month") or 0, GLOBAL_MONTHLY_BUDGET)
+    return max(user_tier, global_tier, key=TIERS.index)
+
+
+def get_usage(user_id: str) -> dict:
+    from supabase_client import supabase
+    day = today()
+    return supabase.rpc("get_usage", {
+        "p_user_id": user_id, "p_day": day.isoformat(), "p_month": day.replace(day=1).isoformat()
+    }).execute().data or {}
+
+def tier_for(user_id: str) -> str:
+    """
+    次の画像をどの段階で処理するか。利用量を読めない時は通常どおり処理する
+    """
+    try:
+        tier = choose_tier(get_usage(user_id))
+    except Exception as e:
+        logging.warning(f"⚠️ 利用量の取得に失敗（通常処理で続行）: {e}")
+        return FULL
+    if tier != FULL:
+        inc("cost_degraded_total", tier=tier)
+        logging.info(f"💸 予算に応じて縮退: {tier}（user_id={user_id}）")
+    return tier
+
+
+def units_of(calls: dict) -> float:
+    return sum(UNIT_COSTS.get(service, 0) * n for service, n in calls.items())
+
+def record(user_id: str, calls: dict):
+    """
+    実際に呼んだ回数（{"vision": 1, "openai": 1, ...}）を裏で記録する
+    """
+    calls = {k: v for k, v in calls.items() if v}
+    if calls:
+        _executor.submit(_write, user_id, today(), calls)
+
+def _write(user_id, day, calls):
+    from supabase_client import supabase
+    try:
+        supabase.rpc("add_usage", {
+            "p_user_id": user_id, "p_day": day.isoformat(), "p_month": day.replace(day=1).isoformat(),
+            "p_calls": calls, "p_units": units_of(calls),
+        }).execute()
+        for service, n in calls.items():
+            inc("cost_units_total", UNIT_COSTS.get(service, 0) * n, service=service)
+    except Exception as e:
+        logging.warning(f"⚠️ 利用量の記録に失敗（user_id={user_id}）: {e}")
+
+
+# ==============================
+# 保留（deferred）
+# ==============================
+
+def defer_image(user_id: str, message_id: str, content: bytes) -> bool:
+    """
+    画像を deferred_images に積む。ユーザーの保留数が上限なら積まずに False
+    """
+    from supabase_client import supabase
+    from utils.ocr_archive import to_bytea
+    queued = supabase.table("deferred_images").select("id") \
+        .eq("user_id", user_id).limit(DEFERRED_MAX_PER_USER).execute().data or []
+    if len(queued) >= DEFERRED_MAX_PER_USER:
+        return False
+    supabase.table("deferred_images").insert({
+        "user_id": user_id, "message_id": message_id, "payload": to_bytea(content)
+    }).execute()
+    inc("cost_deferred_total")
+    return True
+
+
+def is_report_authorized(auth_header) -> bool:
+    # /metrics と違い、METRICS_TOKEN 未設定の時は誰にも見せない
+    return bool(METRICS_TOKEN) and hmac.compare_digest(auth_header or "", f"Bearer {METRICS_TOKEN}")
+
+def report(limit: int = 20) -> dict:
+    """
+    /usage 用：当月の全体の消化量と予算、ユニットの多いユーザー（user_code）、保留中の画像数
+    """
+    from supabase_client import supabase
+    day = today()
+    data = supabase.rpc("get_usage_report", {
+        "p_month": day.replace(day=1).isoformat(), "p_day": day.isoformat(), "p_limit": limit
+    }).execute().data or {}
+    global_month = data.get("global_month") or 0
+    return {
+        "month": day.strftime("%Y-%m"),
+        "unit_costs": UNIT_COSTS,
+        "global": {
+            "units": global_month,
+            "budget": GLOBAL_MONTHLY_BUDGET or None,
+            "tier": _tier_of(global_month, GLOBAL_MONTHLY_BUDGET),
+        },
+        "user_daily_budget": USER_DAILY_BUDGET or None,
+        "top_users": [
+            {**u, "tier": _tier_of(u.get("today") or 0, USER_DAILY_BUDGET)}
+            for u in data.get("top_users") or []
+        ],
+        "deferred_images": data.get("deferred_images") or 0,
+    }
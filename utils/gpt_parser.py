@@ -1,15 +1,38 @@
 import os
 import logging
-from dotenv import load_dotenv
-from openai import OpenAI
 import json
+from utils import resilience
+from utils.resilience import CircuitOpenError
 
-# .env 読み込み（忘れがち！）
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# クライアントは初回呼び出し時に生成する（openai の import が重いため起動時には読まない）
+_client = None
+# 非同期モード用（イベントループ内で初回生成）
+_async_client = None
 
-def parse_text_with_gpt(text: str) -> dict:
-    prompt =f"""
+gpt_dependency = resilience.get("openai")
+
+EMPTY_RESULT = {
+    "song_name": None,
+    "artist_name": None,
+}
+
+def _get_client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        # 再試行は SDK に任せず、タイムアウトと回路遮断で扱う（utils/resilience.py）
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    return _client
+
+def _get_async_client():
+    global _async_client
+    if _async_client is None:
+        from openai import AsyncOpenAI
+        _async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    return _async_client
+
+def build_prompt(text: str) -> str:
+    return f"""
 以下のカラオケスコアOCR結果から、曲名、アーティスト名をJSONで抽出してください。
 
 ⚠️ artist_name に「ビブラート」「ビブラート &」などが含まれていた場合は **絶対に除外** してください。
@@ -32,21 +55,50 @@ OCR結果：
 {text}
 """
 
+def _parse_content(response) -> dict:
+    content = response.choices[0].message.content.strip()
+    logging.debug("🧠 GPT構造化出力:\n%s", content)
+    return json.loads(content)
+
+def parse_text_with_gpt(text: str) -> dict:
+    """
+    失敗時・回路が開いている間（utils/resilience.py）は曲名・アーティストなしで続行する
+    """
+    prompt = build_prompt(text)
+
     try:
-        response = client.chat.completions.create(
+        response = gpt_dependency.call(lambda timeout: _get_client().chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "user", "content": prompt}
             ],
             temperature=0.2,
-        )
-        content = response.choices[0].message.content.strip()
-        logging.debug("🧠 GPT構造化出力:\n%s", content)
-        return json.loads(content)
+            timeout=timeout,
+        ))
+        return _parse_content(response)
+    except CircuitOpenError:
+        logging.warning("⏭️ GPT の回路が開いているため構造化を省略")
+        return dict(EMPTY_RESULT)
     except Exception as e:
         logging.exception("❌ GPT構造化に失敗")
-        return {
-            "song_name": None,
-            "artist_name": None,
-           
-        }
+        return dict(EMPTY_RESULT)
+
+async def parse_text_with_gpt_async(text: str) -> dict:
+    prompt = build_prompt(text)
+
+    try:
+        response = await gpt_dependency.call_async(lambda timeout: _get_async_client().chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.2,
+            timeout=timeout,
+        ))
+        return _parse_content(response)
+    except CircuitOpenError:
+        logging.warning("⏭️ GPT の回路が開いているため構造化を省略")
+        return dict(EMPTY_RESULT)
+    except Exception:
+        logging.exception("❌ GPT構造化に失敗")
+        return dict(EMPTY_RESULT)
@@ -0,0 +1,278 @@
+# utils/group_session.py
+# グループ・トークルームでの「カラオケ大会」モード（sql/013_group_sessions.sql）
+#
+# 「大会開始」から「大会終了」までの間、そのグループに送られた画像のスコアを送信者ごとに集計し、
+# 登録のたびに順位表を返信する。順位表はワーカーのメモリ上で1行ずつ足し込む集計
+# （メンバーごとの件数・合計・最高、曲ごとの各メンバーの最高と、そこから決まる対戦成績）から作り、
+# 大会中のスコアを DB から読み直すことはない。終了時に要約だけを group_sessions に1行書く。
+#
+# 対戦成績は「2人とも歌った曲」ごとに、それぞれの最高点で勝ち負けを決めたもの。
+# 曲名が取れなかったスコア（縮退中・点数だけの OCR）は順位表には入るが対戦には数えない。
+#
+# 値はプロセスごと（profile_cache と同じ）。再起動や別のワーカーに届いたイベントからは見えないため、
+# 大会モードを使う時は gunicorn のワーカーを1つにする（非同期モードなら1プロセスで多数の待ち受けを保持できる）。
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+from utils.song_stats import song_key
+
+START_COMMANDS = ("大会開始", "セッション開始")
+END_COMMANDS = ("大会終了", "セッション終了")
+STATUS_COMMANDS = ("順位表",)
+# 最後のスコアからこの秒数が過ぎた大会は、次に触れた時に終了扱いにする
+IDLE_TIMEOUT = float(os.getenv("GROUP_SESSION_IDLE_TIMEOUT", 6 * 3600))
+# 順位表に並べる人数
+STANDINGS_LIMIT = int(os.getenv("GROUP_SESSION_STANDINGS_LIMIT", 10))
+
+NOT_IN_GROUP_MESSAGE = "⚠️ 大会モードはグループ・トークルームでのみ使えます。"
+NO_SESSION_MESSAGE = "⚠️ 開催中の大会はありません。「大会開始」で始められます。"
+
+
+def source_of(event):
+    """
+    (種別, ID)。グループ・トークルーム以外は None
+    """
+    source = event.source
+    if source.type == "group":
+        return "group", source.group_id
+    if source.type == "room":
+        return "room", source.room_id
+    return None
+
+
+class _Member:
+    __slots__ = ("user_id", "name", "count", "total", "best", "best_song")
+
+    def __init__(self, user_id, name):
+        self.user_id = user_id
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.best = None
+        self.best_song = None
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class Session:
+    """
+    1つのグループの大会。add() で1件ずつ足し込み、順位表・対戦成績を常に最新に保つ
+    """
+
+    def __init__(self, source_type: str, source_id: str, started_by: str):
+        self.source_type = source_type
+        self.source_id = source_id
+        self.started_by = started_by
+        self.started_at = datetime.utcnow().isoformat()
+        self.last_activity = time.monotonic()
+        self.score_count = 0
+        self.members = {}     # user_id → _Member（参加順）
+        self.song_best = {}   # song_key → {user_id: 最高点}
+        # (user_id, user_id) → [勝ち, 負け, 引き分け]（前の user_id から見た数。両方向を持つ）
+        self.versus = {}
+
+    def add(self, user_id: str, name: Optional[str], score: float, song_name: Optional[str]):
+        member = self.members.get(user_id)
+        if member is None:
+            member = self.members[user_id] = _Member(user_id, name)
+        elif name:
+            member.name = name
+        member.count += 1
+        member.total += score
+        if member.best is None or score > member.best:
+            member.best, member.best_song = score, song_name
+        self.score_count += 1
+        self.last_activity = time.monotonic()
+
+        key = song_key(song_name)
+        if key is None:
+            return
+        bests = self.song_best.setdefault(key, {})
+        previous = bests.get(user_id)
+        if previous is not None and score <= previous:
+            return
+        bests[user_id] = score
+        # 最高点が変わった曲についてだけ、同じ曲を歌った相手との勝敗を付け直す
+        for other, other_best in bests.items():
+            if other == user_id:
+                continue
+            if previous is not None:
+                self._tally(user_id, other, previous, other_best, -1)
+            self._tally(user_id, other, score, other_best, 1)
+
+    def _tally(self, a, b, score_a, score_b, delta):
+        outcome = 0 if score_a > score_b else 1 if score_a < score_b else 2
+        self.versus.setdefault((a, b), [0, 0, 0])[outcome] += delta
+        self.versus.setdefault((b, a), [0, 0, 0])[(1, 0, 2)[outcome]] += delta
+
+    def standings(self):
+        """
+        最高点 → 平均 → 件数の順に並べたメンバー
+        """
+        return sorted(self.members.values(), key=lambda m: (-(m.best or 0), -m.average, -m.count))
+
+    def record_of(self, user_id: str):
+        """
+        user_id から見た対戦成績 [(相手, 勝ち, 負け, 引き分け), ...]（対戦の無い相手は除く）
+        """
+        rows = []
+        for (a, b), (win, lose, draw) in self.versus.items():
+            if a == user_id and win + lose + draw:
+                rows.append((self.members[b], win, lose, draw))
+        return sorted(rows, key=lambda r: (-(r[1] - r[2]), r[0].name or ""))
+
+    def summary(self) -> dict:
+        """
+        group_sessions.summary に保存する要約
+        """
+        return {
+            "members": [
+                {"user_id": m.user_id, "name": m.name, "count": m.count, "best": m.best,
+                 "best_song": m.best_song, "average": round(m.average, 3)}
+                for m in self.standings()
+            ],
+            "head_to_head": [
+                [a, b, win, lose, draw]
+                for (a, b), (win, lose, draw) in self.versus.items()
+                if a < b and win + lose + draw
+            ],
+            "songs": len(self.song_best),
+        }
+
+
+# source_id → Session
+_sessions = {}
+_lock = threading.Lock()
+
+
+def _expire(source_id: str):
+    # ロックを持って呼ぶ。放置された大会は終了扱いにして要約を残す
+    session = _sessions.get(source_id)
+    if session is not None and time.monotonic() - session.last_activity > IDLE_TIMEOUT:
+        del _sessions[source_id]
+        threading.Thread(target=_persist, args=(session,), daemon=True).start()
+        return None
+    return session
+
+def get(source_id: str) -> Optional[Session]:
+    with _lock:
+        return _expire(source_id)
+
+def start(source_type: str, source_id: str, user_id: str):
+    """
+    大会を始める。(Session, 新しく始めたか)
+    """
+    with _lock:
+        session = _expire(source_id)
+        if session is not None:
+            return session, False
+        session = _sessions[source_id] = Session(source_type, source_id, user_id)
+    logging.info(f"🎤 大会開始: {source_type}={source_id}")
+    return session, True
+
+def end(source_id: str) -> Optional[Session]:
+    """
+    大会を終えて要約を保存する。開催中でなければ None
+    """
+    with _lock:
+        session = _sessions.pop(source_id, None)
+    if session is not None:
+        _persist(session)
+    return session
+
+def record_score(source_id: str, user_id: str, name: Optional[str], score_row: dict) -> Optional[str]:
+    """
+    開催中なら登録したスコアを足し込み、返信に使う順位表を返す（開催中でなければ None）
+    """
+    from utils.profile_cache import cached_display_name
+    name = name or cached_display_name(user_id)
+    with _lock:
+        session = _expire(source_id)
+        if session is None:
+            return None
+        session.add(user_id, name, score_row["score"], score_row.get("song_name"))
+        return format_standings(session, user_id)
+
+
+def _persist(session: Session):
+    from supabase_client import supabase
+    if not session.score_count:
+        return
+    try:
+        supabase.table("group_sessions").insert({
+            "source_type": session.source_type,
+            "source_id": session.source_id,
+            "started_by": session.started_by,
+            "started_at": session.started_at,
+            "ended_at": datetime.utcnow().isoformat(),
+            "score_count": session.score_count,
+            "summary": session.summary(),
+        }).execute()
+        logging.info(f"✅ 大会の結果を保存: {session.source_type}={session.source_id}（{session.score_count} 件）")
+    except Exception as e:
+        logging.error(f"❌ 大会の結果の保存に失敗: {e}")
+
+
+# ==============================
+# 返信
+# ==============================
+
+MEDALS = {1: "🥇", 2: "🥈", 3: "🥉"}
+
+def _display_name(member: _Member) -> str:
+    from utils.profile_cache import cached_display_name
+    return member.name or cached_display_name(member.user_id) or "メンバー"
+
+def format_standings(session: Session, user_id: Optional[str] = None, title: str = "🏆 現在の順位") -> str:
+    lines = [f"{title}（{session.score_count} 曲）"]
+    for rank, m in enumerate(session.standings()[:STANDINGS_LIMIT], start=1):
+        lines.append(
+            f"{MEDALS.get(rank, f'{rank}.')} {_display_name(m)}  最高 {m.best:.3f}"
+            f"（平均 {m.average:.3f} / {m.count} 曲）"
+        )
+    if len(session.members) > STANDINGS_LIMIT:
+        lines.append(f"ほか {len(session.members) - STANDINGS_LIMIT} 人")
+    if user_id is not None:
+        record = session.record_of(user_id)
+        if record:
+            lines.append("")
+            lines.append(f"⚔️ {_display_name(session.members[user_id])} の対戦成績（同じ曲の最高点）")
+            for other, win, lose, draw in record:
+                lines.append(f"vs {_display_name(other)}: {win}勝{lose}敗" + (f"{draw}分" if draw else ""))
+    return "\n".join(lines)
+
+def handle_command(event, text: str) -> Optional[str]:
+    """
+    大会モードのコマンドなら返信文、そうでなければ None
+    """
+    if text not in START_COMMANDS + END_COMMANDS + STATUS_COMMANDS:
+        return None
+    source = source_of(event)
+    if source is None:
+        return NOT_IN_GROUP_MESSAGE
+    source_type, source_id = source
+    if text in START_COMMANDS:
+        session, created = start(source_type, source_id, event.source.user_id)
+        if not created:
+            return f"ℹ️ 大会は開催中です。\n\n{format_standings(session)}" if session.score_count \
+                else "ℹ️ 大会は開催中です。スコア画像を送ってください。"
+        return ("🎤 大会を始めました！\n"
+                "このグループに送られたスコア画像を送った人の記録として集計します。\n"
+                f"「{STATUS_COMMANDS[0]}」で途中経過、「{END_COMMANDS[0]}」で結果発表です。")
+    if text in END_COMMANDS:
+        session = end(source_id)
+        if session is None:
+            return NO_SESSION_MESSAGE
+        if not session.score_count:
+            return "🎤 大会を終了しました（スコアの登録はありませんでした）。"
+        return f"{format_standings(session, title='🎉 最終結果')}\n\nお疲れさまでした！"
+    session = get(source_id)
+    if session is None:
+        return NO_SESSION_MESSAGE
+    return format_standings(session) if session.score_count else "ℹ️ まだスコアの登録はありません。"
@@ -0,0 +1,178 @@
+# utils/leaderboard.py
+# 全ユーザーの平均スコア（users.average_score）の順位・パーセンタイル
+
+import os
+import time
+import logging
+import threading
+from typing import Optional
+from supabase_client import supabase
+
+# 0.001 点刻みのバケット（0.000〜100.000）
+SCALE = 1000
+MAX_BUCKET = 100 * SCALE
+# 他ワーカーの更新を取り込む間隔（秒）
+SYNC_INTERVAL = float(os.getenv("LEADERBOARD_SYNC_INTERVAL", 5))
+SYNC_PAGE_SIZE = 1000
+
+
+class FenwickTree:
+    """
+    バケットごとの人数を保持し、累積和と k 番目の位置を O(log n) で求める
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.tree = [0] * (size + 1)
+        self.total = 0
+        self._top_bit = 1 << (size.bit_length() - 1)
+
+    def add(self, index: int, delta: int):
+        self.total += delta
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, index: int) -> int:
+        """
+        バケット 0..index の合計
+        """
+        result = 0
+        i = min(index, self.size - 1) + 1
+        while i > 0:
+            result += self.tree[i]
+            i -= i & -i
+        return result
+
+    def find(self, k: int) -> int:
+        """
+        累積和が k 以上になる最小のバケット（k は 1 始まり）
+        """
+        pos = 0
+        step = self._top_bit
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] < k:
+                pos = nxt
+                k -= self.tree[nxt]
+            step >>= 1
+        return pos
+
+
+def to_bucket(score: float) -> int:
+    return max(0, min(MAX_BUCKET, int(round(float(score) * SCALE))))
+
+
+class Leaderboard:
+    """
+    プロセス内の順位インデックス。
+    前回の同期時点で実行中だった最古のトランザクション（users.rating_xid と比べる xmin）以降の
+    更新を毎回読み直すため、採番とコミットの順が前後しても取りこぼさない（sql/018_rating_changes.sql）。
+    ユーザーごとの rating_version で古い更新を無視するので、全ワーカーが同じ最終状態に収束する。
+    """
+
+    def __init__(self):
+        self.tree = FenwickTree(MAX_BUCKET + 1)
+        self.user_bucket = {}
+        self.user_version = {}
+        self.bucket_users = {}
+        self.xmin = None
+        self.synced_at = 0.0
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+
+    # ---- 更新 ----
+
+    def update(self, user_id: str, average_score: Optional[float], version: Optional[int] = None):
+        """
+        version が既知の値より古い更新は無視する（取り込み順の前後に依存しない）
+        """
+        with self._lock:
+            if version is not None:
+                if version < self.user_version.get(user_id, 0):
+                    return
+                self.user_version[user_id] = version
+            old = self.user_bucket.pop(user_id, None)
+            if old is not None:
+                self.tree.add(old, -1)
+                members = self.bucket_users[old]
+                members.discard(user_id)
+                if not members:
+                    del self.bucket_users[old]
+            if average_score is None:
+                return
+            bucket = to_bucket(average_score)
+            self.user_bucket[user_id] = bucket
+            self.bucket_users.setdefault(bucket, set()).add(user_id)
+            self.tree.add(bucket, 1)
+
+    def sync(self):
+        """
+        前回以降に average_score が変わったユーザーを取り込む（初回は全件）
+        """
+        with self._sync_lock:
+            after = 0
+            xmin = None
+            while True:
+                data = supabase.rpc("get_rating_changes", {
+                    "p_since_xid": self.xmin, "p_after_version": after, "p_limit": SYNC_PAGE_SIZE
+                }).execute().data or {}
+                # 次回は最初のページのスナップショットの xmin から（後のページの xmin 以下なので安全側）
+                if xmin is None:
+                    xmin = data.get("xmin")
+                rows = data.get("rows") or []
+                with self._lock:
+                    for row in rows:
+                        self.update(row["id"], row.get("average_score"), row["rating_version"])
+                if len(rows) < SYNC_PAGE_SIZE:
+                    break
+                after = rows[-1]["rating_version"]
+            self.xmin = xmin
+            self.synced_at = time.monotonic()
+
+    def maybe_sync(self):
+        if time.monotonic() - self.synced_at < SYNC_INTERVAL:
+            return
+        try:
+            self.sync()
+        except Exception:
+            logging.warning("⚠️ ランキングの同期に失敗（前回の状態で応答）", exc_info=True)
+
+    # ---- 参照 ----
+
+    def rank(self, user_id: str) -> Optional[dict]:
+        with self._lock:
+            bucket = self.user_bucket.get(user_id)
+            total = self.tree.total
+            if bucket is None or total == 0:
+                return None
+            higher = total - self.tree.prefix(bucket)
+            rank = higher + 1
+            return {
+                "rank": rank,
+                "total": total,
+                # 自分より低いユーザーの割合
+                "percentile": round(100 * self.tree.prefix(bucket - 1) / total, 1),
+                "top_percent": round(100 * rank / total, 1),
+            }
+
+    def top(self, n: int) -> list:
+        """
+        上位 n 人。同点は同順位
+        """
+        with self._lock:
+            result = []
+            total = self.tree.total
+            k = total
+            while k > 0 and len(result) < n:
+                bucket = self.tree.find(k)
+                members = sorted(self.bucket_users.get(bucket, ()))
+                rank = total - self.tree.prefix(bucket) + 1
+                for user_id in members[:n - len(result)]:
+                    result.append({"user_id": user_id, "average_score": bucket / SCALE, "rank": rank})
+                k -= len(members)
+            return result
+
+
+leaderboard = Leaderboard()
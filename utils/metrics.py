@@ -0,0 +1,167 @@
+# utils/metrics.py
+# 処理段階ごとのレイテンシヒストグラムとカウンタ（Prometheus テキスト形式で出力）
+#
+# 値はプロセスごとに保持する。gunicorn の複数ワーカー構成では、ワーカーごとの値を
+# Prometheus 側で sum() して使う想定。
+
+import os
+import hmac
+import time
+import threading
+from bisect import bisect_left
+from utils.auth import token_metrics
+from utils.tracing import record_span
+
+PREFIX = "scorebot_"
+# 設定時は /metrics に Authorization: Bearer <METRICS_TOKEN> を要求する
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# 秒。外部 API（Vision / GPT / MusicBrainz の固定 sleep 込み）を想定した刻み
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 名前 → (種別, 説明)
+METRICS = {
+    "stage_seconds": ("histogram", "handle_image / handle_text の処理段階ごとの所要時間（秒）"),
+    "stage_errors_total": ("counter", "例外で終わった処理段階の数"),
+    "http_request_seconds": ("histogram", "REST API のリクエスト処理時間（秒）"),
+    "external_errors_total": ("counter", "外部サービス呼び出しの失敗数"),
+    "retries_total": ("counter", "外部サービス呼び出し・一意制約違反による再試行の数"),
+    "cache_hits_total": ("counter", "キャッシュヒット数"),
+    "cache_misses_total": ("counter", "キャッシュミス数"),
+    "circuit_open": ("gauge", "外部依存の回路が開いているか（1: 開・半開, 0: 閉）"),
+    "circuit_rejections_total": ("counter", "回路が開いていたため呼ばずに失敗させた数"),
+    "hedged_requests_total": ("counter", "ヘッジとして追加で出したリクエストの数"),
+    "cost_units_total": ("counter", "外部 API の利用量（ユニット, utils/cost_meter.py）"),
+    "cost_degraded_total": ("counter", "予算に応じて縮退して処理した画像の数"),
+    "cost_deferred_total": ("counter", "予算超過のため保留した画像の数"),
+    "supabase_query_seconds": ("histogram", "PostgREST へのクエリごとの所要時間（秒, 応答ヘッダーまで）"),
+    "coalesced_reads_total": ("counter", "実行中の同じ読み取りに相乗りした数（utils/singleflight.py）"),
+    "ocr_engine_total": ("counter", "OCR エンジンごとの採用・失敗の数（utils/ocr_backends.py）"),
+}
+
+_lock = threading.Lock()
+# (名前, ラベル) → [バケットごとの件数..., +Inf の件数] / 合計 / 件数
+_histograms = {}
+# (名前, ラベル) → 値（ゲージも同じ場所に持つ）
+_counters = {}
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(DEFAULT_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+def observe(name: str, value: float, **labels):
+    _observe((name, tuple(sorted(labels.items()))), value)
+
+def _observe(key, value: float):
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = _Histogram()
+        # le は「以下」なので境界値は同じバケットに入れる
+        hist.counts[bisect_left(DEFAULT_BUCKETS, value)] += 1
+        hist.sum += value
+        hist.count += 1
+
+def inc(name: str, amount: float = 1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name: str, value: float, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = value
+
+
+class timed:
+    """
+    with timed("vision"): ... の区間を stage_seconds に記録する。
+    例外で抜けた場合は stage_errors_total も加算する（例外はそのまま送出）。
+    トレース中なら同じ区間をスパンとしても残す（utils/tracing.py）。
+    """
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        _observe(("stage_seconds", (("stage", self.stage),)), elapsed)
+        record_span(self.stage, self.started, elapsed, exc_type is not None)
+        if exc_type is not None:
+            inc("stage_errors_total", stage=self.stage)
+        return False
+
+
+# ==============================
+# 出力
+# ==============================
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render() -> str:
+    """
+    Prometheus テキスト形式（version 0.0.4）
+    """
+    with _lock:
+        histograms = {k: (list(h.counts), h.sum, h.count) for k, h in _histograms.items()}
+        counters = dict(_counters)
+
+    # IDトークン検証キャッシュ（utils/auth.py）の値も同じ形式で出す
+    counters[("cache_hits_total", (("cache", "id_token"),))] = token_metrics["cache_hits"]
+    counters[("cache_misses_total", (("cache", "id_token"),))] = token_metrics["cache_misses"]
+    counters[("external_errors_total", (("service", "id_token_verify"),))] = token_metrics["verify_failures"]
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        full = PREFIX + name
+        lines.append(f"# HELP {full} {help_text}")
+        lines.append(f"# TYPE {full} {kind}")
+        if kind == "histogram":
+            for (n, labels), (counts, total, count) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, c in zip(DEFAULT_BUCKETS, counts):
+                    cumulative += c
+                    lines.append(f"{full}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{full}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{full}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{full}_count{_format_labels(labels)} {count}")
+        else:
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{full}{_format_labels(labels)} {_format_value(value)}")
+
+    lines.append(f"# HELP {PREFIX}id_token_verify_seconds_total IDトークン署名検証の累積時間（秒）")
+    lines.append(f"# TYPE {PREFIX}id_token_verify_seconds_total counter")
+    lines.append(f"{PREFIX}id_token_verify_seconds_total {_format_value(float(token_metrics['verify_seconds_total']))}")
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def is_scrape_authorized(auth_header) -> bool:
+    if not METRICS_TOKEN:
+        return True
+    return hmac.compare_digest(auth_header or "", f"Bearer {METRICS_TOKEN}")
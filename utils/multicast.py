@@ -0,0 +1,192 @@
+# utils/multicast.py
+# LINE マルチキャストの一括送信（定期配信用。scripts/weekly_summary.py から使う）
+#
+# ・同じ本文の宛先を最大 MULTICAST_MAX_RECIPIENTS 人ずつにまとめ、MULTICAST_CONCURRENCY 本まで並行で送る
+#   （まとめられるよう、本文は個人の数字を含まない共通のものにする。個人の数字はクイックリプライへの返信で返す）
+# ・429 / 5xx は Retry-After（無ければ指数バックオフ）だけ待って再送。429 の間は全スレッドが送信を止める
+# ・バッチごとに宛先と本文から決まる X-Line-Retry-Key を付けるため、再送や再実行で二重に届かない
+#   （受付済みのキーは 409 が返るので送信済みとして扱う）
+# ・送信済みの宛先は push_deliveries（sql/011_weekly_summary.sql）に記録し、再実行時は plan_batches の前に除く
+#   （バッチの区切りが前回とずれると Retry-Key も変わるため、バッチ単位で飛ばすだけでは二重に届く）
+
+import os
+import time
+import uuid
+import random
+import hashlib
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence, Tuple
+
+MULTICAST_MAX_RECIPIENTS = 500
+MULTICAST_CONCURRENCY = int(os.getenv("MULTICAST_CONCURRENCY", 4))
+MULTICAST_MAX_ATTEMPTS = int(os.getenv("MULTICAST_MAX_ATTEMPTS", 6))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+PROGRESS_TABLE = "push_deliveries"
+
+RETRY_KEY_NAMESPACE = uuid.UUID("5f0c3b7e-3f1a-4d53-9a55-1f1f0a6b8c21")
+
+
+class Batch:
+    def __init__(self, job_id: str, text: str, recipients: List[str], quick_reply: Sequence[Tuple[str, str]] = ()):
+        self.job_id = job_id
+        self.text = text
+        self.recipients = recipients
+        # クイックリプライのボタン [(ラベル, 押すと送信する文字列)]
+        self.quick_reply = tuple(quick_reply)
+        digest = hashlib.sha256(text.encode("utf-8"))
+        digest.update(",".join(recipients).encode("utf-8"))
+        self.retry_key = str(uuid.uuid5(RETRY_KEY_NAMESPACE, f"{job_id}:{digest.hexdigest()}"))
+
+
+def plan_batches(job_id: str, messages: Dict[str, str], quick_reply: Sequence[Tuple[str, str]] = ()) -> List[Batch]:
+    """
+    {user_id: 本文} を同じ本文ごとにまとめ、宛先を user_id 順に最大 MULTICAST_MAX_RECIPIENTS 人ずつ区切る
+    （同じ入力からは同じバッチ・同じ Retry-Key になる）
+    """
+    by_text = {}
+    for user_id, text in messages.items():
+        by_text.setdefault(text, []).append(user_id)
+    batches = []
+    for text in sorted(by_text):
+        recipients = sorted(by_text[text])
+        for i in range(0, len(recipients), MULTICAST_MAX_RECIPIENTS):
+            batches.append(Batch(job_id, text, recipients[i:i + MULTICAST_MAX_RECIPIENTS], quick_reply))
+    return batches
+
+
+# ==============================
+# 送信済みの記録
+# ==============================
+
+def load_delivered(job_id: str) -> set:
+    from supabase_client import supabase
+    delivered = set()
+    after = ""
+    while True:
+        rows = supabase.table(PROGRESS_TABLE).select("user_id") \
+            .eq("job_id", job_id).gt("user_id", after).order("user_id").limit(1000) \
+            .execute().data or []
+        delivered.update(r["user_id"] for r in rows)
+        if len(rows) < 1000:
+            return delivered
+        after = rows[-1]["user_id"]
+
+def record_delivered(batch: Batch):
+    from supabase_client import supabase
+    supabase.table(PROGRESS_TABLE).upsert(
+        [{"job_id": batch.job_id, "user_id": u} for u in batch.recipients],
+        on_conflict="job_id,user_id", ignore_duplicates=True
+    ).execute()
+
+
+# ==============================
+# 送信
+# ==============================
+
+class MulticastSender:
+    def __init__(self, configuration, concurrency: int = MULTICAST_CONCURRENCY):
+        self.configuration = configuration
+        self.concurrency = concurrency
+        # 429 を受けたらこの時刻まで全スレッドが送信を止める
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.rate_limited = 0
+
+    def _wait_for_pause(self):
+        while True:
+            with self._lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def _pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def send(self, api, batch: Batch) -> str:
+        """
+        1バッチを送る。"sent" / "failed" を返す
+        """
+        from linebot.v3.messaging.exceptions import ApiException
+        from linebot.v3.messaging.models import MulticastRequest, TextMessage, QuickReply, QuickReplyItem, MessageAction
+        quick_reply = QuickReply(items=[
+            QuickReplyItem(action=MessageAction(label=label, text=text)) for label, text in batch.quick_reply
+        ]) if batch.quick_reply else None
+        request = MulticastRequest(to=batch.recipients, messages=[TextMessage(text=batch.text, quick_reply=quick_reply)])
+        for attempt in range(MULTICAST_MAX_ATTEMPTS):
+            self._wait_for_pause()
+            try:
+                api.multicast(request, x_line_retry_key=batch.retry_key)
+                return "sent"
+            except ApiException as e:
+                if e.status == 409:
+                    # 同じ Retry-Key で受付済み（前回の実行・再送で届いている）
+                    return "sent"
+                if e.status != 429 and e.status < 500:
+                    logging.error(f"❌ マルチキャスト失敗（{len(batch.recipients)} 人, status={e.status}）: {e.body}")
+                    return "failed"
+                delay = _retry_after(e) or min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if e.status == 429:
+                    with self._lock:
+                        self.rate_limited += 1
+                    self._pause(delay)
+                logging.warning(f"⏳ マルチキャスト再送待ち {delay:.1f}s（status={e.status}, {attempt + 1} 回目）")
+                if e.status != 429:
+                    time.sleep(delay)
+            except Exception as e:
+                # 接続エラーなど（Retry-Key があるので再送しても二重には届かない）
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+                logging.warning(f"⏳ マルチキャスト再送待ち {delay:.1f}s: {e}")
+                time.sleep(delay)
+        logging.error(f"❌ マルチキャスト失敗（{len(batch.recipients)} 人, 再送 {MULTICAST_MAX_ATTEMPTS} 回）")
+        return "failed"
+
+    def run(self, batches: List[Batch], delivered: set = frozenset(), on_sent=record_delivered) -> Counter:
+        """
+        delivered（送信済みの宛先）だけのバッチは飛ばす。送れたバッチごとに on_sent(batch) で記録する
+        """
+        from linebot.v3.messaging import ApiClient, MessagingApi
+        result = Counter()
+        pending = []
+        for batch in batches:
+            if delivered.issuperset(batch.recipients):
+                result["skipped_batches"] += 1
+                result["skipped_recipients"] += len(batch.recipients)
+            else:
+                pending.append(batch)
+        lock = threading.Lock()
+
+        with ApiClient(self.configuration) as api_client:
+            api = MessagingApi(api_client)
+
+            def work(batch):
+                status = self.send(api, batch)
+                if status == "sent":
+                    try:
+                        on_sent(batch)
+                    except Exception as e:
+                        # 記録できなくても、再実行時は Retry-Key により二重には届かない（24時間以内）
+                        logging.warning(f"⚠️ 送信済みの記録に失敗（{len(batch.recipients)} 人）: {e}")
+                with lock:
+                    result[f"{status}_batches"] += 1
+                    result[f"{status}_recipients"] += len(batch.recipients)
+                    done = result["sent_batches"] + result["failed_batches"]
+                if done % 20 == 0 or done == len(pending):
+                    logging.info(f"📨 {done}/{len(pending)} バッチ")
+
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="multicast") as executor:
+                list(executor.map(work, pending))
+        result["rate_limited"] = self.rate_limited
+        return result
+
+
+def _retry_after(e) -> float:
+    try:
+        return float((e.headers or {}).get("Retry-After"))
+    except (TypeError, ValueError):
+        return 0.0
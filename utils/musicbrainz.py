@@ -1,64 +1,99 @@
-import requests
+import os
+import asyncio
 import time
 import logging
-from requests.exceptions import RequestException
-from supabase_client import supabase
+from typing import TYPE_CHECKING
+from supabase_client import supabase, get_async_supabase
+from utils import resilience
 
-MUSICBRAINZ_BASE_URL = "https://musicbrainz.org/ws/2"
+MUSICBRAINZ_BASE_URL = os.getenv("MUSICBRAINZ_BASE_URL", "https://musicbrainz.org/ws/2")
 USER_AGENT = "KaraokeScoreApp/1.0 (ryo.nakada00.tech@gmail.com)"
 
+if TYPE_CHECKING:
+    import httpx  # 注釈用（実行時は起動を軽くするため import しない）
+
+mb_dependency = resilience.get("musicbrainz")
+
+def _parse_artist(data: dict):
+    if not data.get("artists"):
+        return None
+
+    artist_data = data["artists"][0]
+    return {
+        "musicbrainz_id": artist_data["id"],
+        "name_normalized": artist_data["name"],
+        "genre_tags": [tag["name"] for tag in artist_data.get("tags", [])]
+    }
+
 def search_artist_in_musicbrainz(artist_name: str):
     """
     MusicBrainz APIでアーティストを検索し、結果をSupabaseに保存する。
-    通信失敗時は最大3回まで再試行する。
+    タイムアウト・回路遮断は utils/resilience.py。失敗時・回路が開いている間は付加情報なし（None）。
+    """
+    import requests
+
+    if not mb_dependency.available():
+        logging.info(f"⏭️ MusicBrainz の回路が開いているため検索を省略: {artist_name}")
+        return None
+    time.sleep(1)  # polite usage per MusicBrainz policy
+
+    def fetch(timeout):
+        response = requests.get(
+            f"{MUSICBRAINZ_BASE_URL}/artist/",
+            params={"query": artist_name, "fmt": "json"},
+            headers={"User-Agent": USER_AGENT},
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    try:
+        result = _parse_artist(mb_dependency.call(fetch))
+    except Exception as e:
+        logging.warning(f"⚠️ MusicBrainz API によるアーティスト検索失敗: {artist_name} ({type(e).__name__}: {e})")
+        return None
+    if not result:
+        return None
+
+    # Supabase に UPSERT
+    supabase.table("artists").upsert({
+        **result,
+        "name_raw": artist_name
+    }, on_conflict=["musicbrainz_id"]).execute()
+
+    return result
+
+async def search_artist_in_musicbrainz_async(artist_name: str, http: "httpx.AsyncClient"):
+    """
+    search_artist_in_musicbrainz の非同期版。待機中もイベントループを塞がない。
     """
-    for attempt in range(3):
-        try:
-            time.sleep(1)  # polite usage per MusicBrainz policy
-
-            params = {
-                "query": artist_name,
-                "fmt": "json"
-            }
-            headers = {
-                "User-Agent": USER_AGENT
-            }
-
-            response = requests.get(
-                f"{MUSICBRAINZ_BASE_URL}/artist/",
-                params=params,
-                headers=headers,
-                timeout=5
-            )
-            response.raise_for_status()
-            data = response.json()
-
-            if not data.get("artists"):
-                return None
-
-            artist_data = data["artists"][0]
-            musicbrainz_id = artist_data["id"]
-            name_normalized = artist_data["name"]
-
-            genre_tags = [tag["name"] for tag in artist_data.get("tags", [])]
-
-            # Supabase に UPSERT
-            supabase.table("artists").upsert({
-                "musicbrainz_id": musicbrainz_id,
-                "name_raw": artist_name,
-                "name_normalized": name_normalized,
-                "genre_tags": genre_tags
-            }, on_conflict=["musicbrainz_id"]).execute()
-
-            return {
-                "musicbrainz_id": musicbrainz_id,
-                "name_normalized": name_normalized,
-                "genre_tags": genre_tags
-            }
-
-        except RequestException as e:
-            logging.warning(f"⚠️ MusicBrainz API リクエスト失敗 (attempt {attempt + 1}/3): {e}")
-            time.sleep(1)
-
-    logging.error(f"❌ MusicBrainz API によるアーティスト検索失敗: {artist_name}")
-    return None
+    if not mb_dependency.available():
+        logging.info(f"⏭️ MusicBrainz の回路が開いているため検索を省略: {artist_name}")
+        return None
+    await asyncio.sleep(1)  # polite usage per MusicBrainz policy
+
+    async def fetch(timeout):
+        response = await http.get(
+            f"{MUSICBRAINZ_BASE_URL}/artist/",
+            params={"query": artist_name, "fmt": "json"},
+            headers={"User-Agent": USER_AGENT},
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    try:
+        result = _parse_artist(await mb_dependency.call_async(fetch))
+    except Exception as e:
+        logging.warning(f"⚠️ MusicBrainz API によるアーティスト検索失敗: {artist_name} ({type(e).__name__}: {e})")
+        return None
+    if not result:
+        return None
+
+    db = await get_async_supabase()
+    await db.table("artists").upsert({
+        **result,
+        "name_raw": artist_name
+    }, on_conflict=["musicbrainz_id"]).execute()
+
+    return result
@@ -0,0 +1,62 @@
+# utils/ocr_archive.py
+# Vision の応答（AnnotateImageResponse）の保管
+#
+# 抽出ロジック（_extract_score）や GPT のプロンプトを直した時に、過去の投稿を Vision を呼び直さずに
+# 再抽出できるよう（scripts/reextract_scores.py）、応答を protobuf のままシリアライズ・zlib 圧縮して
+# ocr_annotations（sql/009_ocr_annotations.sql）に scores.client_id と紐付けて保存する。
+# 書き込みは応答経路で待たないよう裏のスレッドで行う（失敗しても登録自体には影響しない）。
+
+import os
+import zlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from utils.metrics import inc
+
+ENABLED = os.getenv("OCR_ARCHIVE", "1") != "0"
+# payload の形式。変える時は decode に分岐を足す（保存済みの行は codec で読み分ける）
+CODEC = "pb-zlib"
+COMPRESS_LEVEL = 9
+TABLE = "ocr_annotations"
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr-archive")
+
+
+def encode(response) -> bytes:
+    return zlib.compress(type(response).serialize(response), COMPRESS_LEVEL)
+
+def decode(payload: bytes, codec: str = CODEC):
+    from google.cloud import vision
+    if codec != CODEC:
+        raise ValueError(f"未対応の codec: {codec}")
+    return vision.AnnotateImageResponse.deserialize(zlib.decompress(payload))
+
+# PostgREST では bytea を 16進文字列（\x...）でやり取りする
+def to_bytea(data: bytes) -> str:
+    return "\\x" + data.hex()
+
+def from_bytea(text: str) -> bytes:
+    return bytes.fromhex(text[2:] if text.startswith("\\x") else text)
+
+
+def save(user_id: str, client_id: Optional[str], response, extracted: dict):
+    """
+    応答を裏で保存する。client_id は登録した scores 行のもの（読み取れず登録しなかった場合は None）、
+    extracted はその時点の抽出結果（score / song_name / artist_name）
+    """
+    if ENABLED:
+        _executor.submit(_write, user_id, client_id, response, extracted)
+
+def _write(user_id, client_id, response, extracted):
+    from supabase_client import supabase
+    try:
+        supabase.table(TABLE).insert({
+            "user_id": user_id,
+            "client_id": client_id,
+            "codec": CODEC,
+            "payload": to_bytea(encode(response)),
+            "extracted": extracted,
+        }).execute()
+    except Exception as e:
+        inc("external_errors_total", service="ocr_archive")
+        logging.warning(f"⚠️ OCR 応答の保存に失敗（user_id={user_id}）: {e}")
@@ -0,0 +1,469 @@
+# utils/ocr_backends.py
+# OCR エンジンの切り替え（Vision を主、ローカルの CPU エンジンを先読み・代替に使う）
+#
+#   vision     … Google Cloud Vision の TEXT_DETECTION（全文が取れる。曲名・アーティストの構造化に必要）
+#   digits     … OpenCV のテンプレート照合で「92.170」形式の点数だけを読む（外部依存なし・数十ms）
+#   tesseract  … Tesseract（pytesseract と tesseract コマンドがある時だけ使える）
+#
+# どのエンジンも Vision と同じ AnnotateImageResponse を返すため、_extract_score・GPT・保管
+# （utils/ocr_archive.py）は使ったエンジンを意識しない。選び方は recognize() の方針による。
+#
+#   1. 先読み: 全文が要らない時（縮退の template 段階）に OCR_FIRST_PASS=1、または Vision の直近の
+#      所要時間の中央値が OCR_LATENCY_BUDGET 秒を超えている時は、ローカルのエンジンを先に試し、
+#      点数の確信度が OCR_MIN_CONFIDENCE 以上ならそれを使う
+#   2. Vision（回路が開いていなければ）
+#   3. Vision が失敗・回路遮断なら、ローカルのエンジンの結果を確信度 OCR_FALLBACK_MIN_CONFIDENCE 以上で使う
+#      （曲名・アーティストは空のまま登録され、「修正」で入力できる）
+
+import os
+import re
+import glob
+import time
+import shutil
+import asyncio
+import logging
+import threading
+from typing import List, Optional
+from utils import resilience
+from utils.metrics import inc, timed
+from utils.resilience import CircuitOpenError
+
+# ローカルのエンジン（試す順）。使えないもの（依存が無い）は飛ばす
+LOCAL_ENGINES = [e.strip() for e in os.getenv("OCR_LOCAL_ENGINES", "digits,tesseract").split(",") if e.strip()]
+FIRST_PASS = os.getenv("OCR_FIRST_PASS", "0") == "1"
+# 0 は無効。Vision の直近の中央値がこれを超えたらローカルを先に試す（秒）
+LATENCY_BUDGET = float(os.getenv("OCR_LATENCY_BUDGET", 0))
+MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", 0.9))
+FALLBACK_MIN_CONFIDENCE = float(os.getenv("OCR_FALLBACK_MIN_CONFIDENCE", 0.6))
+# digits の追加テンプレート（"<数字>_任意.png" の白文字・黒背景の画像。実機の画面から切り出したものなど）
+DIGIT_TEMPLATES_DIR = os.getenv("OCR_DIGIT_TEMPLATES")
+TESSERACT_LANG = os.getenv("OCR_TESSERACT_LANG", "jpn+eng")
+
+SCORE_PATTERN = re.compile(r"^\d{2,3}[.,]\d{3}$")
+
+
+class OcrResult:
+    def __init__(self, engine: str, response, score: Optional[float], confidence: float, elapsed: float):
+        self.engine = engine
+        self.response = response  # AnnotateImageResponse
+        self.score = score
+        self.confidence = confidence
+        self.elapsed = elapsed
+        # Vision を呼んだか（利用量の計測用。失敗した呼び出しも数える）
+        self.vision_called = engine == "vision"
+
+
+def _response(words: List[tuple], full_text: Optional[str] = None):
+    """
+    [(文字列, 確信度, (x, y, w, h) or None), ...] から Vision 形式の応答を組み立てる
+    """
+    from google.cloud import vision
+    annotations = [vision.EntityAnnotation(description=full_text if full_text is not None
+                                           else "\n".join(w for w, _, _ in words))]
+    for text, confidence, box in words:
+        annotation = vision.EntityAnnotation(description=text, confidence=confidence)
+        if box:
+            x, y, w, h = box
+            annotation.bounding_poly = vision.BoundingPoly(vertices=[
+                vision.Vertex(x=x, y=y), vision.Vertex(x=x + w, y=y),
+                vision.Vertex(x=x + w, y=y + h), vision.Vertex(x=x, y=y + h),
+            ])
+        annotations.append(annotation)
+    return vision.AnnotateImageResponse(text_annotations=annotations)
+
+def _decode(content: bytes):
+    import cv2
+    import numpy as np
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    # 処理時間を抑えるため長辺 1280px までに縮める
+    scale = 1280 / max(image.shape)
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return image
+
+
+# ==============================
+# digits（OpenCV）
+# ==============================
+
+GLYPH_SIZE = (20, 32)  # (幅, 高さ)
+
+class DigitReader:
+    name = "digits"
+    provides_text = False
+
+    def __init__(self):
+        self._templates = None
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        try:
+            import cv2  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def templates(self):
+        """
+        数字 → 正規化したテンプレートの一覧（初回に Hershey フォントから描画し、追加分を読み込む）
+        """
+        if self._templates is None:
+            with self._lock:
+                if self._templates is None:
+                    self._templates = self._build_templates()
+        return self._templates
+
+    def _build_templates(self):
+        import cv2
+        import numpy as np
+        templates = {str(d): [] for d in range(10)}
+        fonts = [cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX, cv2.FONT_HERSHEY_TRIPLEX,
+                 cv2.FONT_HERSHEY_COMPLEX, cv2.FONT_HERSHEY_PLAIN]
+        for digit in templates:
+            for font in fonts:
+                for thickness in (2, 4, 7):
+                    canvas = np.zeros((120, 100), dtype=np.uint8)
+                    cv2.putText(canvas, digit, (10, 100), font, 3, 255, thickness, cv2.LINE_AA)
+                    glyph = _normalize_glyph(canvas)
+                    if glyph is not None:
+                        templates[digit].append(glyph)
+        if DIGIT_TEMPLATES_DIR:
+            for path in glob.glob(os.path.join(DIGIT_TEMPLATES_DIR, "*.png")):
+                digit = os.path.basename(path)[0]
+                image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+                glyph = _normalize_glyph(image) if image is not None and digit in templates else None
+                if glyph is not None:
+                    templates[digit].append(glyph)
+        return {d: np.stack(t) for d, t in templates.items()}
+
+    def classify(self, glyph):
+        """
+        正規化済みの文字画像 → (数字, 相関)
+        """
+        import numpy as np
+        flat = glyph.reshape(-1)
+        best, best_score = None, -1.0
+        for digit, stack in self.templates().items():
+            score = float(np.max(stack.reshape(len(stack), -1) @ flat))
+            if score > best_score:
+                best, best_score = digit, score
+        return best, best_score
+
+    def read(self, content: bytes) -> Optional[OcrResult]:
+        started = time.perf_counter()
+        gray = _decode(content)
+        if gray is None:
+            return None
+        best = None
+        for binary in _binarizations(gray):
+            for candidate in self._score_candidates(binary):
+                # 確信度が高く、文字が大きいもの（画面の主役の点数）を選ぶ
+                if best is None or candidate[1] * candidate[3] > best[1] * best[3]:
+                    best = candidate
+        elapsed = time.perf_counter() - started
+        if best is None:
+            return OcrResult(self.name, _response([]), None, 0.0, elapsed)
+        text, confidence, box, _ = best
+        return OcrResult(self.name, _response([(text, confidence, box)]),
+                         float(text), confidence, elapsed)
+
+    def _score_candidates(self, binary):
+        """
+        二値画像から「dd.ddd」形式に並ぶ文字列を探し、(文字列, 確信度, 範囲, 文字の高さ) を返す
+        """
+        import cv2
+        height = binary.shape[0]
+        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = [cv2.boundingRect(c) for c in contours]
+        glyphs = [b for b in boxes if height * 0.03 <= b[3] <= height * 0.6 and 0.08 <= b[2] / b[3] <= 1.1]
+        dots = [b for b in boxes if b[3] < height * 0.2 and 0.5 <= b[2] / max(b[3], 1) <= 2.0]
+        for line in _group_lines(glyphs):
+            for split, certain in _decimal_splits(line, dots):
+                left, right = line[max(0, split - 3):split], line[split:split + 3]
+                if len(left) < 2 or len(right) != 3:
+                    continue
+                digits, scores = [], []
+                for b in left + right:
+                    glyph = _normalize_glyph(binary[b[1]:b[1] + b[3], b[0]:b[0] + b[2]])
+                    digit, score = self.classify(glyph) if glyph is not None else (None, 0.0)
+                    digits.append(digit)
+                    scores.append(score)
+                if None in digits:
+                    continue
+                integer = "".join(digits[:len(left)])
+                if len(integer) == 3 and integer != "100":
+                    # 3桁の整数部は 100 以外ありえないので、先頭は隣の模様などを拾ったものとして落とす
+                    integer, scores, left = integer[1:], scores[1:], left[1:]
+                text = f"{integer}.{''.join(digits[-3:])}"
+                if not SCORE_PATTERN.match(text) or float(text) > 100:
+                    continue
+                confidence = max(0.0, min(scores)) * (1.0 if certain else 0.95)
+                x0, y0 = min(b[0] for b in left), min(b[1] for b in left + right)
+                x1, y1 = max(b[0] + b[2] for b in right), max(b[1] + b[3] for b in left + right)
+                yield text, confidence, (x0, y0, x1 - x0, y1 - y0), max(b[3] for b in line)
+
+
+def _binarizations(gray):
+    """
+    明るい文字・暗い文字それぞれについて、全体の大津の二値化と局所（適応的）二値化を試す
+    """
+    import cv2
+    block = max(15, (min(gray.shape) // 8) | 1)
+    for source in (gray, 255 - gray):
+        _, otsu = cv2.threshold(source, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        yield otsu
+        # 背景の模様・グラデーションに引きずられないよう、周囲より明るい所だけを残す
+        yield cv2.adaptiveThreshold(source, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block, -20)
+
+def _decimal_splits(line, dots):
+    """
+    小数点の位置（その右の文字の添字, 小数点の塊が見つかったか）。
+    塊が見つからない時は、他より広く空いた文字間を小数点の位置とみなす
+    """
+    h = max(b[3] for b in line)
+    bottom = max(b[1] + b[3] for b in line)
+    splits = {}
+    for dot in dots:
+        if dot[3] <= h * 0.35 and abs(dot[1] + dot[3] - bottom) <= h * 0.25:
+            for i in range(1, len(line)):
+                if line[i - 1][0] + line[i - 1][2] <= dot[0] + 1 and dot[0] + dot[2] <= line[i][0] + 1:
+                    splits[i] = True
+    gaps = [line[i][0] - (line[i - 1][0] + line[i - 1][2]) for i in range(1, len(line))]
+    if len(gaps) >= 4:
+        ordered = sorted(gaps)
+        median = ordered[len(ordered) // 2]
+        for i, gap in enumerate(gaps, start=1):
+            if gap >= max(median * 1.5, median + h * 0.15):
+                splits.setdefault(i, False)
+    return sorted(splits.items())
+
+
+def _normalize_glyph(image):
+    """
+    文字の範囲だけを切り出して GLYPH_SIZE に収め、平均 0・ノルム 1 のベクトルにする
+    """
+    import cv2
+    import numpy as np
+    points = cv2.findNonZero(image)
+    if points is None:
+        return None
+    x, y, w, h = cv2.boundingRect(points)
+    crop = image[y:y + h, x:x + w]
+    gw, gh = GLYPH_SIZE
+    # 縦横比を保ったまま高さを揃える（「1」を横に引き伸ばさない）
+    scale = min(gw / w, gh / h)
+    resized = cv2.resize(crop, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    canvas = np.zeros((gh, gw), dtype=np.float32)
+    oy, ox = (gh - resized.shape[0]) // 2, (gw - resized.shape[1]) // 2
+    canvas[oy:oy + resized.shape[0], ox:ox + resized.shape[1]] = resized
+    canvas -= canvas.mean()
+    norm = np.linalg.norm(canvas)
+    return canvas / norm if norm else None
+
+def _group_lines(boxes):
+    """
+    高さ・縦位置が揃い、間隔が文字の高さ程度で並ぶ文字をまとめる（左から順）
+    """
+    lines = []
+    for box in sorted(boxes):
+        x, y, w, h = box
+        for line in lines:
+            lx, ly, lw, lh = line[-1]
+            if abs(h - lh) <= 0.25 * lh and abs((y + h) - (ly + lh)) <= 0.25 * lh and 0 <= x - (lx + lw) <= 1.2 * lh:
+                line.append(box)
+                break
+        else:
+            lines.append([box])
+    return [line for line in lines if len(line) >= 4]
+
+
+# ==============================
+# tesseract（任意）
+# ==============================
+
+class TesseractEngine:
+    name = "tesseract"
+    provides_text = True
+
+    def available(self) -> bool:
+        try:
+            import pytesseract
+        except ImportError:
+            return False
+        return shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+
+    def read(self, content: bytes) -> Optional[OcrResult]:
+        import pytesseract
+        from PIL import Image
+        from utils.ocr_utils import _extract_score
+        started = time.perf_counter()
+        gray = _decode(content)
+        if gray is None:
+            return None
+        data = pytesseract.image_to_data(Image.fromarray(gray), lang=TESSERACT_LANG, config="--psm 11",
+                                         output_type=pytesseract.Output.DICT)
+        words = []
+        for i, text in enumerate(data["text"]):
+            text = text.strip()
+            confidence = float(data["conf"][i])
+            if text and confidence >= 0:
+                box = (data["left"][i], data["top"][i], data["width"][i], data["height"][i])
+                words.append((text, confidence / 100, box))
+        response = _response(words, full_text=" ".join(w for w, _, _ in words))
+        score = _extract_score(response.text_annotations)
+        confidence = max((c for w, c, _ in words if score is not None and _same_score(w, score)), default=0.0)
+        return OcrResult(self.name, response, score, confidence, time.perf_counter() - started)
+
+
+def _same_score(text: str, score: float) -> bool:
+    try:
+        return SCORE_PATTERN.match(text) is not None and float(text.replace(",", ".")) == score
+    except ValueError:
+        return False
+
+
+# ==============================
+# vision
+# ==============================
+
+class VisionEngine:
+    name = "vision"
+    provides_text = True
+
+    def available(self) -> bool:
+        return resilience.get("vision").available()
+
+    def read(self, content: bytes) -> OcrResult:
+        from utils.ocr_utils import ocr_image_response, get_vision_client, _extract_score
+        started = time.perf_counter()
+        with timed("vision"):
+            response = ocr_image_response(content, get_vision_client())
+        score = _extract_score(response.text_annotations)
+        return OcrResult(self.name, response, score, 1.0 if score is not None else 0.0, time.perf_counter() - started)
+
+    async def read_async(self, content: bytes) -> OcrResult:
+        from utils.ocr_utils import ocr_image_bytes_async, get_vision_async_client, _extract_score
+        started = time.perf_counter()
+        with timed("vision"):
+            response = await ocr_image_bytes_async(content, get_vision_async_client())
+        score = _extract_score(response.text_annotations)
+        return OcrResult(self.name, response, score, 1.0 if score is not None else 0.0, time.perf_counter() - started)
+
+
+ENGINES = {e.name: e for e in (VisionEngine(), DigitReader(), TesseractEngine())}
+
+def get(name: str):
+    return ENGINES[name]
+
+def local_engines():
+    return [ENGINES[n] for n in LOCAL_ENGINES if n in ENGINES and ENGINES[n].available()]
+
+
+# ==============================
+# 方針
+# ==============================
+
+def _vision_over_budget() -> bool:
+    if not LATENCY_BUDGET:
+        return False
+    median = resilience.get("vision").recent_latency(0.5)
+    return median is not None and median > LATENCY_BUDGET
+
+def _first_pass(need_text: bool) -> bool:
+    return (FIRST_PASS and not need_text) or _vision_over_budget()
+
+def _accept(result: Optional[OcrResult], threshold: float) -> bool:
+    from utils.ocr_utils import validate_score_range
+    return result is not None and result.score is not None \
+        and validate_score_range(result.score) and result.confidence >= threshold
+
+def _record(result: Optional[OcrResult], outcome: str, engine: str):
+    inc("ocr_engine_total", engine=engine, outcome=outcome)
+    if result is not None:
+        logging.info(f"🔎 OCR {engine}: score={result.score} confidence={result.confidence:.2f} "
+                     f"{result.elapsed * 1000:.0f}ms（{outcome}）")
+
+def _read_local(engine, content) -> Optional[OcrResult]:
+    try:
+        with timed(f"ocr_{engine.name}"):
+            return engine.read(content)
+    except Exception as e:
+        logging.warning(f"⚠️ OCR {engine.name} に失敗: {e}")
+        return None
+
+def recognize(content: bytes, need_text: bool = True) -> OcrResult:
+    """
+    方針に従ってエンジンを選び、結果を返す。どのエンジンも使えなければ Vision の例外を送出する
+    （Vision を呼んだかは vision_called(例外) で分かる）
+    """
+    tried = {}
+    if _first_pass(need_text):
+        for engine in local_engines():
+            result = tried[engine.name] = _read_local(engine, content)
+            if _accept(result, MIN_CONFIDENCE):
+                _record(result, "first_pass", engine.name)
+                return result
+
+    vision = ENGINES["vision"]
+    try:
+        result = vision.read(content)
+        _record(result, "primary", vision.name)
+        return result
+    except Exception as e:
+        error = e
+        logging.warning(f"⚠️ Vision に失敗したためローカルの OCR で読み取ります: {e}")
+        inc("ocr_engine_total", engine=vision.name, outcome="failed")
+
+    for engine in local_engines():
+        result = tried[engine.name] if engine.name in tried else _read_local(engine, content)
+        if _accept(result, FALLBACK_MIN_CONFIDENCE):
+            return _fallback_result(result, error)
+    raise _unread(error)
+
+async def recognize_async(content: bytes, need_text: bool = True) -> OcrResult:
+    """
+    非同期版（ローカルのエンジンはスレッドで動かす）
+    """
+    tried = {}
+    if _first_pass(need_text):
+        for engine in local_engines():
+            result = tried[engine.name] = await asyncio.to_thread(_read_local, engine, content)
+            if _accept(result, MIN_CONFIDENCE):
+                _record(result, "first_pass", engine.name)
+                return result
+
+    vision = ENGINES["vision"]
+    try:
+        result = await vision.read_async(content)
+        _record(result, "primary", vision.name)
+        return result
+    except Exception as e:
+        error = e
+        logging.warning(f"⚠️ Vision に失敗したためローカルの OCR で読み取ります: {e}")
+        inc("ocr_engine_total", engine=vision.name, outcome="failed")
+
+    for engine in local_engines():
+        result = tried[engine.name] if engine.name in tried \
+            else await asyncio.to_thread(_read_local, engine, content)
+        if _accept(result, FALLBACK_MIN_CONFIDENCE):
+            return _fallback_result(result, error)
+    raise _unread(error)
+
+def _fallback_result(result: OcrResult, error: Exception) -> OcrResult:
+    _record(result, "fallback", result.engine)
+    # 回路遮断で呼ばなかった時以外は、失敗した Vision の呼び出しも利用量に数える
+    result.vision_called = not isinstance(error, CircuitOpenError)
+    return result
+
+def _unread(error: Exception) -> Exception:
+    # どのエンジンでも読めなかった時も、Vision を呼んでいれば利用量に数えられるよう例外に付けておく
+    error.vision_called = not isinstance(error, CircuitOpenError)
+    return error
+
+def vision_called(error: BaseException) -> bool:
+    """
+    recognize / recognize_async が送出した例外について、失敗した Vision の呼び出しがあったか
+    """
+    return getattr(error, "vision_called", False)
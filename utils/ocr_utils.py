@@ -3,10 +3,8 @@ import re
 import io
 import logging
 from typing import Optional
-from google.cloud import vision
-from google.oauth2 import service_account
-from google.cloud.vision_v1.types.image_annotator import AnnotateImageResponse
-from linebot.v3.messaging.models import TextMessage, QuickReply, QuickReplyItem, MessageAction
+from utils import resilience
+# google.cloud.vision / grpc / LINE SDK のモデルは重いため、使う関数の中で import する
 
 # ==============================
 # スコア抽出処理
@@ -62,7 +60,86 @@ def _extract_score(texts) -> Optional[float]:
 # OCR 実行
 # ==============================
 
+# ローカルのスタンドイン（負荷試験用）を使う場合は host:port を指定
+VISION_API_ENDPOINT = os.getenv("VISION_API_ENDPOINT")
+
+_vision_client = None
+_vision_async_client = None
+
+def get_vision_client():
+    """
+    Vision クライアントを1度だけ生成して使い回す。
+    VISION_API_ENDPOINT 指定時は認証なしの gRPC チャネルで接続する。
+    """
+    global _vision_client
+    if _vision_client is None:
+        from google.cloud import vision
+        if VISION_API_ENDPOINT:
+            import grpc
+            from google.auth.credentials import AnonymousCredentials
+            from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorGrpcTransport
+            transport = ImageAnnotatorGrpcTransport(
+                channel=grpc.insecure_channel(VISION_API_ENDPOINT),
+                credentials=AnonymousCredentials(),
+            )
+            _vision_client = vision.ImageAnnotatorClient(transport=transport)
+        else:
+            _vision_client = vision.ImageAnnotatorClient()
+    return _vision_client
+
+def get_vision_async_client():
+    """
+    非同期モード用の Vision クライアント（イベントループ内で呼び出すこと）
+    """
+    global _vision_async_client
+    if _vision_async_client is None:
+        from google.cloud import vision
+        if VISION_API_ENDPOINT:
+            import grpc
+            from google.auth.credentials import AnonymousCredentials
+            from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorGrpcAsyncIOTransport
+            transport = ImageAnnotatorGrpcAsyncIOTransport(
+                channel=grpc.aio.insecure_channel(VISION_API_ENDPOINT),
+                credentials=AnonymousCredentials(),
+            )
+            _vision_async_client = vision.ImageAnnotatorAsyncClient(transport=transport)
+        else:
+            _vision_async_client = vision.ImageAnnotatorAsyncClient()
+    return _vision_async_client
+
+def ocr_image_response(content: bytes, client):
+    """
+    画像バイト列を TEXT_DETECTION にかけ、AnnotateImageResponse を返す
+    """
+    from google.cloud import vision
+    image = vision.Image(content=content)
+    # タイムアウト・回路遮断・ヘッジは utils/resilience.py（OCR は冪等なのでヘッジ可）
+    return resilience.get("vision").call(
+        lambda timeout: client.text_detection(image=image, timeout=timeout)
+    )
+
+def ocr_image_bytes(content: bytes, client):
+    """
+    画像バイト列を TEXT_DETECTION にかけ、text_annotations を返す
+    """
+    return ocr_image_response(content, client).text_annotations
+
+async def ocr_image_bytes_async(content: bytes, client):
+    """
+    非同期版。AnnotateImageResponse を返す
+    """
+    from google.cloud import vision
+    request = vision.AnnotateImageRequest(
+        image=vision.Image(content=content),
+        features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)],
+    )
+    response = await resilience.get("vision").call_async(
+        lambda timeout: client.batch_annotate_images(requests=[request], timeout=timeout)
+    )
+    return response.responses[0]
+
 def ocr_image(image_path, client):
+    from google.cloud import vision
     with io.open(image_path, 'rb') as image_file:
         content = image_file.read()
 
@@ -75,6 +152,8 @@ def extract_text_from_image(image_path):
     if not credentials_path:
         logging.error("GOOGLE_APPLICATION_CREDENTIALS 環境変数が設定されていません")
         return None
+    from google.cloud import vision
+    from google.oauth2 import service_account
     credentials = service_account.Credentials.from_service_account_file(credentials_path)
     client = vision.ImageAnnotatorClient(credentials=credentials)
     return ocr_image(image_path, client)
@@ -86,13 +165,15 @@ def extract_text_from_image(image_path):
 def is_correction_command(text: str) -> bool:
     return text == "修正" or text.lower() == "fix"
 
-def get_correction_menu() -> TextMessage:
+def get_correction_menu():
+    from linebot.v3.messaging.models import TextMessage, QuickReply, QuickReplyItem, MessageAction
     return TextMessage(
         text="🔧 修正したい項目を選んでください：",
         quick_reply=QuickReply(items=[
             QuickReplyItem(action=MessageAction(label="スコア", text="スコア")),
             QuickReplyItem(action=MessageAction(label="曲名", text="曲名")),
             QuickReplyItem(action=MessageAction(label="アーティスト", text="アーティスト")),
+            QuickReplyItem(action=MessageAction(label="まとめて修正", text="修正フォーム")),
         ])
     )
 
@@ -105,12 +186,13 @@ def set_user_correction_step(user_id, field):
         "user_id": user_id,
         "field": field,
         "timestamp": "now()"
-    }).execute()
+    }, on_conflict="user_id").execute()
 
 def get_user_correction_step(user_id):
     from supabase_client import supabase
-    resp = supabase.table("corrections").select("field").eq("user_id", user_id).single().execute()
-    return resp.data.get("field") if resp.data else None
+    # 修正中でなければ行が無い（single() だと例外になる）
+    resp = supabase.table("corrections").select("field").eq("user_id", user_id).maybe_single().execute()
+    return resp.data.get("field") if resp and resp.data else None
 
 def clear_user_correction_step(user_id):
     from supabase_client import supabase
@@ -119,7 +201,7 @@ def clear_user_correction_step(user_id):
 def parse_correction_command(text: str):
     result = {}
     patterns = {
-        "score": r"score[:：]\s*(\d+[.,]?\d+)",
+        "score": r"(?:点数|スコア|score)[:：]\s*(\d+[.,．]?\d+)",
         "song_name": r"(?:曲名|song)[:：]\s*(\S+)",
         "artist_name": r"(?:アーティスト|artist)[:：]\s*(\S+)",
         "comment": r"(?:コメント|comment)[:：](.+)"
@@ -1,9 +1,9 @@
 import logging
 from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
 from linebot.v3.messaging.models import ReplyMessageRequest, TextMessage
-from utils.user_code import generate_unique_user_code
+from utils.user_code import with_unique_user_code
 from supabase_client import supabase
-from .richmenu import create_and_link_rich_menu
+from .richmenu import ensure_default_rich_menu
 
 def get_welcome_message(user_name: str) -> str:
     return (
@@ -17,6 +17,22 @@ def get_welcome_message(user_name: str) -> str:
         "ぜひお試しください！✨"
     )
 
+def register_user_if_absent(line_sub: str, user_name: str) -> bool:
+    """
+    INSERT ... ON CONFLICT (id) DO NOTHING の1往復で登録する。
+    新規登録できた場合 True を返す。
+    """
+    def insert(code):
+        return supabase.table("users").upsert({
+            "id": line_sub,
+            "name": user_name,
+            "user_code": code,
+            "score_count": 0
+        }, on_conflict="id", ignore_duplicates=True).execute()
+
+    resp = with_unique_user_code(line_sub, insert)
+    return bool(resp.data)
+
 def handle_user_onboarding(
     line_sub: str,
     user_name: str,
@@ -25,22 +41,14 @@ def handle_user_onboarding(
 ):
     try:
         # Supabase にユーザー登録（初回のみ）
-        code = generate_unique_user_code()
-        resp = supabase.table("users").select("id").eq("id", line_sub).execute()
-        if not resp.data:
-            supabase.table("users").insert({
-                "id": line_sub,
-                "name": user_name,
-                "user_code": code,
-                "score_count": 0
-            }).execute()
+        if register_user_if_absent(line_sub, user_name):
             logging.info(f"Supabase に新規ユーザー登録: {line_sub}")
         else:
             logging.info(f"ユーザー {line_sub} は既に登録済み")
 
-        # リッチメニュー作成＆デフォルト適用
-        # └ 新規友だちにも自動的に全ユーザー共通メニューを適用
-        create_and_link_rich_menu(user_id=None)
+        # 全ユーザー共通のデフォルトメニューを保証
+        # └ 適用済みなら LINE API は呼ばない（作成・画像アップロードは定義が変わった時だけ）
+        ensure_default_rich_menu()
 
         # ウェルカムメッセージ送信
         welcome = get_welcome_message(user_name)
@@ -0,0 +1,110 @@
+# utils/profile_cache.py
+# LINE プロフィール（表示名）のキャッシュ
+#
+# 表示名は users.name に書くためだけに使い、変わることも少ないため、
+# 取得から PROFILE_REFRESH_AFTER 秒を過ぎた値はそのまま返しつつ裏で取り直し（応答経路で待たない）、
+# PROFILE_CACHE_TTL 秒を過ぎた値は使わない。値はプロセスごと。
+
+import os
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+from utils.metrics import inc
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", 10000))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", 24 * 3600))
+PROFILE_REFRESH_AFTER = float(os.getenv("PROFILE_REFRESH_AFTER", 3600))
+
+# user_id → (取得時刻, 表示名)
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+# 裏で取り直す user_id（同じユーザーを重ねて積まない）
+_refresh_queue = queue.Queue()
+_refreshing = set()
+_refresher = None
+_worker = None
+
+
+def set_refresher(fetch: Callable[[str], str]):
+    """
+    裏での取り直しに使う同期関数 fetch(user_id) -> 表示名 を登録する
+    """
+    global _refresher
+    _refresher = fetch
+
+def put(user_id: str, name: str, refresh: bool = False):
+    """
+    refresh=True は DB の users.name など LINE 以外から得た値。返せるようにしつつ、すぐ裏で取り直す
+    """
+    fetched_at = time.monotonic() - (PROFILE_REFRESH_AFTER if refresh else 0)
+    with _lock:
+        _cache[user_id] = (fetched_at, name)
+        _cache.move_to_end(user_id)
+        while len(_cache) > PROFILE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    if refresh:
+        _schedule_refresh(user_id)
+
+def cached_display_name(user_id: str) -> Optional[str]:
+    """
+    キャッシュにあれば表示名、無ければ None（LINE API は呼ばない）
+    """
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry and now - entry[0] < PROFILE_CACHE_TTL:
+            _cache.move_to_end(user_id)
+        else:
+            entry = None
+    if entry is None:
+        inc("cache_misses_total", cache="line_profile")
+        return None
+    inc("cache_hits_total", cache="line_profile")
+    if now - entry[0] >= PROFILE_REFRESH_AFTER:
+        _schedule_refresh(user_id)
+    return entry[1]
+
+def get_display_name(user_id: str, fetch: Callable[[str], str]) -> str:
+    """
+    キャッシュに無ければ fetch(user_id) で取得して保存する
+    """
+    name = cached_display_name(user_id)
+    if name is None:
+        name = fetch(user_id)
+        put(user_id, name)
+    return name
+
+
+# ==============================
+# 裏での取り直し
+# ==============================
+
+def _schedule_refresh(user_id: str):
+    global _worker
+    if _refresher is None:
+        return
+    with _lock:
+        if user_id in _refreshing:
+            return
+        _refreshing.add(user_id)
+        if _worker is None:
+            _worker = threading.Thread(target=_run_refresh, name="profile-refresh", daemon=True)
+            _worker.start()
+    _refresh_queue.put(user_id)
+
+def _run_refresh():
+    while True:
+        user_id = _refresh_queue.get()
+        try:
+            put(user_id, _refresher(user_id))
+        except Exception as e:
+            # 失敗しても古い値のまま（TTL を過ぎれば次の利用時に取り直す）
+            inc("external_errors_total", service="line_profile")
+            logging.warning(f"⚠️ プロフィールの再取得に失敗（user_id={user_id}）: {e}")
+        finally:
+            with _lock:
+                _refreshing.discard(user_id)
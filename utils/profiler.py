@@ -0,0 +1,99 @@
+# utils/profiler.py
+# 本番用のサンプリングプロファイラ（既定は停止。/debug/profiler から実行時に切り替える）
+#
+# 別スレッドから一定間隔で全スレッドのスタックを覗き、関数の呼び出し経路ごとの出現回数を数える。
+# 出力は flamegraph.pl / speedscope がそのまま読める collapsed 形式。
+# 値はプロセスごと（gunicorn の複数ワーカー構成ではリクエストを受けたワーカーのみ）。
+
+import os
+import sys
+import hmac
+import time
+import logging
+import threading
+from collections import Counter
+
+DEFAULT_INTERVAL = 0.01
+MIN_INTERVAL = 0.001
+# 止め忘れても自動で止まるようにする上限（秒）
+MAX_DURATION = float(os.getenv("PROFILER_MAX_DURATION", 300))
+MAX_DEPTH = 64
+# 未設定なら /debug/profiler は無効（404）
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+
+_lock = threading.Lock()
+_samples = Counter()
+_thread = None
+_stop = threading.Event()
+_state = {"running": False, "interval": DEFAULT_INTERVAL, "started_at": None, "stopped_at": None, "sample_count": 0}
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+def _run(interval: float, duration: float):
+    own = threading.get_ident()
+    deadline = time.monotonic() + duration
+    while not _stop.wait(interval):
+        frames = sys._current_frames()
+        with _lock:
+            for thread_id, frame in frames.items():
+                if thread_id != own:
+                    _samples[_collapse(frame)] += 1
+            _state["sample_count"] += 1
+        if time.monotonic() >= deadline:
+            break
+    with _lock:
+        _state["running"] = False
+        _state["stopped_at"] = time.time()
+    logging.info("🛑 サンプリングプロファイラ停止")
+
+def start(interval: float = DEFAULT_INTERVAL, duration: float = MAX_DURATION) -> dict:
+    """
+    前回の結果を破棄して計測を開始する。実行中なら何もしない
+    """
+    global _thread
+    with _lock:
+        if not _state["running"]:
+            _samples.clear()
+            _stop.clear()
+            _state.update(
+                running=True, interval=max(MIN_INTERVAL, interval),
+                started_at=time.time(), stopped_at=None, sample_count=0
+            )
+            _thread = threading.Thread(
+                target=_run, args=(_state["interval"], min(duration, MAX_DURATION)),
+                name="sampling-profiler", daemon=True
+            )
+            _thread.start()
+            logging.info(f"▶️ サンプリングプロファイラ開始（間隔 {_state['interval'] * 1000:.0f}ms）")
+    return status()
+
+def stop() -> dict:
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=1)
+    return status()
+
+def status() -> dict:
+    with _lock:
+        return dict(_state, distinct_stacks=len(_samples))
+
+def collapsed(limit: int = None) -> str:
+    """
+    「関数;関数;関数 回数」の行を回数の多い順に返す
+    """
+    with _lock:
+        rows = _samples.most_common(limit)
+    return "".join(f"{stack} {count}\n" for stack, count in rows)
+
+def is_authorized(auth_header) -> bool:
+    return bool(DEBUG_TOKEN) and hmac.compare_digest(auth_header or "", f"Bearer {DEBUG_TOKEN}")
@@ -0,0 +1,156 @@
+# utils/rating_batch.py
+# 全ユーザーのレーティングを NumPy で一括再計算する（predict_next_rating のベクトル版）
+
+import logging
+from typing import Dict, List, Optional
+import numpy as np
+from supabase_client import supabase
+from utils import rating
+from utils.constants import SCORE_EVAL_COUNT
+
+LOAD_PAGE_SIZE = 1000
+WRITE_BATCH_SIZE = 500
+
+
+class ScoreWindows:
+    """
+    ユーザーごとの直近スコア（新しい順）を (ユーザー数, window) の行列に詰めたもの。
+    件数が window に満たない行の末尾は NaN。
+    """
+
+    def __init__(self, user_ids: List[str], matrix: np.ndarray, counts: np.ndarray):
+        self.user_ids = user_ids
+        self.matrix = matrix
+        self.counts = counts
+
+    @classmethod
+    def from_lists(cls, windows: Dict[str, List[float]], window: int) -> "ScoreWindows":
+        user_ids = [u for u, scores in windows.items() if scores]
+        matrix = np.full((len(user_ids), window), np.nan)
+        counts = np.zeros(len(user_ids), dtype=np.int64)
+        for i, user_id in enumerate(user_ids):
+            scores = windows[user_id][:window]
+            matrix[i, :len(scores)] = scores
+            counts[i] = len(scores)
+        return cls(user_ids, matrix, counts)
+
+
+def load_score_windows(window: int = SCORE_EVAL_COUNT) -> ScoreWindows:
+    """
+    get_recent_score_windows（sql/006_rating_batch.sql）で全ユーザーの直近 window 件を
+    user_id 順のキーセットで取得する
+    """
+    windows = {}
+    after = ""
+    while True:
+        resp = supabase.rpc("get_recent_score_windows", {
+            "p_window": window, "p_after": after, "p_limit": LOAD_PAGE_SIZE
+        }).execute()
+        rows = resp.data or []
+        for row in rows:
+            windows[row["user_id"]] = [s for s in row["scores"] if s is not None]
+        if len(rows) < LOAD_PAGE_SIZE:
+            break
+        after = rows[-1]["user_id"]
+    return ScoreWindows.from_lists(windows, window)
+
+
+def compute_ratings(windows: ScoreWindows, window: int = SCORE_EVAL_COUNT,
+                    thresholds: Optional[Dict[str, float]] = None) -> Dict[str, np.ndarray]:
+    """
+    predict_next_rating と同じ規則で average / rank / next_up_score / next_down_score を一括計算。
+    合計は左から順に足す（cumsum）ため、Python の sum() と丸め誤差まで一致する。
+    """
+    thresholds = thresholds or rating.RANK_THRESHOLDS
+    names = sorted(thresholds, key=thresholds.get)
+    values = np.array([thresholds[n] for n in names], dtype=float)
+    top = len(names) - 1
+
+    matrix = np.nan_to_num(windows.matrix[:, :window])
+    counts = np.minimum(windows.counts, window)
+    rows = np.arange(len(counts))
+    cumsum = np.cumsum(matrix, axis=1)
+
+    # 現在の平均とランク
+    current_sum = cumsum[rows, counts - 1]
+    average = current_sum / counts
+    # 最低ランクのしきい値が 0 より大きい試算（--threshold C=10 など）でも、それ未満は最低ランクとする
+    # （-1 のままだと names[-1] で最上位ランク扱いになり、しきい値も末尾を読んでしまう）
+    rank_idx = np.maximum(np.searchsorted(values, average, side="right") - 1, 0)
+
+    # 最新 window 件中の最古を除いた base_scores
+    base_n = np.where(counts >= window, window - 1, counts)
+    base_sum = np.where(base_n > 0, cumsum[rows, np.maximum(base_n - 1, 0)], 0.0)
+    new_count = base_n + 1
+
+    # ランクアップ条件
+    next_threshold = values[np.minimum(rank_idx + 1, top)]
+    next_up = np.where(rank_idx < top, np.ceil(next_threshold * new_count - base_sum), np.nan)
+
+    # ランクダウン条件
+    current_threshold = values[rank_idx]
+    raw_down = current_threshold * new_count - base_sum
+    boundary = np.floor(raw_down)
+    next_down = np.maximum(0, boundary)
+    next_down = np.where((rank_idx > 0) & ~((boundary == 0) & (raw_down <= 0)), next_down, np.nan)
+
+    return {
+        "average": average,
+        "rank": np.array(names, dtype=object)[rank_idx],
+        "next_up_score": next_up,
+        "next_down_score": next_down,
+    }
+
+
+def _nullable_int(value) -> Optional[int]:
+    return None if np.isnan(value) else int(value)
+
+def to_user_rows(windows: ScoreWindows, result: Dict[str, np.ndarray]) -> List[dict]:
+    return [{
+        "id": user_id,
+        "average_score": round(float(result["average"][i]), 3),
+        "average_rating": str(result["rank"][i]),
+        "next_up_score": _nullable_int(result["next_up_score"][i]),
+        "next_down_score": _nullable_int(result["next_down_score"][i]),
+    } for i, user_id in enumerate(windows.user_ids)]
+
+def write_back(rows: List[dict], batch_size: int = WRITE_BATCH_SIZE) -> int:
+    """
+    apply_rating_batch で batch_size 件ずつ1回の UPDATE にまとめて書き戻す
+    """
+    updated = 0
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        resp = supabase.rpc("apply_rating_batch", {"p_rows": batch}).execute()
+        updated += resp.data or 0
+        logging.info(f"✅ レーティング書き戻し {start + len(batch)}/{len(rows)}")
+    return updated
+
+
+def simulate(windows: ScoreWindows, window: int, thresholds: Dict[str, float],
+             new_window: int, new_thresholds: Dict[str, float]) -> dict:
+    """
+    しきい値・集計件数を変えた場合のランク分布と移動を集計する（書き込みなし）
+    """
+    before = compute_ratings(windows, window, thresholds)["rank"]
+    after = compute_ratings(windows, new_window, new_thresholds)["rank"]
+    order_before = {n: i for i, n in enumerate(sorted(thresholds, key=thresholds.get))}
+    order_after = {n: i for i, n in enumerate(sorted(new_thresholds, key=new_thresholds.get))}
+
+    transitions = {}
+    for old, new in zip(before, after):
+        transitions[(old, new)] = transitions.get((old, new), 0) + 1
+
+    up = sum(c for (o, n), c in transitions.items()
+             if n in order_after and o in order_before and order_after[n] > order_before[o])
+    down = sum(c for (o, n), c in transitions.items()
+               if n in order_after and o in order_before and order_after[n] < order_before[o])
+    return {
+        "users": len(windows.user_ids),
+        "before": {n: int((before == n).sum()) for n in order_before},
+        "after": {n: int((after == n).sum()) for n in order_after},
+        "transitions": transitions,
+        "up": up,
+        "down": down,
+        "unchanged": len(windows.user_ids) - up - down,
+    }
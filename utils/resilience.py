@@ -0,0 +1,238 @@
+# utils/resilience.py
+# 外部依存（Vision / OpenAI / MusicBrainz）の呼び出しを包む共通層
+#
+# ・依存先ごとに直近の所要時間を記録し、タイムアウトをその上位パーセンタイルから決める
+#   （サンプルが少ないうちは上限値。タイムアウトした呼び出しはタイムアウト値として記録するため、
+#     上流が遅くなればタイムアウトも上限まで伸びる）
+# ・連続して失敗したら回路を開き、CIRCUIT_OPEN_SECONDS の間は呼ばずに CircuitOpenError で即失敗
+#   （呼び出し側は付加情報を省く・GPT を使わない等で縮退する）。経過後は1件だけ試して戻すか決める
+# ・HEDGE_DEPENDENCIES に含めた依存先は、冪等な読み取りに限りヘッジする
+#   （p95 を過ぎても返らなければ同じ呼び出しをもう1本出し、先に成功した方を使う）
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
+from utils.metrics import inc, set_gauge
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", 30))
+# タイムアウト = 直近の所要時間の TIMEOUT_PERCENTILE 点 × TIMEOUT_MULTIPLIER（依存先ごとの上下限で丸める）
+TIMEOUT_PERCENTILE = float(os.getenv("TIMEOUT_PERCENTILE", 0.99))
+TIMEOUT_MULTIPLIER = float(os.getenv("TIMEOUT_MULTIPLIER", 2.0))
+HEDGE_PERCENTILE = 0.95
+HEDGE_DEPENDENCIES = {d.strip() for d in os.getenv("HEDGE_DEPENDENCIES", "").split(",") if d.strip()}
+LATENCY_WINDOW = 200
+# これだけ溜まるまではタイムアウトに上限値を使い、ヘッジもしない
+MIN_SAMPLES = 20
+
+_hedge_executor = ThreadPoolExecutor(max_workers=int(os.getenv("HEDGE_WORKERS", 16)), thread_name_prefix="hedge")
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"{name} の回路が開いています")
+        self.name = name
+
+
+class Dependency:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, min_timeout: float, max_timeout: float, hedge: bool = False):
+        self.name = name
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.hedge = hedge
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    # ---- 所要時間 ----
+
+    def _percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self.latencies) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def recent_latency(self, q: float) -> Optional[float]:
+        """
+        直近の所要時間の q 分位点（サンプルが少ないうちは None）
+        """
+        return self._percentile(q)
+
+    def timeout(self) -> float:
+        p = self._percentile(TIMEOUT_PERCENTILE)
+        if p is None:
+            return self.max_timeout
+        return max(self.min_timeout, min(self.max_timeout, p * TIMEOUT_MULTIPLIER))
+
+    def hedge_delay(self) -> Optional[float]:
+        return self._percentile(HEDGE_PERCENTILE) if self.hedge else None
+
+    # ---- 回路 ----
+
+    def available(self) -> bool:
+        """
+        呼ばずに済ませるか（回路が開いている間）の事前確認。状態は変えない
+        """
+        with self._lock:
+            return self.state != self.OPEN or time.monotonic() - self.opened_at >= CIRCUIT_OPEN_SECONDS
+
+    def _acquire(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < CIRCUIT_OPEN_SECONDS:
+                    inc("circuit_rejections_total", service=self.name)
+                    raise CircuitOpenError(self.name)
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                # 試しに通すのは1件だけ
+                if self._probing:
+                    inc("circuit_rejections_total", service=self.name)
+                    raise CircuitOpenError(self.name)
+                self._probing = True
+
+    def _release(self):
+        # キャンセル・中断（CancelledError, KeyboardInterrupt など）は依存先の失敗ではないので数えず、
+        # 試しの1件の枠だけ返す（返さないと HALF_OPEN のまま以降の呼び出しを全て断り続ける）
+        with self._lock:
+            self._probing = False
+
+    def _record(self, elapsed: float, ok: bool):
+        with self._lock:
+            self.latencies.append(elapsed)
+            if ok:
+                if self.state != self.CLOSED:
+                    logging.info(f"✅ {self.name} の回路を閉じました")
+                self.state = self.CLOSED
+                self.failures = 0
+            else:
+                self.failures += 1
+                if self.state == self.HALF_OPEN or self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+                    if self.state != self.OPEN:
+                        logging.warning(f"🔌 {self.name} の回路を開きました（連続失敗 {self.failures} 回）")
+                    self.state = self.OPEN
+                    self.opened_at = time.monotonic()
+            self._probing = False
+            state = self.state
+        set_gauge("circuit_open", 0 if state == self.CLOSED else 1, service=self.name)
+        if not ok:
+            inc("external_errors_total", service=self.name)
+
+    # ---- 呼び出し ----
+
+    def call(self, fn):
+        """
+        fn(timeout) を呼ぶ。fn は渡されたタイムアウト（秒）をクライアントに指定すること
+        """
+        self._acquire()
+        timeout = self.timeout()
+        started = time.perf_counter()
+        try:
+            delay = self.hedge_delay()
+            result = self._hedged(fn, timeout, delay) if delay is not None and delay < timeout else fn(timeout)
+        except Exception:
+            self._record(min(time.perf_counter() - started, timeout), False)
+            raise
+        except BaseException:
+            self._release()
+            raise
+        self._record(time.perf_counter() - started, True)
+        return result
+
+    def _hedged(self, fn, timeout: float, delay: float):
+        deadline = time.monotonic() + timeout
+        first = _hedge_executor.submit(contextvars.copy_context().run, fn, timeout)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        inc("hedged_requests_total", service=self.name)
+        second = _hedge_executor.submit(contextvars.copy_context().run, fn, max(0.001, deadline - time.monotonic()))
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error or TimeoutError(f"{self.name} がタイムアウトしました（{timeout:.1f}s）")
+
+    async def call_async(self, fn):
+        """
+        call の非同期版。fn(timeout) はコルーチンを返すこと
+        """
+        self._acquire()
+        timeout = self.timeout()
+        started = time.perf_counter()
+        try:
+            delay = self.hedge_delay()
+            if delay is not None and delay < timeout:
+                result = await self._hedged_async(fn, timeout, delay)
+            else:
+                result = await asyncio.wait_for(fn(timeout), timeout)
+        except Exception:
+            self._record(min(time.perf_counter() - started, timeout), False)
+            raise
+        except BaseException:
+            self._release()
+            raise
+        self._record(time.perf_counter() - started, True)
+        return result
+
+    async def _hedged_async(self, fn, timeout: float, delay: float):
+        deadline = time.monotonic() + timeout
+        first = asyncio.ensure_future(fn(timeout))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done and first.exception() is None:
+            return first.result()
+        tasks = {first}
+        if not done:
+            inc("hedged_requests_total", service=self.name)
+            tasks.add(asyncio.ensure_future(fn(max(0.001, deadline - time.monotonic()))))
+        error = None
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, timeout=max(0, deadline - time.monotonic()),
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error or asyncio.TimeoutError()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def _max_timeout(name: str, default: float) -> float:
+    return float(os.getenv(f"{name.upper()}_TIMEOUT_MAX", default))
+
+# 下限は通常時の所要時間、上限（VISION_TIMEOUT_MAX など）は返信トークンの有効期限内に収めたい値から
+DEPENDENCIES = {
+    "vision": Dependency("vision", min_timeout=1.0, max_timeout=_max_timeout("vision", 10.0)),
+    "openai": Dependency("openai", min_timeout=2.0, max_timeout=_max_timeout("openai", 15.0)),
+    "musicbrainz": Dependency("musicbrainz", min_timeout=1.0, max_timeout=_max_timeout("musicbrainz", 5.0)),
+}
+for _name in HEDGE_DEPENDENCIES & DEPENDENCIES.keys():
+    DEPENDENCIES[_name].hedge = True
+
+def get(name: str) -> Dependency:
+    return DEPENDENCIES[name]
@@ -1,71 +1,220 @@
 import os
+import hashlib
 import logging
+import threading
 from linebot.v3.messaging import ApiClient, Configuration, MessagingApi, MessagingApiBlob
+from linebot.v3.messaging.exceptions import ApiException
 from linebot.v3.messaging.models import (
     RichMenuRequest, RichMenuArea, RichMenuBounds,
     URIAction, MessageAction
 )
+from supabase_client import supabase
+from utils.metrics import inc
 
-def create_and_link_rich_menu(user_id: str | None = None) -> str:
+RICH_MENU_NAME = "スコア投稿メニュー"
+IMAGE_PATH = os.path.join(os.path.dirname(__file__), "../static/richmenu.png")
+
+# content_hash → rich_menu_id（プロセス内キャッシュ。永続化は rich_menus テーブル）
+_menu_cache = {}
+# デフォルト適用済みのメニューの content_hash
+_default_hash = None
+_lock = threading.Lock()
+
+
+def build_rich_menu_request(content_hash: str) -> RichMenuRequest:
+    return RichMenuRequest(
+        size={"width": 1200, "height": 405},
+        selected=False,
+        # 名前にハッシュを埋め込み、LINE 側の一覧からも定義を特定できるようにする
+        name=f"{RICH_MENU_NAME} {content_hash[:12]}",
+        chat_bar_text="メニュー",
+        areas=[
+            RichMenuArea(
+                bounds=RichMenuBounds(x=0,   y=0, width=400, height=405),
+                action=URIAction(uri="line://nv/camera", label="カメラ起動"),
+            ),
+            RichMenuArea(
+                bounds=RichMenuBounds(x=400, y=0, width=400, height=405),
+                action=MessageAction(label="成績確認", text="成績確認"),
+            ),
+            RichMenuArea(
+                bounds=RichMenuBounds(x=800, y=0, width=400, height=405),
+                action=MessageAction(label="修正", text="修正"),
+            ),
+        ]
+    )
+
+def _load_image() -> bytes:
+    with open(IMAGE_PATH, "rb") as f:
+        return f.read()
+
+def menu_content_hash(image: bytes | None = None) -> str:
     """
-    1) リッチメニューを作成
-    2) 画像をアップロード
-    3) 全ユーザー or 特定ユーザーに適用
+    メニュー定義（名前を除く）と画像の内容からハッシュを計算
     """
+    definition = build_rich_menu_request("").to_json()
+    digest = hashlib.sha256(definition.encode("utf-8"))
+    digest.update(image if image is not None else _load_image())
+    return digest.hexdigest()
+
+def _config() -> Configuration:
     # 環境変数からチャネルアクセストークン取得
     token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
     if not token:
         raise RuntimeError("LINE_CHANNEL_ACCESS_TOKEN is not set")
+    return Configuration(host=os.getenv("LINE_API_ENDPOINT", "https://api.line.me"), access_token=token)
+
+
+# ==============================
+# 永続化（rich_menus テーブル）
+# ==============================
 
-    config = Configuration(access_token=token)
-    with ApiClient(config) as api_client:
-        text_api = MessagingApi(api_client)       # JSON API
-        blob_api = MessagingApiBlob(api_client)   # 画像などバイナリAPI
-
-        # ―― 1) リッチメニュー本体作成 ――
-        rm_request = RichMenuRequest(
-            size={"width": 1200, "height": 405},
-            selected=False,
-            name="スコア投稿メニュー",
-            chat_bar_text="メニュー",
-            areas=[
-                RichMenuArea(
-                    bounds=RichMenuBounds(x=0,   y=0, width=400, height=405),
-                    action=URIAction(uri="line://nv/camera", label="カメラ起動"),
-                ),
-                RichMenuArea(
-                    bounds=RichMenuBounds(x=400, y=0, width=400, height=405),
-                    action=MessageAction(label="成績確認", text="成績確認"),
-                ),
-                RichMenuArea(
-                    bounds=RichMenuBounds(x=800, y=0, width=400, height=405),
-                    action=MessageAction(label="修正", text="修正"),
-                ),
-            ]
-        )
-        resp = text_api.create_rich_menu(rich_menu_request=rm_request)
-        rich_menu_id = resp.rich_menu_id
-        logging.info(f"✅ リッチメニュー作成: {rich_menu_id}")
-
-        # ―― 2) 画像アップロード ――
-        image_path = os.path.join(os.path.dirname(__file__), "../static/richmenu.png")
-        with open(image_path, "rb") as f:
-            body = bytearray(f.read())
-        blob_api.set_rich_menu_image(
-            rich_menu_id=rich_menu_id,
-            body=body,
-            _headers={"Content-Type": "image/png"}
-        )
-        logging.info("✅ リッチメニュー画像アップロード完了")
-
-        # ―― 3) 適用設定 ――
-        if user_id:
-            # 特定ユーザーにのみリンク
-            text_api.link_rich_menu_id_to_user(user_id=user_id, rich_menu_id=rich_menu_id)
-            logging.info(f"✅ リッチメニュー {rich_menu_id} をユーザー {user_id} にリンク")
-        else:
-            # 全ユーザー共通のデフォルトリッチメニューに設定
-            text_api.set_default_rich_menu(rich_menu_id=rich_menu_id)
-            logging.info(f"✅ リッチメニュー {rich_menu_id} を全ユーザーのデフォルトに設定")
+def _load_persisted(content_hash: str):
+    try:
+        resp = supabase.table("rich_menus").select("rich_menu_id, is_default") \
+            .eq("content_hash", content_hash).maybe_single().execute()
+        return resp.data if resp else None
+    except Exception:
+        logging.warning("⚠️ rich_menus の参照に失敗（LINE 側の一覧で代替）", exc_info=True)
+        return None
+
+def _persist(content_hash: str, rich_menu_id: str, is_default: bool):
+    try:
+        if is_default:
+            supabase.table("rich_menus").update({"is_default": False}) \
+                .neq("content_hash", content_hash).execute()
+        supabase.table("rich_menus").upsert({
+            "content_hash": content_hash,
+            "rich_menu_id": rich_menu_id,
+            "is_default": is_default
+        }, on_conflict="content_hash").execute()
+    except Exception:
+        logging.warning("⚠️ rich_menus への保存に失敗", exc_info=True)
+
+
+# ==============================
+# プロビジョニング
+# ==============================
+
+def _find_on_line(text_api: MessagingApi, content_hash: str):
+    name = build_rich_menu_request(content_hash).name
+    for menu in text_api.get_rich_menu_list().richmenus:
+        if menu.name == name:
+            return menu.rich_menu_id
+    return None
+
+def _create(text_api: MessagingApi, blob_api: MessagingApiBlob, content_hash: str, image: bytes) -> str:
+    resp = text_api.create_rich_menu(rich_menu_request=build_rich_menu_request(content_hash))
+    rich_menu_id = resp.rich_menu_id
+    logging.info(f"✅ リッチメニュー作成: {rich_menu_id}")
+
+    blob_api.set_rich_menu_image(
+        rich_menu_id=rich_menu_id,
+        body=bytearray(image),
+        _headers={"Content-Type": "image/png"}
+    )
+    logging.info("✅ リッチメニュー画像アップロード完了")
+    return rich_menu_id
+
+def create_and_link_rich_menu(user_id: str | None = None) -> str:
+    """
+    1) 同じ定義・画像のリッチメニューがあれば再利用、なければ作成して画像をアップロード
+    2) 全ユーザー or 特定ユーザーに適用（デフォルト設定済みなら何もしない）
+    """
+    global _default_hash
+    image = _load_image()
+    content_hash = menu_content_hash(image)
+
+    with _lock:
+        persisted = None
+        rich_menu_id = _menu_cache.get(content_hash)
+        if not rich_menu_id:
+            persisted = _load_persisted(content_hash)
+            rich_menu_id = persisted.get("rich_menu_id") if persisted else None
+
+        with ApiClient(_config()) as api_client:
+            text_api = MessagingApi(api_client)       # JSON API
+            blob_api = MessagingApiBlob(api_client)   # 画像などバイナリAPI
+
+            if not rich_menu_id:
+                rich_menu_id = _find_on_line(text_api, content_hash) \
+                    or _create(text_api, blob_api, content_hash, image)
+                _persist(content_hash, rich_menu_id, is_default=False)
+            _menu_cache[content_hash] = rich_menu_id
+
+            if user_id:
+                # 特定ユーザーにのみリンク
+                text_api.link_rich_menu_id_to_user(user_id=user_id, rich_menu_id=rich_menu_id)
+                logging.info(f"✅ リッチメニュー {rich_menu_id} をユーザー {user_id} にリンク")
+            elif _default_hash != content_hash:
+                # 全ユーザー共通のデフォルトリッチメニューに設定
+                text_api.set_default_rich_menu(rich_menu_id=rich_menu_id)
+                _persist(content_hash, rich_menu_id, is_default=True)
+                _default_hash = content_hash
+                logging.info(f"✅ リッチメニュー {rich_menu_id} を全ユーザーのデフォルトに設定")
 
         return rich_menu_id
+
+def ensure_default_rich_menu():
+    """
+    友だち追加時用。デフォルト適用済みなら LINE API を一切呼ばずに返る。
+    """
+    global _default_hash
+    if _default_hash is not None:
+        inc("cache_hits_total", cache="richmenu")
+        return _menu_cache.get(_default_hash)
+    inc("cache_misses_total", cache="richmenu")
+
+    content_hash = menu_content_hash()
+    persisted = _load_persisted(content_hash)
+    if persisted and persisted.get("is_default"):
+        with _lock:
+            _menu_cache[content_hash] = persisted["rich_menu_id"]
+            _default_hash = content_hash
+        return persisted["rich_menu_id"]
+
+    return create_and_link_rich_menu(user_id=None)
+
+def _is_own_menu(menu) -> bool:
+    # 以前の版はハッシュなしの名前で作っていた
+    return menu.name == RICH_MENU_NAME or (menu.name or "").startswith(f"{RICH_MENU_NAME} ")
+
+def _recorded_menu_ids() -> set:
+    try:
+        resp = supabase.table("rich_menus").select("rich_menu_id").execute()
+        return {r["rich_menu_id"] for r in resp.data or []}
+    except Exception:
+        logging.warning("⚠️ rich_menus の参照に失敗（名前が一致するメニューだけを対象にする）", exc_info=True)
+        return set()
+
+def cleanup_stale_rich_menus(dry_run: bool = False) -> list:
+    """
+    このボットが作ったメニュー（rich_menus に記録があるか、名前が RICH_MENU_NAME のもの）のうち、
+    現在の定義・画像に一致するメニューとデフォルトメニュー以外を削除する。
+    コンソールや他のツールで作ったメニューには触れない
+    """
+    content_hash = menu_content_hash()
+    recorded = _recorded_menu_ids()
+    with ApiClient(_config()) as api_client:
+        text_api = MessagingApi(api_client)
+        keep = {_find_on_line(text_api, content_hash)}
+        try:
+            keep.add(text_api.get_default_rich_menu_id().rich_menu_id)
+        except ApiException:
+            pass  # デフォルト未設定
+
+        stale = [m.rich_menu_id for m in text_api.get_rich_menu_list().richmenus
+                 if m.rich_menu_id not in keep and (m.rich_menu_id in recorded or _is_own_menu(m))]
+        for rich_menu_id in stale:
+            if dry_run:
+                logging.info(f"🔎 削除対象: {rich_menu_id}")
+                continue
+            text_api.delete_rich_menu(rich_menu_id=rich_menu_id)
+            logging.info(f"🗑 リッチメニュー削除: {rich_menu_id}")
+
+    if stale and not dry_run:
+        try:
+            supabase.table("rich_menus").delete().in_("rich_menu_id", stale).execute()
+        except Exception:
+            logging.warning("⚠️ rich_menus の削除に失敗", exc_info=True)
+    return stale
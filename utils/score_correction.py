@@ -0,0 +1,117 @@
+# utils/score_correction.py
+# 最新スコアの修正
+#
+# 修正は apply_score_correction（sql/008_score_correction.sql）の1往復で、
+# 更新・修正後の行の取得・（点数が変わった時だけ）レーティング再計算まで行う。
+# 修正フォームで入力した複数項目は corrections.pending に溜め、「修正完了」でまとめて1回で反映する。
+
+from typing import Optional
+from supabase_client import supabase, mark_written
+from utils.field_map import FIELD_MAP
+from utils.ocr_utils import validate_score_range, parse_correction_command
+
+FORM_COMMAND = "修正フォーム"
+COMPLETE_COMMAND = "修正完了"
+# 「修正 曲名:〇〇 スコア:88.5」のように1通でまとめて修正する
+INLINE_PREFIX = "修正"
+
+
+def parse_score_input(text: str) -> float:
+    """
+    全角のピリオド・カンマも小数点として受け付ける。不正な値は ValueError（メッセージはそのまま返信に使う）
+    """
+    try:
+        value = float(str(text).strip().replace("．", ".").replace("。", ".").replace(",", "."))
+    except ValueError:
+        raise ValueError("⚠️ スコアが数値として認識できませんでした。")
+    if not validate_score_range(value):
+        raise ValueError("⚠️ スコアは30.000以上100.000未満で入力してください。")
+    return value
+
+def coerce_correction_value(column: str, text: str):
+    if column == "score":
+        return parse_score_input(text)
+    return text.strip()
+
+def parse_inline_correction(text: str) -> Optional[dict]:
+    """
+    「修正 曲名:〇〇 スコア:88.5」→ {"song_name": "〇〇", "score": 88.5}。該当しなければ None
+    """
+    if not text.startswith(INLINE_PREFIX) or text in (INLINE_PREFIX, FORM_COMMAND, COMPLETE_COMMAND):
+        return None
+    changes = parse_correction_command(text[len(INLINE_PREFIX):])
+    if not changes:
+        return None
+    return {column: coerce_correction_value(column, value) for column, value in changes.items()}
+
+
+# ==============================
+# 反映
+# ==============================
+
+def apply_correction(user_id: str, changes: dict) -> Optional[dict]:
+    """
+    最新スコアに changes（カラム名 → 値）を反映し、修正後の行を返す（スコアが1件も無ければ None）。
+    点数を変えた場合、行の "user" に再計算後の平均スコア・レーティングが入る。
+    """
+    changes = {k: v for k, v in changes.items() if k in FIELD_MAP.values()}
+    if not changes:
+        raise ValueError("⚠️ 修正する項目がありません。")
+    resp = supabase.rpc("apply_score_correction", {"p_user_id": user_id, "p_changes": changes}).execute()
+    mark_written(user_id)
+    row = resp.data
+    if row and row.get("score") != row.get("previous_score"):
+        _refresh_rank(user_id, row.get("user"))
+    return row
+
+def _refresh_rank(user_id: str, user_data: Optional[dict]):
+    from utils.leaderboard import leaderboard
+    if user_data:
+        leaderboard.update(user_id, user_data.get("average_score"), user_data.get("rating_version"))
+
+def format_correction_reply(row: dict) -> str:
+    msg = (
+        f"✅ 修正完了！\n"
+        f"点数: {row.get('score') or '---'}\n"
+        f"曲名: {row.get('song_name') or '---'}\n"
+        f"アーティスト: {row.get('artist_name') or '---'}"
+    )
+    if row.get("comment"):
+        msg += f"\nコメント: {row['comment']}"
+    user = row.get("user")
+    if user and row.get("score") != row.get("previous_score"):
+        msg += (
+            f"\n\n📊 再計算後の成績\n"
+            f"・レーティング: {user.get('average_rating') or '---'}\n"
+            f"・平均スコア: {user.get('average_score') or '---'}"
+        )
+    return msg
+
+
+# ==============================
+# 修正フォーム（複数項目の一時保存）
+# ==============================
+
+def get_correction_state(user_id: str) -> Optional[dict]:
+    """
+    {"field": 入力待ちの項目（日本語）, "pending": フォームで入力済みの値 or None}
+    """
+    resp = supabase.table("corrections").select("field, pending").eq("user_id", user_id).maybe_single().execute()
+    return resp.data if resp else None
+
+def start_correction_form(user_id: str):
+    supabase.table("corrections").upsert({
+        "user_id": user_id,
+        "field": None,
+        "pending": {},
+        "timestamp": "now()"
+    }, on_conflict="user_id").execute()
+
+def stage_correction_value(user_id: str, column: str, value, pending: dict) -> dict:
+    pending = {**(pending or {}), column: value}
+    supabase.table("corrections").update({"field": None, "pending": pending}).eq("user_id", user_id).execute()
+    return pending
+
+def format_pending(pending: dict) -> str:
+    labels = {column: label for label, column in FIELD_MAP.items()}
+    return "\n".join(f"・{labels.get(k, k)}: {v}" for k, v in pending.items())
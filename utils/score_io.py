@@ -0,0 +1,165 @@
+# utils/score_io.py
+# スコア履歴の一括エクスポート（NDJSON / CSV）と一括インポート
+
+import io
+import csv
+import hashlib
+import json
+import uuid
+import logging
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, List, Tuple
+from supabase_client import supabase, mark_written
+from utils.ocr_utils import validate_score_range
+from routes.scores import build_scores_query
+
+# エクスポートで1往復あたりに読むスコア件数（メモリ上に保持するのはこの件数まで）
+EXPORT_PAGE_SIZE = 500
+EXPORT_FIELDS = [
+    "id", "score", "song_name", "artist_name", "artist_name_normalized",
+    "musicbrainz_id", "genre_tags", "comment", "created_at",
+]
+
+# インポートで受け付けるカラムと上限
+IMPORT_FIELDS = ["score", "song_name", "artist_name", "genre_tags", "comment", "created_at"]
+IMPORT_MAX_ROWS = 5000
+
+
+# ==============================
+# エクスポート
+# ==============================
+
+def iter_user_scores(user_id: str, page_size: int = EXPORT_PAGE_SIZE) -> Iterator[dict]:
+    """
+    (created_at, id) のキーセットでページを順に読み、1件ずつ返す。
+    PostgREST ではサーバー側カーソルを保持できないため、キーセットで同等の逐次読み出しを行う。
+    """
+    cursor = None
+    while True:
+        resp = build_scores_query(
+            supabase.table("scores"), user_id, page_size, cursor, EXPORT_FIELDS
+        ).execute()
+        rows = resp.data or []
+        yield from rows[:page_size]
+        if len(rows) <= page_size:
+            break
+        last = rows[page_size - 1]
+        cursor = (str(last["created_at"]), int(last["id"]))
+
+def iter_ndjson(rows: Iterable[dict]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+def iter_csv(rows: Iterable[dict]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for row in rows:
+        row = dict(row)
+        # 配列は「|」区切りで1セルにまとめる（インポート時も同じ形式で受け付ける）
+        row["genre_tags"] = "|".join(row.get("genre_tags") or [])
+        writer.writerow(row)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+# ==============================
+# インポート
+# ==============================
+
+def parse_import_body(body: str, content_type: str) -> List[dict]:
+    """
+    CSV（ヘッダ行あり）/ NDJSON / JSON 配列を行の dict のリストにする。不正なら ValueError
+    """
+    if "csv" in (content_type or ""):
+        return list(csv.DictReader(io.StringIO(body)))
+    text = body.strip()
+    if text.startswith("["):
+        rows = json.loads(text)
+        if not isinstance(rows, list):
+            raise ValueError("body must be a JSON array")
+        return rows
+    rows = []
+    for n, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            rows.append(json.loads(line))
+        except json.JSONDecodeError:
+            raise ValueError(f"line {n}: invalid JSON")
+    return rows
+
+def _clean_row(row: dict) -> dict:
+    if not isinstance(row, dict):
+        raise ValueError("row must be an object")
+    try:
+        score = float(str(row.get("score")).replace("．", ".").replace(",", "."))
+    except (TypeError, ValueError):
+        raise ValueError("score must be a number")
+    if not validate_score_range(score):
+        raise ValueError("score must be between 30.000 and 100.000")
+
+    # scores.created_at はタイムゾーンなしの UTC。オフセット付き（"+09:00" など）は UTC に直して外し、
+    # オフセットなしは UTC とみなす（エクスポートと同じ形式なので、そのまま戻せる）
+    created_at = row.get("created_at")
+    if created_at:
+        try:
+            dt = datetime.fromisoformat(str(created_at).replace("Z", "+00:00"))
+        except ValueError:
+            raise ValueError("created_at must be ISO 8601")
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+        created_at = dt.isoformat()
+    else:
+        created_at = datetime.utcnow().isoformat()
+
+    genre_tags = row.get("genre_tags") or []
+    if isinstance(genre_tags, str):
+        genre_tags = [g for g in genre_tags.split("|") if g]
+
+    return {
+        "score": round(score, 3),
+        "song_name": row.get("song_name") or None,
+        "artist_name": row.get("artist_name") or None,
+        "genre_tags": genre_tags,
+        "comment": row.get("comment") or None,
+        "created_at": created_at,
+    }
+
+def validate_import_rows(rows: List[dict]) -> Tuple[List[dict], List[dict]]:
+    """
+    全行を検証して (正規化済みの行, エラー一覧) を返す。エラー行番号は 1 始まり
+    """
+    cleaned, errors = [], []
+    for n, row in enumerate(rows, start=1):
+        try:
+            cleaned.append(_clean_row(row))
+        except ValueError as e:
+            errors.append({"row": n, "error": str(e)})
+    return cleaned, errors
+
+def import_key(user_id: str, body: str, idempotency_key: str = None) -> str:
+    """
+    インポートの冪等キー。Idempotency-Key が無ければ本文から決める（同じ本文の再送は同じキー）
+    """
+    if idempotency_key:
+        return idempotency_key
+    return hashlib.sha256(f"{user_id}\n{body}".encode("utf-8")).hexdigest()
+
+def _client_id(user_id: str, key: str, n: int) -> str:
+    # 同じインポートの同じ行は常に同じ client_id になり、DB 側の一意制約で重複を無視する
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"score-import:{user_id}:{key}:{n}"))
+
+def import_scores(user_id: str, rows: List[dict], key: str) -> int:
+    """
+    全行を1回の RPC（1トランザクション）で登録し、件数と平均スコアも同時に更新する（sql/019_score_import_atomic.sql）。
+    失敗時は何も登録されない。同じ key の再送では既に入った行を無視し、新しく入った件数を返す
+    """
+    payload = [dict(r, client_id=_client_id(user_id, key, n)) for n, r in enumerate(rows, start=1)]
+    inserted = supabase.rpc("import_scores", {"p_user_id": user_id, "p_rows": payload}).execute().data or 0
+    mark_written(user_id)
+    logging.info(f"✅ スコアインポート {inserted}/{len(rows)}（user_id={user_id}）")
+    return inserted
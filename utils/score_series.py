@@ -0,0 +1,203 @@
+# utils/score_series.py
+# グラフ用のスコア履歴の時系列（/api/scores/series）
+#
+# ユーザーの全スコアを (時刻, 点数) の配列で持ち、直近 SCORE_EVAL_COUNT 件の平均（レーティングの元）を
+# 累積和で一括計算したうえで、どちらの系列も LTTB（Largest-Triangle-Three-Buckets）で
+# 指定の点数まで間引いて返す。山や谷を残したまま、履歴の長さに関係なく応答の大きさを一定に抑える。
+#
+# 配列はユーザーごとに LRU でキャッシュする。users.score_version（/api/scores の ETag と同じ判定。
+# sql/014_scores_version.sql）が進んでいれば読み直し、このワーカーでの書き込み時
+# （supabase_client.mark_written）は即座に捨てる。
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from utils.constants import SCORE_EVAL_COUNT
+
+DEFAULT_POINTS = 200
+MAX_POINTS = 1000
+LOAD_PAGE_SIZE = 1000
+CACHE_SIZE = int(os.getenv("SERIES_CACHE_SIZE", 256))
+
+
+def parse_points(args) -> int:
+    """
+    points（返す点数の上限）を検証して返す。不正なら ValueError
+    """
+    try:
+        points = int(args.get("points", DEFAULT_POINTS))
+    except ValueError:
+        raise ValueError("points must be an integer")
+    if not 3 <= points <= MAX_POINTS:
+        raise ValueError(f"points must be between 3 and {MAX_POINTS}")
+    return points
+
+def build_history_query(table, user_id, after=None):
+    """
+    (created_at, id) の昇順でキーセット・ページネーション（aio_app と共用）
+    """
+    query = table.select("id,score,created_at").eq("user_id", user_id)
+    if after:
+        created_at, score_id = after
+        query = query.or_(
+            f'created_at.gt."{created_at}",'
+            f'and(created_at.eq."{created_at}",id.gt.{score_id})'
+        )
+    return query.order("created_at").order("id").limit(LOAD_PAGE_SIZE)
+
+def next_page(rows):
+    """
+    次ページのキー（最後のページなら None）
+    """
+    if len(rows) < LOAD_PAGE_SIZE:
+        return None
+    return rows[-1]["created_at"], rows[-1]["id"]
+
+
+def load_history(db, user_id: str) -> "History":
+    rows, after = [], None
+    while True:
+        page = build_history_query(db.table("scores"), user_id, after).execute().data or []
+        rows.extend(page)
+        after = next_page(page)
+        if after is None:
+            return History(rows)
+
+async def load_history_async(db, user_id: str) -> "History":
+    rows, after = [], None
+    while True:
+        page = (await build_history_query(db.table("scores"), user_id, after).execute()).data or []
+        rows.extend(page)
+        after = next_page(page)
+        if after is None:
+            return History(rows)
+
+
+def _epoch(created_at) -> int:
+    # scores.created_at は UTC（タイムゾーンなし）で保存している
+    dt = datetime.fromisoformat(str(created_at))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+class History:
+    """
+    1ユーザーのスコア履歴（古い順）。t は UNIX 時刻（秒）、average は各時点の直近 window 件の平均
+    """
+
+    def __init__(self, rows, window: int = SCORE_EVAL_COUNT):
+        import numpy as np
+        rows = [r for r in rows if r.get("score") is not None]
+        self.t = np.array([_epoch(r["created_at"]) for r in rows], dtype=np.int64)
+        self.score = np.array([r["score"] for r in rows], dtype=float)
+        # update_average_score と同じ規則（件数が window 未満ならある分だけの平均）
+        cumsum = np.concatenate(([0.0], np.cumsum(self.score)))
+        n = np.arange(1, len(rows) + 1)
+        count = np.minimum(n, window)
+        self.average = np.round((cumsum[n] - cumsum[n - count]) / np.maximum(count, 1), 3)
+        self.window = window
+
+    def __len__(self):
+        return len(self.score)
+
+
+def lttb(x, y, points: int):
+    """
+    (x, y) を LTTB で points 点に間引いた時の添字（先頭・末尾は必ず含む）
+    """
+    import numpy as np
+    size = len(x)
+    if points >= size or points < 3:
+        return np.arange(size)
+    x = x.astype(float)
+    # 先頭・末尾を除いた点を points - 2 個のバケツに分ける
+    edges = np.linspace(1, size - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            cx, cy = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+        # 直前に選んだ点・次のバケツの平均点と三角形の面積が最大になる点を選ぶ
+        area = np.abs((x[a] - cx) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (cy - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+def build_series(user_id: str, history: History, points: int) -> dict:
+    def downsample(values):
+        idx = lttb(history.t, values, points)
+        return {"t": history.t[idx].tolist(), "v": values[idx].tolist()}
+
+    return {
+        "line_user_id": user_id,
+        "total": len(history),
+        "window": history.window,
+        "score": downsample(history.score),
+        "average": downsample(history.average),
+    }
+
+
+def compute_etag(version, points) -> str:
+    basis = json.dumps(["series", version, points], sort_keys=True, default=str)
+    return hashlib.sha256(basis.encode("utf-8")).hexdigest()[:32]
+
+
+# ==============================
+# キャッシュ
+# ==============================
+
+class _Entry:
+    __slots__ = ("version", "history", "series")
+
+    def __init__(self, version, history):
+        self.version = version
+        self.history = history
+        self.series = {}  # points → build_series の結果
+
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+def cached_series(user_id: str, version, points: int):
+    """
+    キャッシュにある時系列（無い・古い時は None）
+    """
+    with _lock:
+        entry = _cache.get(user_id)
+        # version が None（users に行が無い）の時はキャッシュを使わない
+        if entry is None or version is None or entry.version != version:
+            return None
+        _cache.move_to_end(user_id)
+        series = entry.series.get(points)
+    if series is None:
+        # 配列は読み直さず、間引きだけやり直す（points の種類が増えすぎたら捨てる）
+        series = build_series(user_id, entry.history, points)
+        with _lock:
+            if len(entry.series) >= 8:
+                entry.series.clear()
+            entry.series[points] = series
+    return series
+
+def store_series(user_id: str, version, history: History, points: int) -> dict:
+    series = build_series(user_id, history, points)
+    entry = _Entry(version, history)
+    entry.series[points] = series
+    with _lock:
+        _cache[user_id] = entry
+        _cache.move_to_end(user_id)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return series
+
+def invalidate(user_id: str):
+    with _lock:
+        _cache.pop(user_id, None)
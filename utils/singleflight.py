@@ -0,0 +1,82 @@
+# utils/singleflight.py
+# 同じユーザーの同じ読み取りが同時に複数来たら、1回だけ実行して結果を全員に返す
+#
+# キーは (クエリ名, user_id, ...) のタプル。実行中の読み取りに後から来た呼び出しが相乗りする
+# （終わった読み取りの結果は残さないので、キャッシュとは違い古い値を返し続けることはない）。
+# そのユーザーの書き込み後は supabase_client.mark_written → forget で実行中の読み取りから切り離し、
+# 書き込み前に始まった読み取りの結果を書き込んだ本人に返さないようにする。
+# 結果は相乗りした全員で共有するため、呼び出し側で変更しないこと。
+
+import asyncio
+import threading
+from utils.metrics import inc
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_calls = {}
+_lock = threading.Lock()
+
+def do(key: tuple, fn):
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+    if not leader:
+        inc("coalesced_reads_total", query=key[0])
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+    try:
+        call.result = fn()
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            if _calls.get(key) is call:
+                del _calls[key]
+        call.done.set()
+
+
+# イベントループごとに (キー → Task)
+_tasks = {}
+
+async def do_async(key: tuple, coro_fn):
+    loop = asyncio.get_running_loop()
+    tasks = _tasks.setdefault(loop, {})
+    task = tasks.get(key)
+    if task is None:
+        task = tasks[key] = loop.create_task(coro_fn())
+
+        def _done(t):
+            if tasks.get(key) is t:
+                tasks.pop(key, None)
+        task.add_done_callback(_done)
+    else:
+        inc("coalesced_reads_total", query=key[0])
+    # 1人がキャンセルされても相乗りしている他の呼び出しには影響させない
+    return await asyncio.shield(task)
+
+
+def forget(user_id: str):
+    """
+    user_id の実行中の読み取りに、これ以降の呼び出しを相乗りさせない
+    """
+    with _lock:
+        for key in [k for k in _calls if len(k) > 1 and k[1] == user_id]:
+            del _calls[key]
+    # 非同期モードでは to_thread 先からも呼ばれるため、キーの一覧を写してから消す
+    for tasks in list(_tasks.values()):
+        for key in [k for k in list(tasks) if len(k) > 1 and k[1] == user_id]:
+            tasks.pop(key, None)
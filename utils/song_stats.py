@@ -0,0 +1,83 @@
+# utils/song_stats.py
+# 曲ごとの自己ベスト（user_song_stats, sql/010_song_stats.sql）
+#
+# 集計は scores のトリガーが更新し、参照は (user_id, song_key) の主キー1件だけ。
+# handle_image では登録前の集計を読み、今回のスコアを足した結果で「自己ベスト更新」などの見出しを作る
+# （書き込み遅延中の未書き込み分も同じ規則で足すため、登録方式によらず同じ返信になる）。
+
+import re
+import unicodedata
+from typing import Iterable, Optional
+# song_key / fold は負荷試験のスタンドインからも使うため、Supabase クライアントは関数内で import する
+
+
+def song_key(song_name: Optional[str]) -> Optional[str]:
+    """
+    SQL の song_key() と同じ規則（NFKC・小文字化・空白除去）
+    """
+    if not song_name:
+        return None
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", song_name)).lower() or None
+
+
+def get_song_stats(user_id: str, song_name: Optional[str]) -> Optional[dict]:
+    from supabase_client import supabase
+    if not song_key(song_name):
+        return None
+    return supabase.rpc("get_song_stats", {"p_user_id": user_id, "p_song_name": song_name}).execute().data
+
+async def get_song_stats_async(user_id: str, song_name: Optional[str]) -> Optional[dict]:
+    from supabase_client import get_async_supabase
+    if not song_key(song_name):
+        return None
+    db = await get_async_supabase()
+    return (await db.rpc("get_song_stats", {"p_user_id": user_id, "p_song_name": song_name}).execute()).data
+
+
+def fold(stats: Optional[dict], score: float, created_at: str, song_name: str) -> dict:
+    """
+    集計に1行足す（scores_song_stats_trigger の INSERT と同じ）
+    """
+    if not stats:
+        return {"song_name": song_name, "count": 1, "score_sum": score, "best_score": score, "best_at": created_at,
+                "latest_score": score, "latest_at": created_at, "previous_score": None}
+    stats = dict(stats)
+    stats["count"] += 1
+    stats["score_sum"] += score
+    if score > stats["best_score"]:
+        stats["best_score"], stats["best_at"] = score, created_at
+    if created_at >= stats["latest_at"]:
+        stats["song_name"] = song_name
+        stats["previous_score"], stats["latest_score"], stats["latest_at"] = stats["latest_score"], score, created_at
+    return stats
+
+def fold_pending(stats: Optional[dict], song_name: str, pending: Iterable[dict]) -> Optional[dict]:
+    """
+    書き込み遅延で未書き込みの行（新しい順）のうち同じ曲の分を足す
+    """
+    key = song_key(song_name)
+    for row in reversed(list(pending)):
+        if row.get("score") is not None and song_key(row.get("song_name")) == key:
+            stats = fold(stats, row["score"], row["created_at"], row["song_name"])
+    return stats
+
+
+def format_song_headline(before: Optional[dict], score: float, song_name: Optional[str]) -> Optional[str]:
+    """
+    before は今回の登録前の集計。曲名が読み取れなかった時は None
+    """
+    if not song_key(song_name):
+        return None
+    if not before:
+        return f"🎵 「{song_name}」初登録！"
+    count = before["count"] + 1
+    if score > before["best_score"]:
+        return f"🎉 「{song_name}」自己ベスト更新！ {before['best_score']} → {score}（{count}回目）"
+    average = round((before["score_sum"] + score) / count, 3)
+    diff = score - before["latest_score"]
+    trend = "📈" if diff > 0 else "📉" if diff < 0 else "➡️"
+    return (
+        f"🎵 「{song_name}」{count}回目\n"
+        f"・ベスト: {before['best_score']} / 平均: {average}\n"
+        f"・前回比: {trend} {diff:+.3f}"
+    )
@@ -1,12 +1,22 @@
+import asyncio
 from typing import Optional
-from supabase_client import supabase
+from supabase_client import reader, async_reader
+from utils import singleflight
+from utils.leaderboard import leaderboard
 from utils.rating_predictor import predict_next_rating
 from utils.constants import SCORE_EVAL_COUNT
 
+USER_STATS_COLUMNS = "average_score, average_rating, next_up_score, next_down_score, score_count, rating_version"
+
 
 def build_user_stats_message(user_id: str) -> Optional[str]:
+    # 同じユーザーの同時の問い合わせは1回の読み取りにまとめる
+    return singleflight.do(("user_stats", user_id), lambda: _build_user_stats_message(user_id))
+
+def _build_user_stats_message(user_id: str) -> Optional[str]:
+    db = reader(user_id)
     # スコア取得（最新SCORE_EVAL_COUNT件）
-    resp = supabase.table("scores") \
+    resp = db.table("scores") \
         .select("score, created_at") \
         .eq("user_id", user_id) \
         .order("created_at", desc=True) \
@@ -17,19 +27,55 @@ def build_user_stats_message(user_id: str) -> Optional[str]:
     if not score_list:
         return None
 
-    latest_score = score_list[0]
-    max_score = max(score_list)
-
     # ユーザー情報（DBから取得）
-    user_info = supabase.table("users") \
-        .select("average_score, average_rating, next_up_score, next_down_score, score_count") \
+    user_info = db.table("users") \
+        .select(USER_STATS_COLUMNS) \
         .eq("id", user_id).single().execute()
 
-    average_score = user_info.data.get("average_score") if user_info.data else None
-    average_rating = user_info.data.get("average_rating") or "---"
-    score_count = user_info.data.get("score_count") or 0
-    next_up_score = user_info.data.get("next_up_score")
-    next_down_score = user_info.data.get("next_down_score")
+    leaderboard.maybe_sync()
+    return format_user_stats_message(score_list, user_info.data, _rank_of(user_id, user_info.data))
+
+
+async def build_user_stats_message_async(user_id: str) -> Optional[str]:
+    return await singleflight.do_async(("user_stats", user_id), lambda: _build_user_stats_message_async(user_id))
+
+async def _build_user_stats_message_async(user_id: str) -> Optional[str]:
+    db = await async_reader(user_id)
+    resp = await db.table("scores") \
+        .select("score, created_at") \
+        .eq("user_id", user_id) \
+        .order("created_at", desc=True) \
+        .limit(SCORE_EVAL_COUNT) \
+        .execute()
+
+    score_list = [s["score"] for s in resp.data if s.get("score") is not None]
+    if not score_list:
+        return None
+
+    user_info = await db.table("users") \
+        .select(USER_STATS_COLUMNS) \
+        .eq("id", user_id).single().execute()
+
+    await asyncio.to_thread(leaderboard.maybe_sync)
+    return format_user_stats_message(score_list, user_info.data, _rank_of(user_id, user_info.data))
+
+
+def _rank_of(user_id: str, user_data: Optional[dict]) -> Optional[dict]:
+    # 今読んだ最新の平均スコアを順位インデックスへ反映してから順位を引く
+    if user_data:
+        leaderboard.update(user_id, user_data.get("average_score"), user_data.get("rating_version"))
+    return leaderboard.rank(user_id)
+
+
+def format_user_stats_message(score_list: list, user_data: Optional[dict], rank_info: Optional[dict] = None) -> str:
+    latest_score = score_list[0]
+    max_score = max(score_list)
+
+    average_score = user_data.get("average_score") if user_data else None
+    average_rating = user_data.get("average_rating") or "---"
+    score_count = user_data.get("score_count") or 0
+    next_up_score = user_data.get("next_up_score")
+    next_down_score = user_data.get("next_down_score")
 
     # レーティング情報（動的な補足計算が必要なら）
     rating_info = predict_next_rating(score_list) if average_score is not None else {}
@@ -43,6 +89,8 @@ def build_user_stats_message(user_id: str) -> Optional[str]:
         f"・最高スコア: {max_score or '---'}\n"
         f"・登録回数: {score_count} 回\n"
     )
+    if rank_info:
+        msg += f"・全体順位: {rank_info['rank']} 位 / {rank_info['total']} 人（上位 {rank_info['top_percent']}%）\n"
     # レーティング変動予測（DBの next_up_score / next_down_score を使用）
     if next_up_score is not None and next_up_score <= 100:
         msg += f"・次の曲でレーティングを上がるには {next_up_score} 点が必要！\n"
@@ -0,0 +1,120 @@
+# utils/tracing.py
+# Webhook イベント単位のトレース（トレースIDのログ付与と、遅いイベントの段階別内訳ログ）
+
+import os
+import time
+import uuid
+import logging
+import functools
+import contextvars
+
+# イベント受信からの合計処理時間がこれを超えたら段階別の内訳をログに出す（秒）
+SLOW_EVENT_THRESHOLD = float(os.getenv("SLOW_EVENT_THRESHOLD", 3.0))
+
+# asyncio のタスクや asyncio.to_thread 先にもそのまま引き継がれる
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    __slots__ = ("trace_id", "kind", "event_timestamp", "started", "spans")
+
+    def __init__(self, trace_id: str, kind: str, event_timestamp=None):
+        self.trace_id = trace_id
+        self.kind = kind
+        # LINE 側のイベント発生時刻（ミリ秒）。配信遅延の把握に使う
+        self.event_timestamp = event_timestamp
+        self.started = time.perf_counter()
+        # (段階名, 開始オフセット秒, 所要秒, 例外で終わったか)
+        self.spans = []
+
+    def add_span(self, name: str, started: float, elapsed: float, failed: bool):
+        self.spans.append((name, started - self.started, elapsed, failed))
+
+    def breakdown(self, total: float) -> str:
+        lines = [f"🐢 遅いイベント trace={self.trace_id} kind={self.kind} total={total * 1000:.0f}ms"]
+        if self.event_timestamp:
+            lag = time.time() - self.event_timestamp / 1000 - total
+            lines.append(f"  受信までの遅延: {lag * 1000:.0f}ms")
+        for name, offset, elapsed, failed in sorted(self.spans, key=lambda s: s[1]):
+            mark = " ❌" if failed else ""
+            lines.append(f"  +{offset * 1000:7.0f}ms {name:22s} {elapsed * 1000:8.1f}ms{mark}")
+        return "\n".join(lines)
+
+
+def current_trace():
+    return _current.get()
+
+def current_trace_id() -> str:
+    trace = _current.get()
+    return trace.trace_id if trace else "-"
+
+def record_span(name: str, started: float, elapsed: float, failed: bool):
+    """
+    utils.metrics.timed から呼ばれる。トレース外なら何もしない
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.add_span(name, started, elapsed, failed)
+
+
+class start_trace:
+    """
+    with start_trace(event): ... の間のログにトレースIDを付け、
+    終了時に合計時間が SLOW_EVENT_THRESHOLD を超えていれば内訳を出す。
+    既にトレース中なら（非同期版から to_thread で呼ばれた場合など）そのトレースを使う。
+    """
+    __slots__ = ("event", "trace", "token")
+
+    def __init__(self, event=None):
+        self.event = event
+        self.trace = None
+        self.token = None
+
+    def __enter__(self):
+        if _current.get() is not None:
+            return _current.get()
+        event = self.event
+        trace_id = getattr(event, "webhook_event_id", None) or uuid.uuid4().hex[:26].upper()
+        kind = getattr(event, "type", None) or "request"
+        message = getattr(event, "message", None)
+        if message is not None and getattr(message, "type", None):
+            kind = f"{kind}/{message.type}"
+        self.trace = Trace(trace_id, kind, getattr(event, "timestamp", None))
+        self.token = _current.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.token is None:
+            return False
+        total = time.perf_counter() - self.trace.started
+        if total >= SLOW_EVENT_THRESHOLD:
+            logging.warning(self.trace.breakdown(total))
+        _current.reset(self.token)
+        return False
+
+
+def traced(func):
+    """
+    イベントハンドラ用デコレータ。引数のイベントでトレースを開始する。
+    WebhookHandler は引数の数で destination を渡すか決めるため、引数はイベント1つに固定する
+    """
+    @functools.wraps(func)
+    def wrapper(event):
+        with start_trace(event):
+            return func(event)
+    return wrapper
+
+
+class TraceIdFilter(logging.Filter):
+    """
+    ログレコードに trace_id 属性を付ける（フォーマットで %(trace_id)s を使えるようにする）
+    """
+
+    def filter(self, record):
+        record.trace_id = current_trace_id()
+        return True
+
+def install_log_filter():
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, TraceIdFilter) for f in handler.filters):
+            handler.addFilter(TraceIdFilter())
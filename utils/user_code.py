@@ -1,13 +1,53 @@
-import random
+import os
+import hmac
+import hashlib
 import string
-from supabase_client import supabase
+from utils.metrics import inc
 
-def generate_user_code(length=8):
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+ALPHABET = string.ascii_uppercase + string.digits
+# user_code の一意制約違反時に試す候補数（8桁36進で衝突自体がまず起きない）
+MAX_ATTEMPTS = 5
 
-def generate_unique_user_code():
-    while True:
-        code = generate_user_code()
-        result = supabase.table("users").select("id").eq("user_code", code).execute()
-        if not result.data:
-            return code
+def _secret() -> bytes:
+    return (os.getenv("USER_CODE_SECRET") or os.getenv("LINE_CHANNEL_SECRET") or "").encode("utf-8")
+
+def generate_user_code(user_id: str, attempt: int = 0, length=8) -> str:
+    """
+    LINE ユーザーIDの鍵付きハッシュからユーザーコードを導出する（DB 参照なし）。
+    同じ user_id / attempt なら常に同じコードになる。
+    """
+    digest = hmac.new(_secret(), f"{user_id}:{attempt}".encode("utf-8"), hashlib.sha256).digest()
+    n = int.from_bytes(digest, "big")
+    code = []
+    for _ in range(length):
+        n, r = divmod(n, len(ALPHABET))
+        code.append(ALPHABET[r])
+    return "".join(code)
+
+def is_user_code_conflict(e: Exception) -> bool:
+    from postgrest.exceptions import APIError
+    return isinstance(e, APIError) and e.code == "23505" and \
+        "user_code" in f"{e.message or ''} {e.details or ''}"
+
+def with_unique_user_code(user_id: str, write):
+    """
+    write(code) を実行し、users.user_code の一意制約に弾かれた時だけ次の候補で再試行する
+    """
+    from postgrest.exceptions import APIError
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return write(generate_user_code(user_id, attempt))
+        except APIError as e:
+            if not is_user_code_conflict(e) or attempt == MAX_ATTEMPTS - 1:
+                raise
+            inc("retries_total", service="user_code")
+
+async def with_unique_user_code_async(user_id: str, write):
+    from postgrest.exceptions import APIError
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return await write(generate_user_code(user_id, attempt))
+        except APIError as e:
+            if not is_user_code_conflict(e) or attempt == MAX_ATTEMPTS - 1:
+                raise
+            inc("retries_total", service="user_code")
@@ -0,0 +1,147 @@
+# utils/weekly_summary.py
+# 週次サマリー「今週のカラオケ」（scripts/weekly_summary.py の配信と、「今週の記録」への返信）
+#
+# 配信の本文はランクの変化（先週 → 今週）ごとに共通にして、同じ本文の宛先をマルチキャストで
+# 最大 500 人ずつまとめて送る（utils/multicast.py）。登録回数・最高スコアなどの個人の数字は
+# 本文に入れず、クイックリプライの「今週の記録」への返信（無料の応答メッセージ）で返す。
+# ボタンは「今週の記録 2026-W42」のように配信した週を付けて送るため、--week で過去の週を配信した時や
+# 翌週になってから押された時も、配信した週の記録を返す。
+
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from utils import rating
+from utils.constants import SCORE_EVAL_COUNT
+
+JST = timezone(timedelta(hours=9))
+PAGE_SIZE = 1000
+WEEKLY_COMMAND = "今週の記録"
+
+
+def week_range(week: str = None):
+    """
+    "2026-W42" → その週の (月曜, 翌週月曜)（JST の日付）。省略時は先週
+    """
+    if week:
+        year, _, number = week.partition("-W")
+        monday = date.fromisocalendar(int(year), int(number), 1)
+    else:
+        today = datetime.now(JST).date()
+        monday = today - timedelta(days=today.weekday() + 7)
+    return monday, monday + timedelta(days=7)
+
+def week_id(since: date) -> str:
+    year, number, _ = since.isocalendar()
+    return f"{year}-W{number:02d}"
+
+def _utc(day: date) -> str:
+    # scores.created_at は UTC（タイムゾーンなし）で保存している
+    return datetime.combine(day, datetime.min.time(), JST).astimezone(timezone.utc).replace(tzinfo=None).isoformat()
+
+def _params(since: date, until: date, after: str = "", limit: int = PAGE_SIZE, user_id: str = None) -> dict:
+    return {
+        "p_since": _utc(since), "p_until": _utc(until), "p_window": SCORE_EVAL_COUNT,
+        "p_after": after, "p_limit": limit, "p_user_id": user_id,
+    }
+
+
+def load_summaries(since: date, until: date):
+    """
+    get_weekly_summaries（sql/016_weekly_summary_user.sql）で全対象ユーザーの集計を user_id 順に取得する
+    """
+    from supabase_client import supabase
+    after = ""
+    while True:
+        rows = supabase.rpc("get_weekly_summaries", _params(since, until, after)).execute().data or []
+        yield from rows
+        if len(rows) < PAGE_SIZE:
+            return
+        after = rows[-1]["user_id"]
+
+def get_summary(user_id: str, since: date, until: date) -> Optional[dict]:
+    from supabase_client import supabase
+    rows = supabase.rpc("get_weekly_summaries", _params(since, until, limit=1, user_id=user_id)).execute().data
+    return rows[0] if rows else None
+
+
+def _period(since: date, until: date) -> str:
+    last_day = until - timedelta(days=1)
+    return f"{since.month}/{since.day}〜{last_day.month}/{last_day.day}"
+
+def rank_change(row: dict):
+    """
+    (先週末のランク or None, 今週末のランク)
+    """
+    before, after = row.get("average_before"), row.get("average_after")
+    return (rating.get_rank(before) if before is not None else None,
+            rating.get_rank(after) if after is not None else None)
+
+def format_broadcast(row: dict, since: date, until: date) -> str:
+    """
+    配信の本文。ランクの変化だけで決まるため、同じ変化のユーザーには同じ本文になる
+    """
+    before, after = rank_change(row)
+    if after is None:
+        line = "今週もおつかれさまでした！"
+    elif before is None:
+        line = f"🆕 はじめてのレーティングは {after} です！"
+    elif rating.RANK_ORDER.index(after) > rating.RANK_ORDER.index(before):
+        line = f"🎉 レーティングが {before} → {after} に上がりました！"
+    elif rating.RANK_ORDER.index(after) < rating.RANK_ORDER.index(before):
+        line = f"📉 レーティングは {before} → {after}。来週の巻き返しに期待！"
+    else:
+        line = f"👍 レーティング {after} をキープしました。"
+    return (
+        f"🎤 今週のカラオケ（{_period(since, until)}）\n"
+        f"{line}\n\n"
+        f"登録回数・最高スコアなどは、下のボタン（または「{WEEKLY_COMMAND}」と送信）で確認できます。"
+    )
+
+def format_summary(row: dict, since: date, until: date) -> str:
+    """
+    個人の記録（「今週の記録」への返信）
+    """
+    msg = (
+        f"🎤 今週のカラオケ（{_period(since, until)}）\n"
+        f"・登録: {row['count']} 回（{row['songs']} 曲）\n"
+        f"・最高スコア: {row['best_score']}（{row.get('best_song') or '曲名不明'}）\n"
+        f"・今週の平均: {round(row['week_average'], 3)}"
+    )
+    after = row.get("average_after")
+    if after is not None:
+        before = row.get("average_before")
+        if before is None:
+            msg += f"\n・レーティング: {rating.get_rank(after)}（平均 {round(after, 3)}）"
+        else:
+            msg += (
+                f"\n・レーティング: {rating.get_rank(before)} → {rating.get_rank(after)}"
+                f"（平均 {round(before, 3)} → {round(after, 3)}）"
+            )
+    return msg
+
+def quick_reply(since: date):
+    """
+    配信に付けるクイックリプライ [(ラベル, 送信する文字列)]
+    """
+    return [(WEEKLY_COMMAND, f"{WEEKLY_COMMAND} {week_id(since)}")]
+
+def parse_command(text: str) -> Optional[str]:
+    """
+    「今週の記録」なら ""、「今週の記録 2026-W42」なら "2026-W42"、それ以外は None
+    """
+    command, _, week = text.partition(" ")
+    if command != WEEKLY_COMMAND:
+        return None
+    return week.strip()
+
+def build_reply(user_id: str, week: str = None) -> str:
+    """
+    「今週の記録」への返信（週の指定が無い・読めない時は先週分）
+    """
+    try:
+        since, until = week_range(week)
+    except ValueError:
+        since, until = week_range()
+    row = get_summary(user_id, since, until)
+    if row is None:
+        return f"ℹ️ {_period(since, until)} のスコアの登録はありません。"
+    return format_summary(row, since, until)
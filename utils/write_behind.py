@@ -0,0 +1,291 @@
+# utils/write_behind.py
+# スコア登録の書き込み遅延（write-behind）
+#
+# WRITE_BEHIND=1 の時、handle_image はスコアをここに積んですぐに応答し、
+# scores の INSERT・users のカウンタ更新・平均スコア更新は、一定間隔または一定件数ごとに
+# apply_score_batch（sql/007_write_behind.sql）1回にまとめて書き込む。
+#
+# 積んだ行はワーカーごとの追記専用ジャーナルにも書く。ワーカーが落ちた場合は、
+# 次に起動したワーカーが持ち主のいないジャーナルを引き取って再送する。
+# 各行は client_id（UUID）を持ち、DB 側で重複を無視するため、再送しても二重登録にならない。
+
+import os
+import json
+import uuid
+import atexit
+import logging
+import threading
+from typing import List, Optional
+from supabase_client import supabase, mark_written
+from utils import rating
+from utils.constants import SCORE_EVAL_COUNT
+from utils.metrics import timed, inc
+from utils.rating_predictor import predict_next_rating
+
+ENABLED = os.getenv("WRITE_BEHIND", "0") == "1"
+# 書き込み間隔（秒）と、これだけ溜まったら間隔を待たずに書く件数（1回の RPC の上限も兼ねる）
+FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", 1.0))
+MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", 200))
+JOURNAL_DIR = os.getenv("WRITE_BEHIND_JOURNAL_DIR", "/tmp/scorebot-write-behind")
+# 0 にすると応答前の fsync を省く（OS ごと落ちた場合は直近の行を失う）
+FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "1") == "1"
+# 書き込み失敗時の待ち時間の上限（秒）
+MAX_BACKOFF = 30.0
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _read_journal(path: str) -> List[dict]:
+    """
+    書きかけの最終行（落ちた瞬間の途中書き）は読み飛ばす
+    """
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                logging.warning(f"⚠️ ジャーナルの壊れた行を無視: {path}")
+    return rows
+
+
+class WriteBehindBuffer:
+    """
+    未書き込みのスコア行（古い順）とそのジャーナル。
+    行の追加は任意のスレッドから、削除は書き込みスレッドだけが先頭から行う。
+    """
+
+    def __init__(self, journal_dir: str = JOURNAL_DIR):
+        self.journal_dir = journal_dir
+        self.pid = os.getpid()
+        self.journal_path = os.path.join(journal_dir, f"journal-{self.pid}.jsonl")
+        self.pending = []
+        self._journal = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---- 起動・終了 ----
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.journal_dir, exist_ok=True)
+        recovered = self._claim_orphans()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        if recovered:
+            with self._lock:
+                for row in recovered:
+                    self._append(row)
+                self._sync_journal()
+            self._delete_claimed()
+            logging.info(f"♻️ 前回のワーカーの未書き込みスコア {len(recovered)} 件を再送します")
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _claim_orphans(self) -> List[dict]:
+        """
+        持ち主のワーカーが既にいないジャーナル（同じ PID の前回プロセスの分を含む）を
+        rename で引き取る。rename は原子的なので、複数ワーカーが同時に起動しても1つだけが引き取る。
+        """
+        rows = []
+        self._claimed = []
+        for name in sorted(os.listdir(self.journal_dir)):
+            if not name.endswith(".jsonl"):
+                continue
+            try:
+                pid = int(name.rsplit(".", 1)[0].split("-")[1])
+            except (IndexError, ValueError):
+                continue
+            if pid != self.pid and _pid_alive(pid):
+                continue
+            claimed = os.path.join(self.journal_dir, f"replay-{self.pid}-{uuid.uuid4().hex[:8]}.jsonl")
+            try:
+                os.rename(os.path.join(self.journal_dir, name), claimed)
+            except FileNotFoundError:
+                continue
+            self._claimed.append(claimed)
+            rows.extend(_read_journal(claimed))
+        return rows
+
+    def _delete_claimed(self):
+        # 引き取った行は自分のジャーナルに書き写し済み
+        for path in self._claimed:
+            os.remove(path)
+        self._claimed = []
+
+    def close(self):
+        """
+        終了時に残りを書き切る。失敗した分はジャーナルに残り、次のワーカーが再送する
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=FLUSH_INTERVAL + 5)
+        self.flush_all()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+                if not self.pending:
+                    os.remove(self.journal_path)
+
+    # ---- 追加 ----
+
+    def _append(self, row: dict):
+        self._journal.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.pending.append(row)
+
+    def _sync_journal(self):
+        self._journal.flush()
+        if FSYNC:
+            os.fsync(self._journal.fileno())
+
+    def submit(self, row: dict):
+        """
+        ジャーナルに書いてから（FSYNC 時はディスクまで）バッファに積む
+        """
+        with self._lock:
+            self._append(row)
+            self._sync_journal()
+            size = len(self.pending)
+        if size >= MAX_BATCH:
+            self._wake.set()
+
+    def pending_for(self, user_id: str) -> List[dict]:
+        """
+        このワーカーで未書き込みの行（新しい順）
+        """
+        with self._lock:
+            return [r for r in reversed(self.pending) if r["user_id"] == user_id]
+
+    # ---- 書き込み ----
+
+    def flush(self) -> int:
+        """
+        先頭から最大 MAX_BATCH 件を1回の RPC で書き込み、書き込めた分をジャーナルから消す
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = self.pending[:MAX_BATCH]
+            if not batch:
+                return 0
+            with timed("write_behind_flush"):
+                supabase.rpc("apply_score_batch", {"p_rows": batch}).execute()
+            for user_id in {row["user_id"] for row in batch}:
+                mark_written(user_id)
+            with self._lock:
+                del self.pending[:len(batch)]
+                self._rewrite_journal()
+            return len(batch)
+
+    def _rewrite_journal(self):
+        # 残りだけを一時ファイルに書いて置き換える（途中で落ちても旧ジャーナルが残る）
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row in self.pending:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.flush()
+            if FSYNC:
+                os.fsync(f.fileno())
+        self._journal.close()
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def flush_all(self):
+        while True:
+            try:
+                if not self.flush():
+                    return
+            except Exception as e:
+                inc("external_errors_total", service="write_behind")
+                logging.error(f"❌ スコアの一括書き込みに失敗（{len(self.pending)} 件はジャーナルに保持）: {e}")
+                return
+
+    def _run(self):
+        backoff = FLUSH_INTERVAL
+        while not self._stop.is_set():
+            self._wake.wait(backoff)
+            self._wake.clear()
+            try:
+                while self.flush() == MAX_BATCH:
+                    pass
+                backoff = FLUSH_INTERVAL
+            except Exception as e:
+                inc("external_errors_total", service="write_behind")
+                inc("retries_total", service="write_behind")
+                backoff = min(MAX_BACKOFF, backoff * 2)
+                logging.warning(f"⚠️ スコアの一括書き込みに失敗、{backoff:.0f} 秒後に再試行: {e}")
+
+
+buffer = WriteBehindBuffer()
+_registered = set()
+
+
+def start():
+    buffer.start()
+
+def submit_score(user_id: str, user_name: str, score_row: dict):
+    """
+    handle_image のスコア行を積む（client_id が無ければ採番）。users の行は初回だけ作成を保証する（以降の更新は一括書き込み側）
+    """
+    if user_id not in _registered:
+        from utils.onboarding import register_user_if_absent
+        register_user_if_absent(user_id, user_name)
+        _registered.add(user_id)
+    buffer.submit({"client_id": str(uuid.uuid4()), **score_row, "user_id": user_id, "user_name": user_name})
+
+
+def build_user_stats_message(user_id: str) -> Optional[str]:
+    """
+    utils.stats.build_user_stats_message と同じ成績メッセージを、
+    DB の値にこのワーカーで未書き込みのスコアを足してローカルで計算する
+    """
+    from utils.stats import USER_STATS_COLUMNS, format_user_stats_message, _rank_of
+    from utils.leaderboard import leaderboard
+
+    # 先にバッファを見てから DB を読む（間に書き込まれた行は client_id で除く）
+    pending = buffer.pending_for(user_id)
+    resp = supabase.table("scores") \
+        .select("score, created_at, client_id") \
+        .eq("user_id", user_id) \
+        .order("created_at", desc=True) \
+        .limit(SCORE_EVAL_COUNT) \
+        .execute()
+    stored = resp.data or []
+    written = {s.get("client_id") for s in stored}
+    pending = [p for p in pending if p["client_id"] not in written]
+
+    score_list = [p["score"] for p in pending] + [s["score"] for s in stored if s.get("score") is not None]
+    score_list = score_list[:SCORE_EVAL_COUNT]
+    if not score_list:
+        return None
+
+    user_info = supabase.table("users") \
+        .select(USER_STATS_COLUMNS) \
+        .eq("id", user_id).maybe_single().execute()
+    user_data = dict((user_info.data if user_info else None) or {})
+    if pending:
+        # update_average_score と同じ規則（直近 SCORE_EVAL_COUNT 件の平均）
+        average = round(sum(score_list) / len(score_list), 3)
+        prediction = predict_next_rating(score_list)
+        user_data.update(
+            average_score=average,
+            average_rating=rating.get_rank(average),
+            next_up_score=prediction.get("next_up_score"),
+            next_down_score=prediction.get("next_down_score"),
+            score_count=(user_data.get("score_count") or 0) + len(pending),
+        )
+
+    leaderboard.maybe_sync()
+    return format_user_stats_message(score_list, user_data, _rank_of(user_id, user_data))